@@ -1,26 +1,46 @@
+import multiprocessing
+import signal
+import sys
 from threading import Thread
-from typing import List
+from typing import List, Tuple
 
-from flask import Flask, send_file
+from flask import Flask, jsonify, request, send_file
 from logzero import logger as log
 from redis import StrictRedis
+from telegram import Bot
 
 import settings
 from clients.facebook import FacebookClient
+from clients.httptransport import PooledHTTPTransport
+from clients.localnlu import create_fast_path_engine
+from clients.nlucache import CachingNLUEngine
 from clients.nluclients import DialogflowClient
+from clients.resilientnlu import CircuitBreaker, ResilientNLUEngine
 from clients.telegram import TelegramClient
 from clients.telegramsupport import TelegramSupportChannel
 from clients.voice import VoiceRecognitionClient
-from core import ChatAction
+from core import ChatAction, stats
+from core.admission import IngressQueue
+from core.choices import PendingChoices
+from core.coalescing import MessageCoalescer
 from core.context import ContextManager, States
+from core.delivery import DeliveryScheduler
 from core.dialogmanager import DialogManager
+from core.dispatcher import AsyncDispatcher, Lane
+from core.pipeline import StagedPipeline
 from core.recorder import ConversationRecorder
+from core.sharding import ShardRouter
+from core.timers import TimerQueue
+from core.writebehind import WriteBehindFlusher
 from corpus.media import get_file_by_media_id
+from corpus.responsetemplates import TemplateRenderer
+from logic.hotreload import HotReloader, install as install_reloader
 from logic.planning import PlanningAgent
 from logic.rules.dialogcontroller import application_router
+from server import PreforkServer
 
 
-def main():
+def create_app() -> Flask:
     app = Flask(__name__)
 
     @app.route('/ping', methods=['GET'])
@@ -33,6 +53,19 @@ def main():
         filepath = get_file_by_media_id(media_id)
         return send_file(filepath, mimetype=f'{mimetype}/{ext}')
 
+    @app.route('/stats', methods=['GET'])
+    def stats_endpoint():
+        return jsonify(stats.collect())
+
+    return app
+
+
+def create_bot(app: Flask, webhook_url=settings.APP_URL, test_mode=settings.DEBUG_MODE) -> DialogManager:
+    """
+    Initializes all clients and the `DialogManager` and starts listening for updates.
+    If `webhook_url` is None, no webhook is set and updates need to be fed in by calling `process_webhook_data` on
+    the clients.
+    """
     # Initialize redis cache
     redis = StrictRedis.from_url(settings.REDIS_URL)
 
@@ -46,9 +79,9 @@ def main():
     # Initialize bot api client for Telegram Messenger
     telegram_client = TelegramClient(
         app=app,
-        webhook_url=settings.APP_URL,
+        webhook_url=webhook_url,
         token=settings.TELEGRAM_ACCESS_TOKEN,
-        test_mode=settings.DEBUG_MODE
+        test_mode=test_mode
     )
     telegram_client.initialize()
 
@@ -65,9 +98,66 @@ def main():
     )
 
     # Initialize NLU and SLR clients
-    dialogflow_client = DialogflowClient(settings.DIALOGFLOW_ACCESS_TOKEN)
+    nlu_transport = PooledHTTPTransport(
+        settings.DIALOGFLOW_BASE_URL,
+        headers={'Authorization': f'Bearer {settings.DIALOGFLOW_ACCESS_TOKEN}'},
+        pool_size=settings.NLU_POOL_SIZE,
+        connect_timeout=settings.NLU_CONNECT_TIMEOUT,
+        read_timeout=settings.NLU_READ_TIMEOUT
+    )
+    stats.register('nlu_transport', nlu_transport.stats)
+    # Without the resilient engine (see below), errors of Dialogflow are understood as `fallback` by the client itself
+    nlu_client = DialogflowClient(
+        settings.DIALOGFLOW_ACCESS_TOKEN,
+        transport=nlu_transport,
+        raise_errors=settings.NLU_BUDGET_MS > 0
+    )
+    local_nlu = None
+    if settings.LOCAL_NLU:
+        nlu_client = create_fast_path_engine(nlu_client, threshold=settings.LOCAL_NLU_THRESHOLD)
+        local_nlu = nlu_client.local
+        stats.register('local_nlu', nlu_client.stats)
+    if settings.NLU_CACHE_SIZE > 0:
+        nlu_client = CachingNLUEngine(
+            nlu_client,
+            max_size=settings.NLU_CACHE_SIZE,
+            ttl=settings.NLU_CACHE_TTL,
+            redis=redis if settings.NLU_CACHE_REDIS else None
+        )
+        stats.register('nlu_cache', nlu_client.stats)
+    if settings.NLU_BUDGET_MS > 0:
+        # Outermost, so that cache hits are never hedged and fallback understandings are never cached
+        nlu_client = ResilientNLUEngine(
+            nlu_client,
+            fallback=local_nlu,
+            budget=settings.NLU_BUDGET_MS / 1000,
+            hedge_percentile=settings.NLU_HEDGE_PERCENTILE / 100,
+            breaker=CircuitBreaker(
+                error_rate=settings.NLU_BREAKER_ERROR_RATE / 100,
+                reset_timeout=settings.NLU_BREAKER_RESET_TIMEOUT
+            )
+        )
+        stats.register('nlu_resilience', nlu_client.stats)
     voice_client = VoiceRecognitionClient()
 
+    # Optionally process the turns of different users concurrently, each user with an ordered mailbox. Background and
+    # bulk work gets separate concurrency budgets, so that it does not delay the responses to customers.
+    dispatcher = None
+    if settings.ASYNC_DISPATCH:
+        dispatcher = AsyncDispatcher(
+            max_concurrency=settings.MAX_CONCURRENT_TURNS,
+            lane_budgets={
+                Lane.BACKGROUND: settings.MAX_CONCURRENT_BACKGROUND,
+                Lane.BULK: settings.MAX_CONCURRENT_BULK,
+            }
+        )
+        dispatcher.start()
+        stats.register('dispatcher', dispatcher.stats)
+
+    # Timers for writing state (context syncs, recordings) in the background, flushed when shutting down
+    sync_timers = TimerQueue(workers=2, name='Sync')
+    sync_timers.start()
+
     # Create recorder for all conversations with the bot. This will publish to the support channel from above if the
     # custom `publish_trigger` condition is met.
     conversation_recorder = None
@@ -81,23 +171,257 @@ def main():
         conversation_recorder = ConversationRecorder(
             telegram_client.bot,
             support_channel=support_client,
-            publish_trigger=publish_trigger
+            publish_trigger=publish_trigger,
+            timers=sync_timers,
+            dispatcher=dispatcher
         )
 
     # Initialize planning agent that holds the core logic of creating context-sensitive responses
     planning_agent = PlanningAgent(router=application_router)
 
+    # Optionally deliver the planned chat actions when they are due, without holding a thread while waiting
+    delivery = None
+    if settings.SCHEDULED_DELIVERY:
+        delivery_timers = TimerQueue(workers=settings.DELIVERY_WORKERS, name='Delivery')
+        delivery_timers.start()
+        delivery = DeliveryScheduler(delivery_timers)
+
+    # Optionally run the stages of a turn on separate thread pools, so that e.g. slow NLU requests do not hold up
+    # the planning of other turns
+    pipeline = None
+    if settings.PIPELINE_STAGES:
+        pipeline = StagedPipeline(
+            nlu_workers=settings.NLU_STAGE_WORKERS,
+            planning_workers=settings.PLANNING_STAGE_WORKERS,
+            delivery_workers=settings.DELIVERY_STAGE_WORKERS
+        )
+        stats.register('pipeline', pipeline.stats)
+
+    # Optionally merge rapid-fire text messages of a user into a single turn
+    coalescer = None
+    if settings.COALESCE_WINDOW_MS > 0:
+        coalescing_timers = TimerQueue(workers=2, name='Coalescing')
+        coalescing_timers.start()
+        coalescer = MessageCoalescer(coalescing_timers, window=settings.COALESCE_WINDOW_MS / 1000)
+        stats.register('coalescing', coalescer.stats)
+
+    # Understand presses of the buttons that we offered without a round trip to the NLU service
+    pending_choices = None
+    if settings.CHOICE_SHORTCUT:
+        pending_choices = PendingChoices(max_size=settings.CONTEXT_CACHE_SIZE or None,
+                                         ttl=settings.CONTEXT_IDLE_TIMEOUT or None)
+        stats.register('choices', pending_choices.stats)
+
+    # Optionally admit webhook updates through a bounded queue and shed load when it runs full
+    if settings.INGRESS_HIGH_WATERMARK > 0:
+        ingress = IngressQueue(
+            high_watermark=settings.INGRESS_HIGH_WATERMARK,
+            low_watermark=settings.INGRESS_LOW_WATERMARK,
+            shed_mode=settings.SHED_MODE,
+            backlog=(lambda: dispatcher.lane_pending(Lane.INTERACTIVE)) if dispatcher else None,
+            # As many as there are threads to receive the webhooks, so that a slow turn only holds up a few users
+            workers=settings.WEB_THREADS
+        )
+        ingress.start()
+        telegram_client.ingress = ingress
+        facebook_client.ingress = ingress
+        stats.register('ingress', ingress.stats)
+
     # Initialize dialog management collection that will steer the main control flow when users interact with the bots
-    DialogManager(
-        context_manager=ContextManager(initial_state=States.SMALLTALK, redis=redis),
+    # Changes of the contexts are written to redis in batches, at most every CONTEXT_FLUSH_INTERVAL_MS
+    context_flusher = WriteBehindFlusher(
+        redis,
+        sync_timers,
+        interval=settings.CONTEXT_FLUSH_INTERVAL_MS / 1000,
+        max_pending=settings.CONTEXT_FLUSH_BATCH_SIZE
+    )
+    stats.register('context_flush', context_flusher.stats)
+    context_manager = ContextManager(
+        initial_state=States.SMALLTALK,
+        redis=redis,
+        flusher=context_flusher,
+        max_size=settings.CONTEXT_CACHE_SIZE or None,
+        idle_timeout=settings.CONTEXT_IDLE_TIMEOUT or None
+    )
+    stats.register('contexts', context_manager.stats)
+    dialog_manager = DialogManager(
+        context_manager=context_manager,
         bot_clients=[telegram_client, facebook_client],
-        nlu_client=dialogflow_client,
+        nlu_client=nlu_client,
         planning_agent=planning_agent,
         recorder=conversation_recorder,
         voice_recognition_client=voice_client,
-        support_channel=support_client
+        support_channel=support_client,
+        dispatcher=dispatcher,
+        delivery=delivery,
+        coalescer=coalescer,
+        pipeline=pipeline,
+        pending_choices=pending_choices,
+        async_nlu=settings.ASYNC_NLU
     )
 
+    # Allow templates, questionnaires and rules to be reloaded between turns without restarting the process
+    reloader = HotReloader(application_router, dialog_manager.turn_gate, context_manager)
+    install_reloader(reloader)
+    stats.register('reload', reloader.stats)
+
+    return dialog_manager
+
+
+def create_app_and_bot() -> Tuple[Flask, DialogManager]:
+    app = create_app()
+    return app, create_bot(app)
+
+
+def warm_up(dialog_manager: DialogManager):
+    """
+    Establishes the connections and fills the caches that the first turn would otherwise have to wait for.
+    """
+    dialog_manager.context_manager.redis.ping()
+    for bot in dialog_manager.bots:
+        if bot.client_name == 'telegram':
+            # Opens the connection pool to the Bot API
+            bot.bot.get_me()
+    # Compiles the templates that the renderer itself depends on
+    TemplateRenderer({}).load_and_render('busy', safe=True)
+
+
+def serve_shard(shard_index: int, queue, dialog_manager: DialogManager):
+    """
+    Processes the webhook data routed to a shard in order until it receives `None`, then drains `dialog_manager`, so
+    that the turns it has received are finished and the buffered context writes and recordings are saved.
+    """
+    clients = {bot.client_name: bot for bot in dialog_manager.bots}
+
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        client_name, data = item
+        try:
+            clients[client_name].process_webhook_data(data)
+        except Exception as e:
+            log.error(f"Shard worker {shard_index} failed to process an update:")
+            log.exception(e)
+
+    log.info(f"Shard worker {shard_index} is shutting down, draining pending turns...")
+    dialog_manager.drain(timeout=settings.GRACEFUL_TIMEOUT)
+
+
+def run_shard_worker(shard_index: int, queue):
+    """
+    Entry point of a worker process in sharded mode. Processes the webhook data routed to this shard in order.
+    All contexts of the users routed to this shard live in this process and are backed by the shared redis.
+    """
+    # The front process stops the workers in order (see `run_sharded`), after the updates it has already routed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    log.info(f"Shard worker {shard_index} starting...")
+    dialog_manager = create_bot(Flask(__name__), webhook_url=None, test_mode=False)
+    serve_shard(shard_index, queue, dialog_manager)
+
+
+def create_sharded_front(router: ShardRouter) -> Flask:
+    """ Creates the app of the front process in sharded mode, which routes each webhook update to its shard """
+    app = create_app()
+
+    def telegram_webhook():
+        data = request.get_json()
+        router.route(TelegramClient.get_shard_key(data), ('telegram', data))
+        return 'OK'
+
+    def facebook_webhook():
+        for key, data in FacebookClient.split_webhook_data(request.get_json()):
+            router.route(key, ('facebook', data))
+        return 'ok'
+
+    app.add_url_rule(f"/{settings.TELEGRAM_ACCESS_TOKEN}", view_func=telegram_webhook, methods=['POST', 'GET'])
+    app.add_url_rule('/', 'index', FacebookClient.authenticate_webhook, methods=['GET'])
+    app.add_url_rule('/', 'request', facebook_webhook, methods=['POST'])
+    return app
+
+
+def run_sharded_front(router: ShardRouter):
+    """
+    Entry point of the front process in sharded mode. Serves the webhooks with `WEB_WORKERS` prefork workers, which
+    only route the updates and therefore keep no state of their own.
+    """
+    if settings.PREFORK_SERVER:
+        PreforkServer(
+            lambda: (create_sharded_front(router), None),
+            bind=f'0.0.0.0:{settings.PORT}',
+            workers=settings.WEB_WORKERS,
+            threads=settings.WEB_THREADS,
+            graceful_timeout=settings.GRACEFUL_TIMEOUT
+        ).run()
+    else:
+        create_sharded_front(router).run(host='0.0.0.0', port=settings.PORT)
+
+
+def run_sharded(num_workers: int):
+    """
+    Runs a front process that receives the webhooks and routes each update by its user to one of `num_workers`
+    worker processes.
+
+    This process only supervises the others: the front is a separate process (and not the parent of the workers), so
+    that the server it runs does not reap or signal the workers. When shutting down, the front is stopped first and
+    the workers are then drained after the updates that have been routed to them.
+    """
+    router = ShardRouter(num_workers, run_shard_worker)
+    router.start()
+
+    Bot(settings.TELEGRAM_ACCESS_TOKEN).set_webhook(settings.APP_URL + settings.TELEGRAM_ACCESS_TOKEN)
+    front = multiprocessing.Process(target=run_sharded_front, args=(router,), name='Front')
+    front.start()
+
+    def shutdown(_signum, _frame):
+        log.info("Shutting down, stopping the front and draining the shard workers...")
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    log.info(f"Listening with {settings.WEB_WORKERS} web workers and {num_workers} shard workers...")
+    try:
+        front.join()
+        log.error("The front process has exited.")
+    finally:
+        if front.is_alive():
+            # Lets the server finish the requests it has received
+            front.terminate()
+            front.join(settings.GRACEFUL_TIMEOUT)
+        router.stop(timeout=settings.GRACEFUL_TIMEOUT)
+
+
+def main():
+    if settings.SHARD_WORKERS > 1 and not settings.DEBUG_MODE:
+        return run_sharded(settings.SHARD_WORKERS)
+
+    if settings.WEB_WORKERS > 1 and settings.PREFORK_SERVER and not settings.DEBUG_MODE:
+        # Every worker would keep its own contexts and mailboxes, so the turns of a user would be split across them
+        raise ValueError("More than one web worker is only supported together with sharding (SHARD_WORKERS > 1).")
+
+    if settings.PREFORK_SERVER and not settings.DEBUG_MODE:
+        log.info(f"Listening with {settings.WEB_WORKERS} prefork workers...")
+        return PreforkServer(
+            create_app_and_bot,
+            warm_up=warm_up,
+            bind=f'0.0.0.0:{settings.PORT}',
+            workers=settings.WEB_WORKERS,
+            threads=settings.WEB_THREADS,
+            graceful_timeout=settings.GRACEFUL_TIMEOUT
+        ).run()
+
+    app, dialog_manager = create_app_and_bot()
+    telegram_client = next(x for x in dialog_manager.bots if x.client_name == 'telegram')
+
+    def shutdown(_signum, _frame):
+        log.info("Shutting down, draining pending turns...")
+        dialog_manager.drain(timeout=settings.GRACEFUL_TIMEOUT)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+
     # Actually start the application
     if settings.DEBUG_MODE:
         host = 'localhost'
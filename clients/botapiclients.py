@@ -12,6 +12,20 @@ class BotAPIClient(object, metaclass=ABCMeta):
     In order to add another bot platform to the system, inherit from this class and implement all methods accordingly.
     """
 
+    # Multiplier for the natural delays of `ChatActions` on this platform
+    delay_factor = 1.0
+
+    # Bounded queue that webhook updates are admitted to, if set (see `core.admission.IngressQueue`)
+    ingress = None
+
+    # Set while shutting down: webhook updates are refused, so that the platform delivers them again later
+    draining = False
+
+    @property
+    def pending(self) -> int:
+        """ Number of received updates that have not been handed to the update handlers yet """
+        return 0
+
     @property
     @abstractmethod
     def client_name(self) -> str: pass
@@ -80,3 +94,28 @@ class BotAPIClient(object, metaclass=ABCMeta):
         Performs a sequence of `ChatActions` planned by the `DialogManager`
         """
         pass
+
+    @abstractmethod
+    def perform_action(self, action: ChatAction, is_last: bool = True):
+        """
+        Sends a single `ChatAction` right away, without showing a typing notification or waiting for its delay.
+        `is_last` determines whether this is the last action of the planned sequence.
+        """
+        pass
+
+    @staticmethod
+    def render_busy_message() -> str:
+        """
+        Returns the message that is sent to users whose updates are shed under high load
+        """
+        from corpus.responsetemplates import TemplateRenderer
+        return TemplateRenderer({}).load_and_render('busy', safe=True)
+
+    def get_delay(self, action: ChatAction) -> float:
+        """
+        Returns the number of seconds to wait before the `action` is sent
+        """
+        if not action.delay:
+            return 0
+        delay = getattr(action.delay, 'value', action.delay)
+        return delay * self.delay_factor
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import datetime
+import json
 import os
 import shutil
 import time
-from typing import Callable, List
+from typing import Callable, List, Tuple
 
 import requests
 from fbmq import Event, Page, QuickReply
@@ -12,6 +13,7 @@ from logzero import logger as log
 
 from clients.botapiclients import BotAPIClient
 from core import ChatAction
+from core.admission import IngressQueue
 from corpus.emojis.emoji import remove_emoji
 from corpus.media import get_file_by_media_id
 from model import Update, User
@@ -22,6 +24,9 @@ class FacebookClient(BotAPIClient):
     Facebook Messenger Bot API client
     """
 
+    # Facebook bots are very slow, shorten delays
+    delay_factor = 0.3
+
     def __init__(self, app, token):
         self._app = app
         self._token = token
@@ -70,7 +75,7 @@ class FacebookClient(BotAPIClient):
         self._page.show_starting_button("START_BOT")
 
         # Add webhook handlers
-        self._app.add_url_rule('/', 'index', self._authentication, methods=['GET'])
+        self._app.add_url_rule('/', 'index', self.authenticate_webhook, methods=['GET'])
         self._app.add_url_rule('/', 'request', self._webhook, methods=['POST'])
 
         self._page.set_webhook_handler('message', self._message_handler)
@@ -91,37 +96,41 @@ class FacebookClient(BotAPIClient):
         and adding QuickReply buttons.
         """
         for action in actions:
-            try:
-                user_id = action.peer.facebook_id
-
-                if action.show_typing:
-                    self.show_typing(user_id)
-                if action.delay:
-                    delay = action.delay.value if isinstance(action.delay, ChatAction.Delay) else action.delay
-                    # Facebook bots are very slow, shorten timeout
-                    time.sleep(delay * 0.3)
-
-                quick_replies = None
-                if action.action_type == ChatAction.Type.ASKING_QUESTION:
-                    if action.choices:
-                        quick_replies = [
-                            QuickReply(
-                                title=remove_emoji(x),
-                                payload=f"test_{x}"
-                            ) for x in action.choices[:10]]
-                elif action.action_type == ChatAction.Type.SENDING_MEDIA:
-                    self.send_media(action.peer, action.media_id, caption=action.render())
-                    continue
-
-                self._page.send(
-                    recipient_id=user_id,
-                    message=action.render(remove_html=True),
-                    quick_replies=quick_replies)
-            finally:
-                self.end_typing(user_id)
+            if action.show_typing:
+                self.show_typing(action.peer)
+            delay = self.get_delay(action)
+            if delay:
+                time.sleep(delay)
+
+            self.perform_action(action)
+
+    def perform_action(self, action: ChatAction, is_last: bool = True):
+        """
+        Sends a single `ChatAction` and ends the typing notification.
+        """
+        user_id = action.peer.facebook_id
+        try:
+            quick_replies = None
+            if action.action_type == ChatAction.Type.ASKING_QUESTION:
+                if action.choices:
+                    quick_replies = [
+                        QuickReply(
+                            title=remove_emoji(x),
+                            payload=f"test_{x}"
+                        ) for x in action.choices[:10]]
+            elif action.action_type == ChatAction.Type.SENDING_MEDIA:
+                self.send_media(action.peer, action.media_id, caption=action.render())
+                return
+
+            self._page.send(
+                recipient_id=user_id,
+                message=action.render(remove_html=True),
+                quick_replies=quick_replies)
+        finally:
+            self.end_typing(user_id)
 
     @staticmethod
-    def _authentication():
+    def authenticate_webhook():
         """
         Authentication is done when the webhook is set up in the facebook developer console
         """
@@ -132,9 +141,60 @@ class FacebookClient(BotAPIClient):
         return ''
 
     def _webhook(self):
-        self._page.handle_webhook(request.get_data(as_text=True))
+        if self.draining:
+            return "shutting down", 503
+
+        data = request.get_data(as_text=True)
+        if self.ingress is None:
+            self._page.handle_webhook(data)
+            return "ok"
+
+        # Batched events of several senders are kept together and processed in order of the first sender
+        events = self.split_webhook_data(json.loads(data))
+        key = events[0][0] if events else None
+        if self.ingress.offer(self._page.handle_webhook, data, key=key):
+            return "ok"
+        return self._shed_webhook(data)
+
+    def _shed_webhook(self, data: str):
+        """
+        Answers a webhook that was not admitted, either by asking Facebook to retry later, or by sending a busy
+        message to the senders of its messages.
+        """
+        if self.ingress.shed_mode == IngressQueue.SHED_RETRY:
+            return "busy", 503
+
+        text = self.render_busy_message()
+        for _, payload in self.split_webhook_data(json.loads(data)):
+            messaging = payload['entry'][0]['messaging'][0]
+            if 'message' not in messaging or messaging['message'].get('is_echo'):
+                continue
+            try:
+                self._page.send(recipient_id=messaging['sender']['id'], message=text)
+            except Exception as e:
+                log.error(f"Sending busy message failed: {e}")
         return "ok"
 
+    def process_webhook_data(self, data: dict):
+        """
+        Handles the JSON body of a webhook request that was received by another process.
+        """
+        self._page.handle_webhook(json.dumps(data))
+
+    @staticmethod
+    def split_webhook_data(data: dict) -> List[Tuple[str, dict]]:
+        """
+        Splits a (possibly batched) webhook body into one body per messaging event, each together with a key
+        identifying the sender.
+        """
+        results = []
+        for entry in data.get('entry') or []:
+            for messaging in entry.get('messaging') or []:
+                sender_id = messaging.get('sender', {}).get('id')
+                single_entry = dict(entry, messaging=[messaging])
+                results.append((f"facebook:{sender_id}", dict(data, entry=[single_entry])))
+        return results
+
     def start_listening(self):
         pass  # Flask handles this automatically
 
@@ -198,9 +258,9 @@ class FacebookClient(BotAPIClient):
         #     #     self.send_message(peer, caption)
         #     # return msg
 
-    def show_typing(self, user_id):
+    def show_typing(self, user):
         try:
-            self._page.typing_on(user_id)
+            self._page.typing_on(user.facebook_id)
         except:
             log.error("Turning typing indication on failed.")
 
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from typing import Dict
+from urllib.parse import urljoin
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledHTTPTransport:
+    """
+    Sends JSON requests to a single web service over persistent keep-alive connections.
+
+    Blocking calls share a `requests.Session` whose connection pool holds up to `pool_size` connections, so
+    concurrent threads reuse connections instead of opening a new TLS connection per request. The `*_async`
+    coroutines share an `aiohttp.ClientSession` with the same limit, which is created on first use on the calling
+    event loop. Any number of them can be in flight on a single loop without occupying a thread each.
+    """
+
+    def __init__(self,
+                 base_url: str,
+                 headers: Dict[str, str] = None,
+                 pool_size: int = 16,
+                 connect_timeout: float = 3.0,
+                 read_timeout: float = 10.0):
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._async_session = None  # type: aiohttp.ClientSession
+        self._async_loop = None  # type: asyncio.AbstractEventLoop
+
+        self.requests = 0
+        self.failures = 0
+
+    def url(self, path: str) -> str:
+        return urljoin(self.base_url, path)
+
+    def request(self, method: str, path: str, payload: dict = None, params: dict = None) -> dict:
+        self.requests += 1
+        try:
+            response = self._session.request(method, self.url(path), json=payload, params=params,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            response.raise_for_status()
+            return response.json()
+        except Exception:
+            self.failures += 1
+            raise
+
+    def post(self, path: str, payload: dict, params: dict = None) -> dict:
+        return self.request('POST', path, payload, params)
+
+    async def request_async(self, method: str, path: str, payload: dict = None, params: dict = None) -> dict:
+        self.requests += 1
+        try:
+            async with self._get_async_session().request(method, self.url(path), json=payload,
+                                                         params=params) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except Exception:
+            self.failures += 1
+            raise
+
+    async def post_async(self, path: str, payload: dict, params: dict = None) -> dict:
+        return await self.request_async('POST', path, payload, params)
+
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        # Always called from a coroutine, so this is the running loop
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            if self._async_session is None or self._async_session.closed or self._async_loop is not loop:
+                self._async_loop = loop
+                self._async_session = aiohttp.ClientSession(
+                    headers=self.headers,
+                    connector=aiohttp.TCPConnector(limit=self.pool_size),
+                    timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+                )
+            return self._async_session
+
+    async def close_async(self):
+        if self._async_session is not None:
+            await self._async_session.close()
+
+    def close(self):
+        self._session.close()
+
+    def stats(self) -> dict:
+        return dict(requests=self.requests, failures=self.failures, pool_size=self.pool_size)
@@ -0,0 +1,230 @@
+import glob
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from logzero import logger as log
+
+import util
+from appglobals import ROOT_DIR
+from clients.nluclients import NLUEngine
+from core.choices import choice_intent
+from core.understanding import MessageUnderstanding
+from model import User
+
+# Recorded conversations that are used as training data
+RECORDING_GLOBS = (
+    os.path.join(ROOT_DIR, 'scripts', 'valid-recordings', '*.yml'),
+    os.path.join(ROOT_DIR, 'tmp', '*', 'recordings', '*.yml'),
+)
+
+
+class LocalNLUEngine(NLUEngine):
+    """
+    Lightweight intent classifier that runs in-process.
+
+    Messages are represented as TF-IDF weighted character n-grams and compared to the training examples by cosine
+    similarity. The intent of the most similar example is returned with the similarity as its `score`. `classify`
+    additionally returns the margin to the best example of any other intent, so that ambiguous inputs can be told
+    apart.
+
+    The engine does not extract any entity parameters.
+    """
+
+    _NON_WORD = re.compile(r'[^\w\s]+')
+    _WHITESPACE = re.compile(r'\s+')
+
+    def __init__(self, examples: Iterable[Tuple[str, str]], ngram_range: Tuple[int, int] = (2, 4)):
+        self.ngram_range = ngram_range
+        self._intents = []  # type: List[str]
+        self._index = defaultdict(list)  # type: Dict[str, List[Tuple[int, float]]]
+        self._idf = {}  # type: Dict[str, float]
+        self._fit(examples)
+
+    @property
+    def intents(self) -> Set[str]:
+        return set(self._intents)
+
+    def __len__(self):
+        return len(self._intents)
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        text = cls._NON_WORD.sub(' ', text.lower())
+        return cls._WHITESPACE.sub(' ', text).strip()
+
+    def _ngrams(self, text: str) -> Counter:
+        text = f' {self.normalize(text)} '
+        low, high = self.ngram_range
+        return Counter(text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1))
+
+    def _vectorize(self, counts: Counter) -> Dict[str, float]:
+        vector = {g: (1 + math.log(c)) * self._idf.get(g, 0.0) for g, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {g: w / norm for g, w in vector.items() if w} if norm else {}
+
+    def _fit(self, examples: Iterable[Tuple[str, str]]):
+        documents = []
+        seen = set()
+        for text, intent in examples:
+            key = (self.normalize(text), intent)
+            if not key[0] or key in seen:
+                continue
+            seen.add(key)
+            documents.append((self._ngrams(text), intent))
+
+        document_frequency = Counter(g for counts, _ in documents for g in counts)
+        n = len(documents)
+        self._idf = {g: math.log((1 + n) / (1 + df)) + 1 for g, df in document_frequency.items()}
+
+        for counts, intent in documents:
+            idx = len(self._intents)
+            self._intents.append(intent)
+            for gram, weight in self._vectorize(counts).items():
+                self._index[gram].append((idx, weight))
+
+    def classify(self, text: str) -> Tuple[Optional[str], float, float]:
+        """ Returns the best intent for `text`, its similarity score and the margin to the next best intent """
+        scores = defaultdict(float)
+        for gram, weight in self._vectorize(self._ngrams(text)).items():
+            for idx, example_weight in self._index.get(gram, ()):
+                scores[idx] += weight * example_weight
+        if not scores:
+            return None, 0.0, 0.0
+
+        best_per_intent = {}
+        for idx, score in scores.items():
+            intent = self._intents[idx]
+            if score > best_per_intent.get(intent, 0.0):
+                best_per_intent[intent] = score
+        ranking = sorted(best_per_intent.items(), key=lambda x: x[1], reverse=True)
+        intent, score = ranking[0]
+        runner_up = ranking[1][1] if len(ranking) > 1 else 0.0
+        return intent, min(score, 1.0), score - runner_up
+
+    def understand(self, text: str, session_id=None) -> MessageUnderstanding:
+        intent, score, _ = self.classify(text or '')
+        return MessageUnderstanding(text=text, intent=intent or 'fallback', parameters={}, score=score)
+
+    async def understand_async(self, text: str, session_id=None) -> MessageUnderstanding:
+        return self.understand(text, session_id)
+
+    def get_user_entities(self, user: User) -> List[str]:
+        return []
+
+
+class FastPathNLUEngine(NLUEngine):
+    """
+    Answers messages with the `local` engine if it is confident enough, and lets all other messages fall through to
+    the `remote` engine (e.g. Dialogflow).
+
+    A local prediction is only used if its intent is one of `allowed_intents`, its score reaches `threshold` and it
+    leads the next best intent by at least `min_margin`.
+    """
+
+    def __init__(self,
+                 local: LocalNLUEngine,
+                 remote: NLUEngine,
+                 threshold: float = 0.85,
+                 min_margin: float = 0.1,
+                 allowed_intents: Iterable[str] = None):
+        self.local = local
+        self.remote = remote
+        self.threshold = threshold
+        self.min_margin = min_margin
+        self.allowed_intents = set(allowed_intents) if allowed_intents is not None else None
+
+        self.local_hits = 0
+        self.fallthroughs = 0
+
+    def understand(self, text: str, session_id) -> MessageUnderstanding:
+        return self._understand_locally(text) or self.remote.understand(text, session_id)
+
+    async def understand_async(self, text: str, session_id) -> MessageUnderstanding:
+        return self._understand_locally(text) or await self.remote.understand_async(text, session_id)
+
+    def _understand_locally(self, text: str) -> Optional[MessageUnderstanding]:
+        if text and not text.startswith('/'):
+            intent, score, margin = self.local.classify(text)
+            if self._is_confident(intent, score, margin):
+                self.local_hits += 1
+                log.debug(f"Understood locally: {intent} ({score:.2f})")
+                return MessageUnderstanding(text=text, intent=intent, parameters={}, score=score)
+
+        self.fallthroughs += 1
+        return None
+
+    def _is_confident(self, intent: str, score: float, margin: float) -> bool:
+        if intent is None or score < self.threshold or margin < self.min_margin:
+            return False
+        return self.allowed_intents is None or intent in self.allowed_intents
+
+    def get_user_entities(self, user: User) -> List[str]:
+        return self.remote.get_user_entities(user)
+
+    def stats(self) -> dict:
+        return dict(
+            examples=len(self.local),
+            local_hits=self.local_hits,
+            fallthroughs=self.fallthroughs,
+        )
+
+
+def load_recorded_examples(patterns: Iterable[str] = RECORDING_GLOBS) -> List[Tuple[str, str]]:
+    """ Collects (text, intent) pairs from recorded conversations """
+    examples = []
+    for path in sorted(set(p for pattern in patterns for p in glob.glob(pattern))):
+        try:
+            entries = util.load_yaml_as_dict(path) or []
+        except Exception as e:
+            log.warning(f"Could not load recording {path}: {e}")
+            continue
+        for entry in entries:
+            text, intent = entry.get('user_says'), entry.get('intent')
+            if not text or not intent or intent == 'fallback' or text.startswith('/'):
+                continue
+            examples.append((text, intent))
+    return examples
+
+
+def load_choice_examples() -> List[Tuple[str, str]]:
+    """ Collects the labels of the keyboard buttons that we send (e.g. "Ja, gerne" for `yes`) """
+    from corpus.emojis.emoji import replace_aliases
+    from corpus.responsetemplates import all_response_templates
+
+    examples = []
+    for template_id, templates in all_response_templates.items():
+        intent = choice_intent(template_id)
+        if not intent:
+            continue
+        if not isinstance(templates, list):
+            templates = [templates]
+        examples.extend((replace_aliases(t.original_text), intent) for t in templates)
+    return examples
+
+
+def known_intents() -> Set[str]:
+    """ All intents that are referenced by name in `logic.intents` """
+    from logic import intents
+
+    result = set()
+    for value in vars(intents).values():
+        if isinstance(value, str):
+            result.add(value)
+        elif isinstance(value, list):
+            result.update(x for x in value if isinstance(x, str))
+    return result
+
+
+def create_fast_path_engine(remote: NLUEngine, threshold: float = 0.85) -> FastPathNLUEngine:
+    """
+    Trains a `LocalNLUEngine` on the recorded conversations and our own choice labels. Only the intents referenced in
+    `logic.intents` and those of the choice labels are answered locally.
+    """
+    choices = load_choice_examples()
+    local = LocalNLUEngine(load_recorded_examples() + choices)
+    allowed = known_intents() | {intent for _, intent in choices}
+    log.info(f"Trained local NLU on {len(local)} examples of {len(local.intents)} intents.")
+    return FastPathNLUEngine(local, remote, threshold=threshold, allowed_intents=allowed)
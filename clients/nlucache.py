@@ -0,0 +1,210 @@
+import copy
+import datetime
+import hashlib
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from logzero import logger as log
+from redis import StrictRedis
+
+from clients.nluclients import NLUEngine
+from core.understanding import MessageUnderstanding
+from model import User
+
+
+class _TTLCache:
+    """ Thread-safe LRU mapping whose entries expire after `ttl` seconds """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CachingNLUEngine(NLUEngine):
+    """
+    Caches the understandings of another `NLUEngine`, so that repeated inputs such as "ja", "nein", "weiter" or the
+    labels of our own keyboard buttons do not need a request to the NLU service.
+
+    Results are keyed on the normalized text and the names of the NLU contexts that were active in the session
+    before the message, as these influence the recognized intent. Entries are evicted by LRU and expire after `ttl`
+    seconds. If `redis` is given, it is used as a second level that is shared by all worker processes.
+
+    Understandings with date or time parameters are not cached: the service resolves relative expressions like
+    "morgen" to absolute dates, which would be wrong for a later message.
+    """
+
+    _WHITESPACE = re.compile(r'\s+')
+    _TRAILING_PUNCTUATION = re.compile(r'[\s.!?,;:]+$')
+    # Values of the date, time and period entities, e.g. "2018-05-02", "14:00:00" or "2018-05-01/2018-05-07"
+    _DATE_OR_TIME = re.compile(r'\d{4}-\d{2}-\d{2}|\d{2}:\d{2}(:\d{2})?(?!\d)')
+
+    def __init__(self,
+                 engine: NLUEngine,
+                 max_size: int = 10000,
+                 ttl: float = 600,
+                 redis: StrictRedis = None,
+                 key_prefix: str = 'nlu:'):
+        self.engine = engine
+        self.ttl = ttl
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self._cache = _TTLCache(max_size, ttl)
+        # Names of the NLU contexts that were active after the last message of each session
+        self._session_contexts = _TTLCache(max_size, ttl)
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        text = cls._WHITESPACE.sub(' ', text.strip().lower())
+        return cls._TRAILING_PUNCTUATION.sub('', text) or text
+
+    @classmethod
+    def cache_key(cls, text: str, context_names: Iterable[str] = None) -> str:
+        raw = cls.normalize(text) + '|' + ','.join(sorted(context_names or ()))
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def understand(self, text: str, session_id) -> MessageUnderstanding:
+        if not text:
+            return self.engine.understand(text, session_id)
+
+        key, cached = self._lookup_session(text, session_id)
+        if cached is None:
+            understanding = self.engine.understand(text, session_id)
+            self._store(key, understanding)
+        else:
+            understanding = self._from_cache(cached, text)
+        return self._remember_contexts(session_id, understanding)
+
+    async def understand_async(self, text: str, session_id) -> MessageUnderstanding:
+        if not text:
+            return await self.engine.understand_async(text, session_id)
+
+        key, cached = self._lookup_session(text, session_id)
+        if cached is None:
+            understanding = await self.engine.understand_async(text, session_id)
+            self._store(key, understanding)
+        else:
+            understanding = self._from_cache(cached, text)
+        return self._remember_contexts(session_id, understanding)
+
+    def _lookup_session(self, text: str, session_id) -> Tuple[str, Optional[MessageUnderstanding]]:
+        key = self.cache_key(text, self._session_contexts.get(session_id))
+        cached = self._lookup(key)
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, cached
+
+    @classmethod
+    def is_cacheable(cls, understanding: MessageUnderstanding) -> bool:
+        return not cls._has_date_or_time(understanding.parameters)
+
+    @classmethod
+    def _has_date_or_time(cls, value) -> bool:
+        if isinstance(value, str):
+            return cls._DATE_OR_TIME.match(value) is not None
+        if isinstance(value, dict):
+            return any(cls._has_date_or_time(v) for v in value.values())
+        if isinstance(value, (list, tuple)):
+            return any(cls._has_date_or_time(v) for v in value)
+        return False
+
+    @staticmethod
+    def _copy(understanding: MessageUnderstanding) -> MessageUnderstanding:
+        """ Copies `understanding` without sharing the parameters and contexts, which the turns may change """
+        result = copy.copy(understanding)
+        result.parameters = copy.deepcopy(understanding.parameters)
+        result.contexts = copy.deepcopy(understanding.contexts)
+        return result
+
+    @classmethod
+    def _from_cache(cls, cached: MessageUnderstanding, text: str) -> MessageUnderstanding:
+        understanding = cls._copy(cached)
+        understanding.text = text
+        # The memo of the cached instance belongs to a different turn
+        understanding.clear_extractions()
+        understanding.date = datetime.datetime.now()
+        return understanding
+
+    def _remember_contexts(self, session_id, understanding: MessageUnderstanding) -> MessageUnderstanding:
+        self._session_contexts.put(session_id, [c['name'] for c in understanding.contexts or () if 'name' in c])
+        return understanding
+
+    def get_user_entities(self, user: User):
+        return self.engine.get_user_entities(user)
+
+    def stats(self) -> dict:
+        return dict(
+            size=len(self._cache),
+            hits=self.hits,
+            redis_hits=self.redis_hits,
+            misses=self.misses,
+            evictions=self._cache.evictions,
+            expirations=self._cache.expirations,
+        )
+
+    def _lookup(self, key: str) -> Optional[MessageUnderstanding]:
+        understanding = self._cache.get(key)
+        if understanding is not None or self.redis is None:
+            return understanding
+
+        try:
+            data = self.redis.get(self.key_prefix + key)
+        except Exception as e:
+            log.warning(f"Reading from the NLU cache in redis failed: {e}")
+            return None
+        if data is None:
+            return None
+
+        understanding = pickle.loads(data)
+        self.redis_hits += 1
+        self._cache.put(key, understanding)
+        return understanding
+
+    def _store(self, key: str, understanding: MessageUnderstanding):
+        if not self.is_cacheable(understanding):
+            return
+        # A copy, as the turn goes on to memoize its extractions on the understanding and may change its parameters
+        self._cache.put(key, self._copy(understanding))
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(self.key_prefix + key, pickle.dumps(understanding), ex=int(self.ttl))
+        except Exception as e:
+            log.warning(f"Writing to the NLU cache in redis failed: {e}")
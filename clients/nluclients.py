@@ -1,46 +1,140 @@
+import asyncio
 import json
+import time
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from typing import List, TypeVar
+from typing import Iterable, Iterator, List, NamedTuple, Optional, TypeVar
 
+import aiohttp
 import apiai
+import requests
 from dateutil.parser import parse
+from logzero import logger as log
 
+from clients.httptransport import PooledHTTPTransport
 from core.understanding import MessageUnderstanding
 from model import User
 
 Update = TypeVar('Update')
 
 
+class BatchResult(NamedTuple):
+    text: str
+    understanding: Optional[MessageUnderstanding]
+    latency: float
+    error: Optional[Exception] = None
+
+
 class NLUEngine(metaclass=ABCMeta):
     @abstractmethod
-    def insert_understanding(self, update: Update) -> MessageUnderstanding: pass
+    def understand(self, text: str, session_id) -> MessageUnderstanding: pass
+
+    def insert_understanding(self, update: Update) -> MessageUnderstanding:
+        update.understanding = self.understand(update.message_text, update.user.id)
+        return update.understanding
+
+    async def understand_async(self, text: str, session_id) -> MessageUnderstanding:
+        # Engines without a non-blocking implementation occupy a thread of the loop's default executor
+        return await asyncio.get_event_loop().run_in_executor(None, self.understand, text, session_id)
+
+    async def insert_understanding_async(self, update: Update) -> MessageUnderstanding:
+        update.understanding = await self.understand_async(update.message_text, update.user.id)
+        return update.understanding
+
+    def understand_batch(self, texts: Iterable[str], parallelism: int = 8) -> Iterator[BatchResult]:
+        """
+        Understands a stream of utterances with up to `parallelism` requests in flight and yields the results in the
+        order of `texts`. Every utterance is understood in a session of its own, so that no contexts carry over.
+        """
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            in_flight = deque()
+            for i, text in enumerate(texts):
+                in_flight.append(executor.submit(self._understand_timed, text, f'batch-{i}'))
+                if len(in_flight) >= parallelism * 2:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def _understand_timed(self, text: str, session_id) -> BatchResult:
+        started = time.monotonic()
+        try:
+            understanding = self.understand(text, session_id)
+        except Exception as e:
+            return BatchResult(text, None, time.monotonic() - started, e)
+        return BatchResult(text, understanding, time.monotonic() - started)
 
     @abstractmethod
     def get_user_entities(self, user: User) -> List[str]: pass
 
 
 class DialogflowClient(NLUEngine):
-    def __init__(self, token):
+    """
+    Understands messages with the Dialogflow (formerly api.ai) V1 query API. Requests go through a
+    `PooledHTTPTransport`, so connections are kept alive and reused by all turns, and `understand_async` does not
+    block a thread while waiting for the response.
+
+    If Dialogflow answers with an error status, the message is understood as `fallback`. With `raise_errors`, the
+    error is raised instead, so that e.g. a `ResilientNLUEngine` can count the failure and fall back by itself.
+    """
+
+    BASE_URL = 'https://api.api.ai/v1/'
+    API_VERSION = '20150910'
+
+    # Raised by the transport for error statuses
+    STATUS_ERRORS = (requests.HTTPError, aiohttp.ClientResponseError)
+
+    def __init__(self, token, transport: PooledHTTPTransport = None, lang: str = 'de', base_url: str = BASE_URL,
+                 raise_errors: bool = False):
         self.ai = apiai.ApiAI(token)
+        self.lang = lang
+        self.raise_errors = raise_errors
+        self.transport = transport or PooledHTTPTransport(
+            base_url,
+            headers={'Authorization': f'Bearer {token}'}
+        )
+
+    def _query(self, text, session_id) -> dict:
+        return {
+            'query': text,
+            'lang': self.lang,
+            'sessionId': session_id,
+            'timezone': time.strftime("%z", time.gmtime()),
+        }
 
     def perform_nlu(self, text, user_id):
-        request = self.ai.text_request()
+        response = self.transport.post('query', self._query(text, user_id), params={'v': self.API_VERSION})
+        return response.get('result'), parse(response['timestamp'])
 
-        request.lang = 'de'
-        request.session_id = user_id
-        request.query = text
+    async def perform_nlu_async(self, text, user_id):
+        response = await self.transport.post_async('query', self._query(text, user_id),
+                                                   params={'v': self.API_VERSION})
+        return response.get('result'), parse(response['timestamp'])
 
-        response = json.loads(request.getresponse().read())
+    def understand(self, text, session_id) -> MessageUnderstanding:
+        try:
+            return self._to_understanding(text, *self.perform_nlu(text, session_id))
+        except self.STATUS_ERRORS as e:
+            return self._failed(text, e)
 
-        return response.get('result'), parse(response['timestamp'])
+    async def understand_async(self, text, session_id) -> MessageUnderstanding:
+        try:
+            return self._to_understanding(text, *await self.perform_nlu_async(text, session_id))
+        except self.STATUS_ERRORS as e:
+            return self._failed(text, e)
 
-    def insert_understanding(self, update) -> MessageUnderstanding:
-        result_obj, timestamp = self.perform_nlu(update.message_text, update.user.id)
+    def _failed(self, text, error: Exception) -> MessageUnderstanding:
+        if self.raise_errors:
+            raise error
+        log.error(f"Dialogflow answered with an error, not understanding the message: {error}")
+        return self._to_understanding(text, None, None)
 
+    @staticmethod
+    def _to_understanding(text, result_obj, timestamp) -> MessageUnderstanding:
         try:
-            nlu = MessageUnderstanding(
-                text=update.message_text,
+            return MessageUnderstanding(
+                text=text,
                 intent=result_obj['metadata']['intentName'],
                 parameters=result_obj['parameters'],
                 contexts=result_obj.get('contexts'),
@@ -48,8 +142,8 @@ class DialogflowClient(NLUEngine):
                 date=timestamp
             )
         except (KeyError, TypeError):
-            nlu = MessageUnderstanding(
-                text=update.message_text,
+            return MessageUnderstanding(
+                text=text,
                 intent='fallback',
                 parameters={},
                 contexts=None,
@@ -57,9 +151,6 @@ class DialogflowClient(NLUEngine):
                 date=timestamp
             )
 
-        update.understanding = nlu
-        return nlu
-
     def get_user_entities(self, user):
         request = self.ai.user_entities_request()
 
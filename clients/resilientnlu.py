@@ -0,0 +1,245 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from enum import Enum
+from typing import List
+
+from logzero import logger as log
+
+from clients.nluclients import NLUEngine
+from core.understanding import MessageUnderstanding
+from model import User
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for `reset_timeout` seconds once the share of failures among the last `window`
+    calls reaches `error_rate` (and at least `min_calls` have been made). Afterwards, a single trial call is let
+    through: if it succeeds, the circuit is closed again, otherwise it stays open for another `reset_timeout`.
+    """
+
+    class State(Enum):
+        CLOSED = 'closed'
+        OPEN = 'open'
+        HALF_OPEN = 'half_open'
+
+    def __init__(self, error_rate: float = 0.5, window: int = 20, min_calls: int = 10, reset_timeout: float = 30):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._state = self.State.CLOSED
+        self._opened_at = 0.0
+        self.trips = 0
+
+    @property
+    def state(self) -> State:
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.State.CLOSED:
+                return True
+            if self._state == self.State.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let a single trial call through
+                self._state = self.State.HALF_OPEN
+                return True
+            return False
+
+    def record(self, success: bool):
+        with self._lock:
+            if self._state == self.State.HALF_OPEN:
+                if success:
+                    self._state = self.State.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._trip()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate:
+                self._trip()
+
+    def _trip(self):
+        if self._state != self.State.OPEN:
+            self.trips += 1
+            log.warning(f"Circuit opened, failing fast for {self.reset_timeout} seconds.")
+        self._state = self.State.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+
+class ResilientNLUEngine(NLUEngine):
+    """
+    Bounds the time a turn waits for its understanding to `budget` seconds.
+
+    If the request to the wrapped `engine` has not returned after the `hedge_percentile` of recent request latencies,
+    a second, hedged request is sent and whichever answers first is used. The hedge is also sent right away if the
+    first request fails. If no request succeeds within the budget, or while the `CircuitBreaker` is open because too
+    many turns failed, the message is understood by the `fallback` engine instead (by default, as `fallback` intent).
+
+    Requests that are abandoned keep running in the background, so that e.g. a cache behind this engine still learns
+    their result. Note that a hedged request is a second query in the same Dialogflow session, so it may use up
+    the lifespan of a context once more.
+    """
+
+    # Number of latency samples before the percentile is trusted, and the number of samples kept
+    MIN_SAMPLES = 20
+    MAX_SAMPLES = 200
+
+    def __init__(self,
+                 engine: NLUEngine,
+                 fallback: NLUEngine = None,
+                 budget: float = 2.5,
+                 hedge_percentile: float = 0.95,
+                 min_hedge_delay: float = 0.05,
+                 breaker: CircuitBreaker = None,
+                 workers: int = 16):
+        self.engine = engine
+        self.fallback = fallback
+        self.budget = budget
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._latencies = deque(maxlen=self.MAX_SAMPLES)
+
+        self.hedges = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.fallbacks = 0
+
+    def hedge_delay(self) -> float:
+        """ Seconds after which a request is hedged """
+        latencies = sorted(self._latencies)
+        if len(latencies) < self.MIN_SAMPLES:
+            return self.budget / 2
+        percentile = latencies[min(int(len(latencies) * self.hedge_percentile), len(latencies) - 1)]
+        return min(max(percentile, self.min_hedge_delay), self.budget)
+
+    @property
+    def hedging(self) -> bool:
+        return bool(self.hedge_percentile)
+
+    def understand(self, text: str, session_id) -> MessageUnderstanding:
+        if not text or not self.breaker.allow():
+            return self._fall_back(text, session_id)
+
+        started = time.monotonic()
+        deadline = started + self.budget
+        hedge_at = started + self.hedge_delay()
+        pending = {self._executor.submit(self._timed, self.engine.understand, text, session_id)}
+        hedged = not self.hedging
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake_up = deadline if hedged else min(hedge_at, deadline)
+            done, pending = wait(pending, timeout=wake_up - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.breaker.record(True)
+                    return future.result()
+                self._request_failed(future.exception())
+            if not hedged and (done or time.monotonic() >= hedge_at):
+                hedged = True
+                self.hedges += 1
+                pending.add(self._executor.submit(self._timed, self.engine.understand, text, session_id))
+
+        return self._turn_failed(text, session_id, timed_out=bool(pending))
+
+    async def understand_async(self, text: str, session_id) -> MessageUnderstanding:
+        if not text or not self.breaker.allow():
+            return await self._fall_back_async(text, session_id)
+
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        deadline = started + self.budget
+        hedge_at = started + self.hedge_delay()
+        pending = {self._start_async(text, session_id)}
+        hedged = not self.hedging
+
+        while pending:
+            now = loop.time()
+            if now >= deadline:
+                break
+            wake_up = deadline if hedged else min(hedge_at, deadline)
+            done, pending = await asyncio.wait(pending, timeout=wake_up - now, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    self.breaker.record(True)
+                    return task.result()
+                self._request_failed(task.exception())
+            if not hedged and (done or loop.time() >= hedge_at):
+                hedged = True
+                self.hedges += 1
+                pending.add(self._start_async(text, session_id))
+
+        return await self._turn_failed_async(text, session_id, timed_out=bool(pending))
+
+    def get_user_entities(self, user: User) -> List[str]:
+        return self.engine.get_user_entities(user)
+
+    def stats(self) -> dict:
+        return dict(
+            circuit=self.breaker.state.value,
+            trips=self.breaker.trips,
+            hedge_delay=round(self.hedge_delay(), 3),
+            hedges=self.hedges,
+            timeouts=self.timeouts,
+            errors=self.errors,
+            fallbacks=self.fallbacks,
+        )
+
+    def _timed(self, understand, text: str, session_id) -> MessageUnderstanding:
+        started = time.monotonic()
+        result = understand(text, session_id)
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    def _start_async(self, text: str, session_id) -> asyncio.Task:
+        async def timed():
+            started = time.monotonic()
+            result = await self.engine.understand_async(text, session_id)
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+        task = asyncio.ensure_future(timed())
+        # Abandoned requests must not log "exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def _request_failed(self, error: BaseException):
+        self.errors += 1
+        log.warning(f"NLU request failed: {error!r}")
+
+    def _record_failure(self, timed_out: bool):
+        if timed_out:
+            self.timeouts += 1
+            log.warning(f"NLU did not answer within {self.budget} seconds.")
+        self.breaker.record(False)
+
+    def _turn_failed(self, text: str, session_id, timed_out: bool) -> MessageUnderstanding:
+        self._record_failure(timed_out)
+        return self._fall_back(text, session_id)
+
+    async def _turn_failed_async(self, text: str, session_id, timed_out: bool) -> MessageUnderstanding:
+        self._record_failure(timed_out)
+        return await self._fall_back_async(text, session_id)
+
+    def _fall_back(self, text: str, session_id) -> MessageUnderstanding:
+        self.fallbacks += 1
+        if self.fallback is None:
+            return MessageUnderstanding(text=text, intent='fallback', parameters={}, score=0)
+        return self.fallback.understand(text, session_id)
+
+    async def _fall_back_async(self, text: str, session_id) -> MessageUnderstanding:
+        self.fallbacks += 1
+        if self.fallback is None:
+            return MessageUnderstanding(text=text, intent='fallback', parameters={}, score=0)
+        return await self.fallback.understand_async(text, session_id)
@@ -63,6 +63,9 @@ class SMSClient(BotAPIClient):
 
         print(message.sid)
 
+    def perform_action(self, action: ChatAction, is_last: bool = True):
+        self.perform_actions([action])
+
     def add_voice_handler(self, callback):
         pass
 
@@ -7,7 +7,7 @@ from typing import Callable, List
 
 import logzero
 import telegram
-from flask import Flask, request
+from flask import Flask, jsonify, request
 from logzero import logger as log
 from telegram import *
 from telegram import ChatAction as TelegramChatAction, Update as TelegramUpdate
@@ -17,6 +17,7 @@ import settings
 import util
 from clients.botapiclients import BotAPIClient
 from core import ChatAction
+from core.admission import IngressQueue
 from corpus.media import get_file_by_media_id
 from model import User
 from model.update import Update
@@ -87,32 +88,40 @@ class TelegramClient(BotAPIClient):
         """
         for i, action in enumerate(actions):
             if action.show_typing:
-                self.bot.send_chat_action(action.peer.telegram_id, TelegramChatAction.TYPING, timeout=20)
-            if action.delay:
-                time.sleep(action.delay.value if isinstance(action.delay, ChatAction.Delay) else action.delay)
-
-            markup = None
-            if action.action_type == ChatAction.Type.ASKING_QUESTION:
-                if action.choices:
-                    buttons = [KeyboardButton(x) for x in action.choices]
-                    markup = ReplyKeyboardMarkup(util.build_menu(buttons, 3),
-                                                 resize_keyboard=True,
-                                                 one_time_keyboard=True,
-                                                 selective=True)
+                self.show_typing(action.peer)
+            delay = self.get_delay(action)
+            if delay:
+                time.sleep(delay)
+
+            self.perform_action(action, is_last=i == len(actions) - 1)
+
+    def perform_action(self, action: ChatAction, is_last: bool = True):
+        """
+        Sends a single `ChatAction`. A question without choices that is the last action of its sequence forces a
+        reply, any other question removes the reply keyboard.
+        """
+        markup = None
+        if action.action_type == ChatAction.Type.ASKING_QUESTION:
+            if action.choices:
+                buttons = [KeyboardButton(x) for x in action.choices]
+                markup = ReplyKeyboardMarkup(util.build_menu(buttons, 3),
+                                             resize_keyboard=True,
+                                             one_time_keyboard=True,
+                                             selective=True)
+            else:
+                if not is_last:
+                    markup = ReplyKeyboardRemove()
                 else:
-                    if i < len(actions) - 1:
-                        markup = ReplyKeyboardRemove()
-                    else:
-                        markup = ForceReply()
-            elif action.action_type == ChatAction.Type.SENDING_MEDIA:
-                self.send_media(action.peer, action.media_id, action.render())
-                continue
+                    markup = ForceReply()
+        elif action.action_type == ChatAction.Type.SENDING_MEDIA:
+            self.send_media(action.peer, action.media_id, action.render())
+            return
 
-            if markup is None and settings.ALWAYS_REMOVE_MARKUP:
-                markup = ReplyKeyboardRemove()
+        if markup is None and settings.ALWAYS_REMOVE_MARKUP:
+            markup = ReplyKeyboardRemove()
 
-            text = action.render()
-            self.send_message(peer=action.peer, text=text, markup=markup)
+        text = action.render()
+        self.send_message(peer=action.peer, text=text, markup=markup)
 
     def _init_thread(self, target, *args, **kwargs):
         thr = Thread(target=target, args=args, kwargs=kwargs)
@@ -123,12 +132,51 @@ class TelegramClient(BotAPIClient):
         self.updater = Updater(token=self._token, request_kwargs={'read_timeout': 10, 'connect_timeout': 7})
         self.bot = self.updater.bot
 
+    @property
+    def pending(self) -> int:
+        return self.updater.update_queue.qsize()
+
     def _webhook_endpoint(self):
+        if self.draining:
+            return 'Shutting down', 503
+
         data = request.get_json()
+        if self.ingress is None:
+            self.process_webhook_data(data)
+            return 'OK'
+
+        update = TelegramUpdate.de_json(data, self.updater.bot)
+        if self.ingress.offer(self.updater.dispatcher.process_update, update, key=self.get_shard_key(data)):
+            return 'OK'
+        return self._shed_update(update)
+
+    def _shed_update(self, update: TelegramUpdate):
+        """
+        Answers an update that was not admitted, either by asking Telegram to retry later, or with a busy message that
+        is sent as the webhook response (no extra request needed).
+        """
+        if self.ingress.shed_mode == IngressQueue.SHED_RETRY or update.effective_chat is None:
+            return 'Busy', 503
+        return jsonify(method='sendMessage', chat_id=update.effective_chat.id, text=self.render_busy_message())
+
+    def process_webhook_data(self, data: dict):
+        """
+        Feeds the JSON body of a webhook request into the update queue.
+        """
         update = TelegramUpdate.de_json(data, self.updater.bot)
         self.updater.update_queue.put(update)
 
-        return 'OK'
+    @staticmethod
+    def get_shard_key(data: dict) -> str:
+        """
+        Returns a key identifying the user of a raw webhook update, without deserializing the update.
+        """
+        for value in data.values():
+            if isinstance(value, dict):
+                sender = value.get('from') or value.get('chat')
+                if sender:
+                    return f"telegram:{sender['id']}"
+        return f"telegram:{data.get('update_id')}"
 
     def start_listening(self):
         # Start ptb threads
@@ -139,6 +187,10 @@ class TelegramClient(BotAPIClient):
             self.updater.start_polling()
             return
 
+        if self._webhook_url is None:
+            # Updates are received by another process and fed in through `process_webhook_data`
+            return
+
         # Construct URL and set webhook
         url = self._webhook_url + self._token
         self.bot.set_webhook(url)
@@ -216,7 +268,7 @@ class TelegramClient(BotAPIClient):
             return msg
 
     def show_typing(self, user):
-        self.bot.send_chat_action(user.telegram_id, TelegramChatAction.TYPING)
+        self.bot.send_chat_action(user.telegram_id, TelegramChatAction.TYPING, timeout=20)
 
     def add_error_handler(self, callback: Callable):
         self.updater.dispatcher.add_error_handler(callback)
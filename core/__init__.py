@@ -2,6 +2,7 @@ from core.chataction import ChatAction
 from core.context import ContextManager, Context, States
 from core.understanding import MessageUnderstanding
 from core.dialogmanager import DialogManager, ForceReevaluation, StopPropagation
+from core.dispatcher import AsyncDispatcher, Lane
 from core.dialogstates import INFINITE_LIFETIME, DialogStates
 from core.handover import HumanHandover
 from core.planningagent import IPlanningAgent
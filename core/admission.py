@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from typing import Callable, Hashable, List
+
+from logzero import logger as log
+
+
+class IngressQueue:
+    """
+    Bounded queue between the webhook endpoints and the processing of updates.
+
+    Admission is controlled by two watermarks: once the number of queued and in-progress updates reaches the
+    `high_watermark`, new updates are shed until the depth has fallen to the `low_watermark` again. Shed updates are
+    answered according to `shed_mode`, either with a fast "busy" reply (`SHED_REPLY`) or by asking the platform to
+    deliver the update again later (`SHED_RETRY`).
+
+    Updates are processed by `workers` threads. All updates offered with the same `key` (e.g. of the same user) go to
+    the same worker and are processed in the order they were admitted, so a slow turn only holds up the users that
+    share its worker. Work that is queued further down the line (e.g. in the mailboxes of an `AsyncDispatcher`) can be
+    counted towards the depth through `backlog`.
+    """
+
+    SHED_REPLY = 'reply'
+    SHED_RETRY = 'retry'
+
+    def __init__(self,
+                 high_watermark: int,
+                 low_watermark: int = None,
+                 shed_mode: str = SHED_REPLY,
+                 backlog: Callable[[], int] = None,
+                 workers: int = 1,
+                 name: str = 'Ingress'):
+        if workers < 1:
+            raise ValueError("The ingress queue needs at least one worker.")
+        if low_watermark is None:
+            low_watermark = high_watermark // 2
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("The low watermark must be lower than the high watermark.")
+        if shed_mode not in (self.SHED_REPLY, self.SHED_RETRY):
+            raise ValueError(f"Unknown shed mode: {shed_mode}")
+
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.shed_mode = shed_mode
+        self.name = name
+        self._backlog = backlog
+
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._in_progress = 0
+        self._shedding = False
+        self._threads = []  # type: List[threading.Thread]
+
+        self.accepted = 0
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        """ Number of admitted updates that have not been processed yet """
+        depth = sum(q.qsize() for q in self._queues) + self._in_progress
+        if self._backlog:
+            depth += self._backlog()
+        return depth
+
+    @property
+    def shedding(self) -> bool:
+        return self._shedding
+
+    def start(self):
+        if self._threads:
+            return
+        for index, worker_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(worker_queue,), name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        if not self._threads:
+            return
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+    def offer(self, func: Callable, *args, key: Hashable = None) -> bool:
+        """
+        Tries to admit a call to `func` with `args`, to be processed after the calls that have been admitted with the
+        same `key`. Returns False if the update has been shed.
+        """
+        with self._lock:
+            depth = self.depth
+            if self._shedding and depth <= self.low_watermark:
+                self._shedding = False
+                log.info(f"{self.name} queue is down to {depth}, accepting updates again.")
+            elif not self._shedding and depth >= self.high_watermark:
+                self._shedding = True
+                log.warning(f"{self.name} queue reached {depth}, shedding load.")
+
+            if self._shedding:
+                self.dropped += 1
+                return False
+
+            self.accepted += 1
+            self._queues[hash(key) % len(self._queues)].put((func, args))
+        return True
+
+    def stats(self) -> dict:
+        return dict(
+            depth=self.depth,
+            accepted=self.accepted,
+            dropped=self.dropped,
+            shedding=self._shedding,
+            high_watermark=self.high_watermark,
+            low_watermark=self.low_watermark,
+            workers=len(self._queues),
+        )
+
+    def _run(self, worker_queue: queue.Queue):
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                break
+            func, args = item
+            with self._lock:
+                self._in_progress += 1
+            try:
+                func(*args)
+            except Exception as e:
+                log.error(f"Error while processing an update from the {self.name} queue:")
+                log.exception(e)
+            finally:
+                with self._lock:
+                    self._in_progress -= 1
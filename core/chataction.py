@@ -2,7 +2,7 @@ import datetime
 import re
 from enum import Enum
 from pprint import pprint
-from typing import List
+from typing import Dict, List
 
 from model import User
 
@@ -33,11 +33,14 @@ class ChatAction:
                  intents: List[str] = None,
                  media_id: str = None,
                  choices: List = None,
+                 choice_intents: Dict[str, str] = None,
                  show_typing: bool = True,
                  delay: Delay = Delay.MEDIUM):
         self.action_type = action_type
         self.intents = intents
         self.choices = choices
+        # Rendered choices that stand for an intent, e.g. {"Ja, gerne": "yes"}
+        self.choice_intents = choice_intents or {}
         self.text_parts = [text]
         self.media_id = media_id
         self.peer = peer
@@ -45,6 +48,11 @@ class ChatAction:
         self.delay = delay
         self.date = datetime.datetime.now()
 
+    def __setstate__(self, state):
+        # Actions pickled by older versions have no `choice_intents`
+        state.setdefault('choice_intents', {})
+        self.__dict__.update(state)
+
     def render(self, remove_html=False) -> str:
         text = self.__str__()
 
@@ -0,0 +1,96 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from core.chataction import ChatAction
+from core.understanding import MessageUnderstanding
+from model import Update
+
+# Ids of choice templates that stand for an intent, e.g. `affirm_yes` for `yes` or `negate_wrong` for `wrong`
+CHOICE_ID_PATTERN = re.compile(r'^(?:affirm|negate)_(.+)$')
+
+
+def choice_intent(choice_id: str) -> Optional[str]:
+    """ Returns the intent that is encoded in the id of a choice template, or None """
+    match = CHOICE_ID_PATTERN.match(choice_id)
+    return match.group(1) if match else None
+
+
+class PendingChoices:
+    """
+    Remembers the choices that the last response offered to each user, so that a tap on one of the buttons can be
+    understood without asking the NLU engine.
+
+    The buttons come back as the plain text of their label (on Facebook without emojis), so labels are compared
+    after removing punctuation, symbols and case.
+
+    Like the contexts (see `core.context.ContextManager`), the choices of at most `max_size` users are kept, and
+    choices that are older than `ttl` seconds are dropped. The least recently offered choices are dropped first.
+    """
+
+    _NON_WORD = re.compile(r'[^\w\s]+')
+    _WHITESPACE = re.compile(r'\s+')
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # Normalized labels mapped to their intent and the time they were offered, least recently offered first
+        self._choices = OrderedDict()  # type: Dict[int, Tuple[Dict[str, str], float]]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        text = cls._NON_WORD.sub(' ', text.lower())
+        return cls._WHITESPACE.sub(' ', text).strip()
+
+    def remember(self, user_id: int, actions: List[ChatAction]):
+        """ Replaces the pending choices of the user with those of the `actions` that are about to be sent """
+        choices = {}
+        for action in actions:
+            if action.choices and action.choice_intents:
+                choices = {self.normalize(label): intent for label, intent in action.choice_intents.items()}
+        now = time.monotonic()
+        with self._lock:
+            self._choices.pop(user_id, None)
+            if choices:
+                self._choices[user_id] = (choices, now)
+            self._evict(now)
+
+    def _expired(self, offered: float, now: float) -> bool:
+        return bool(self.ttl) and now - offered > self.ttl
+
+    def _evict(self, now: float):
+        while self._choices:
+            user_id, (_, offered) = next(iter(self._choices.items()))
+            if not (self.max_size and len(self._choices) > self.max_size) and not self._expired(offered, now):
+                break
+            del self._choices[user_id]
+            self.evictions += 1
+
+    def match(self, update: Update) -> Optional[MessageUnderstanding]:
+        """ Returns the understanding of the update if its text is the label of one of the pending choices """
+        if not update.message_text:
+            return None
+        with self._lock:
+            choices, offered = self._choices.get(update.user.id, (None, 0.0))
+        if not choices or self._expired(offered, time.monotonic()):
+            return None
+
+        intent = choices.get(self.normalize(update.message_text))
+        if intent is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return MessageUnderstanding(update.message_text, intent, score=1.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            users = len(self._choices)
+        return dict(users=users, hits=self.hits, misses=self.misses, evictions=self.evictions)
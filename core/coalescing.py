@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from clients.botapiclients import BotAPIClient
+from core.timers import Timer, TimerQueue
+from model import Update
+
+
+class _Burst:
+    __slots__ = ('bot', 'callback', 'updates', 'started', 'timer')
+
+    def __init__(self, bot: BotAPIClient, callback: Callable):
+        self.bot = bot
+        self.callback = callback
+        self.updates = []  # type: List[Update]
+        self.started = time.monotonic()
+        self.timer = None  # type: Timer
+
+
+class MessageCoalescer:
+    """
+    Debounces rapid-fire text messages of a user ("hi", "my phone", "is broken") into a single turn.
+
+    Every added update (re)starts a `window` for its user. When the window elapses without another message,
+    `callback(bot, update, swallowed)` is called once with the last update, whose `message_text` has been set to the
+    merged text of the burst, and the list of earlier updates that were merged into it. A burst is never held back
+    for longer than `max_delay` after its first message.
+    """
+
+    def __init__(self, timers: TimerQueue, window: float, max_delay: float = None):
+        self._timers = timers
+        self.window = window
+        self.max_delay = window * 3 if max_delay is None else max_delay
+        self._lock = threading.Lock()
+        self._bursts = {}  # type: Dict[Tuple[str, int], _Burst]
+
+        self.turns = 0
+        self.merged = 0
+
+    @staticmethod
+    def _key(bot: BotAPIClient, update: Update):
+        return bot.client_name, update.user.id
+
+    @property
+    def pending(self) -> int:
+        """ Number of updates that are waiting for their window to elapse """
+        with self._lock:
+            return sum(len(b.updates) for b in self._bursts.values())
+
+    def add(self, bot: BotAPIClient, update: Update, callback: Callable):
+        key = self._key(bot, update)
+        with self._lock:
+            burst = self._bursts.get(key)
+            if burst is None:
+                burst = self._bursts[key] = _Burst(bot, callback)
+            elif burst.timer:
+                burst.timer.cancel()
+            burst.updates.append(update)
+
+            remaining = burst.started + self.max_delay - time.monotonic()
+            burst.timer = self._timers.call_later(min(self.window, remaining), self._flush_burst, key, burst)
+
+    def take(self, bot: BotAPIClient, update: Update) -> Optional[Tuple[Update, List[Update]]]:
+        """
+        Removes the pending messages of the update's user without waiting for the window, e.g. because a non-text
+        update of the same user needs to be handled after them. Returns the merged update and the swallowed updates,
+        or None if there were no pending messages.
+        """
+        burst = self._pop(self._key(bot, update))
+        return self._merge(burst) if burst else None
+
+    def take_all(self) -> List[Tuple[BotAPIClient, Update, List[Update]]]:
+        """ Removes the pending messages of all users, e.g. when shutting down """
+        with self._lock:
+            keys = list(self._bursts)
+        bursts = filter(None, (self._pop(key) for key in keys))
+        return [(burst.bot, *self._merge(burst)) for burst in bursts]
+
+    def stats(self) -> dict:
+        return dict(pending=self.pending, turns=self.turns, merged=self.merged)
+
+    def _pop(self, key, burst: _Burst = None) -> Optional[_Burst]:
+        with self._lock:
+            current = self._bursts.get(key)
+            if current is None or (burst is not None and current is not burst):
+                # Already taken
+                return None
+            del self._bursts[key]
+            if current.timer:
+                current.timer.cancel()
+            self.turns += 1
+            self.merged += len(current.updates) - 1
+            return current
+
+    @staticmethod
+    def _merge(burst: _Burst) -> Tuple[Update, List[Update]]:
+        *swallowed, update = burst.updates
+        if swallowed:
+            update.message_text = ' '.join(u.message_text for u in burst.updates if u.message_text)
+        return update, swallowed
+
+    def _flush_burst(self, key, burst: _Burst):
+        if self._pop(key, burst):
+            burst.callback(burst.bot, *self._merge(burst))
@@ -1,19 +1,21 @@
 import collections
-import sched
 import threading
 import time
-from collections import deque
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Callable, Deque, Dict, List, Union
+from typing import Callable, Deque, Dict, List, Tuple, Union
 
 from redis import StrictRedis
-from redis_collections import SyncableDeque, SyncableDict
 
 import settings
 from core.chataction import ChatAction
 from core.dialogstates import DialogStates
+from core.intentindex import IntentIndex
+from core.kvstore import RedisHashStore
+from core.serialization import CompactCodec, CompactSyncableDeque
 from core.understanding import MessageUnderstanding
+from core.writebehind import WriteBehindFlusher
 from corpus.questions import Question, Questionnaire, all_questionnaires
 from corpus.responsetemplates import format_intent
 from model import Update, User, UserAnswers
@@ -47,45 +49,53 @@ class Context(collections.MutableMapping):
     # Maximum number of utterances a single context keeps stored.
     SIZE_LIMIT = 50
 
-    def __init__(self, user: User, initial_state, redis=None):
+    def __init__(self, user: User, initial_state, redis=None, flusher: WriteBehindFlusher = None):
         self.user = user
 
         self._redis = redis
         self._initial_state = initial_state
 
-        self._init_collections()
+        # Changes are written to the redis database by the `flusher` every couple of seconds, as opposed to
+        # immediately. Without a flusher, they are written right away.
+        if redis and flusher is None:
+            flusher = WriteBehindFlusher(redis)
+        self._flusher = flusher
+        self.__utt_lock = threading.Lock()
 
-        # Utterances are synced with the redis database every couple of seconds, as opposed to immediately.
-        self._sync_timeout = 5  # seconds
-        self._scheduler = sched.scheduler(time.time, time.sleep)
-        self.__sync_utt_job = None  # type: sched.Event
-        self.__utt_sync_lock = threading.Lock()
+        self._init_collections()
 
         self.__name__ = "Context"
 
+    @staticmethod
+    def redis_keys(user_id: int) -> Tuple[str, str, str]:
+        """ Returns the keys of the dialog states, utterances and values of a user in redis """
+        return f'{user_id}:ds', f'{user_id}:utterances', f'{user_id}:kv_store'
+
     def _init_collections(self):
-        uid = self.user.id
+        states_key, utterances_key, values_key = self.redis_keys(self.user.id)
         self.dialog_states = DialogStates(
             self._initial_state,
             redis=self._redis,
-            key=f'{uid}:ds')
+            key=states_key,
+            flusher=self._flusher)
 
         # User and Bot utterances from newest to oldest
         if self._redis:
-            self._utterances = SyncableDeque(
+            self._utterances = CompactSyncableDeque(
                 maxlen=self.SIZE_LIMIT,
                 redis=self._redis,
-                key=f'{uid}:utterances')  # type: Deque[Union[MessageUnderstanding, ChatAction]]
-            self._value_store = SyncableDict(  # type: Dict
-                redis=self._redis,
-                writeback=True,
-                key=f'{uid}:kv_store')
-            self._utterances.sync()
-            self._value_store.sync()
+                key=utterances_key,
+                codec=CompactCodec(self.user))  # type: Deque[Union[MessageUnderstanding, ChatAction]]
+            self._value_store = RedisHashStore(self._redis, values_key, codec=CompactCodec(self.user))  # type: Dict
         else:
             self._utterances = deque()  # type: Deque[Union[MessageUnderstanding, ChatAction]]
             self._value_store = dict()
 
+        # Where the intents occurred in the utterances, for the recency lookups of every template condition
+        self._incoming_intents = IntentIndex()
+        self._outgoing_intents = IntentIndex()
+        self._index_utterances()
+
         self._answered_question_ids = UserAnswers.get_answered_question_ids(self.user)
 
         self._current_question = None  # type: Question
@@ -97,31 +107,62 @@ class Context(collections.MutableMapping):
         # cached property
         self.__last_user_utterance = None  # type: MessageUnderstanding
 
-    def _sched_sync_utterance(self):
-        if not isinstance(self._utterances, SyncableDeque):
-            return
-        try:
-            self._scheduler.cancel(self.__sync_utt_job)
-        except ValueError:
-            pass
-        self.__sync_utt_job = self._scheduler.enter(self._sync_timeout, 1, self._sync_utterances)
-        threading.Thread(target=self._scheduler.run).start()
+    def _mark_dirty(self, collection):
+        if self._flusher:
+            self._flusher.mark_dirty(collection)
 
-    def _sync_utterances(self):
-        with self.__utt_sync_lock:
-            self._utterances.sync()
+    def mark_values_dirty(self):
+        """
+        Schedules the values to be written, e.g. after they have been modified in place. Nothing is scheduled if no
+        value has been assigned, deleted or read since the last write.
+        """
+        if self._flusher and self._value_store.has_changes:
+            self._flusher.mark_dirty(self._value_store)
+
+    def flush(self):
+        """
+        Writes the state that has not been synced with redis yet, i.e. pending changes and values that have been
+        modified in place. The pending changes of other contexts are written along with them.
+        """
+        if not self._flusher:
+            return
+        self.mark_values_dirty()
+        self._flusher.flush()
+
+    def _index_utterances(self):
+        self._incoming_intents.clear()
+        self._outgoing_intents.clear()
+        for utt in reversed(self._utterances):  # oldest to newest
+            self._index_of(utt).add(self._intents_of(utt))
+
+    def _index_of(self, utt: Union[MessageUnderstanding, ChatAction]) -> IntentIndex:
+        return self._incoming_intents if isinstance(utt, MessageUnderstanding) else self._outgoing_intents
+
+    @staticmethod
+    def _intents_of(utt: Union[MessageUnderstanding, ChatAction]) -> List[str]:
+        return [utt.intent] if isinstance(utt, MessageUnderstanding) else utt.intents
+
+    def _append_utterance(self, utt: Union[MessageUnderstanding, ChatAction]):
+        if self._utterances.maxlen is not None and len(self._utterances) == self._utterances.maxlen:
+            # The oldest utterance is about to fall out of the history
+            oldest = self._utterances[-1]
+            self._index_of(oldest).drop_oldest(self._intents_of(oldest))
+        self._utterances.appendleft(utt)
+        self._index_of(utt).add(self._intents_of(utt))
 
     def add_user_utterance(self, understanding: MessageUnderstanding):
-        with self.__utt_sync_lock:
-            self._utterances.appendleft(understanding)
+        with self.__utt_lock:
+            self._append_utterance(understanding)
         self.__last_user_utterance = understanding
-        self._sched_sync_utterance()
+        self._mark_dirty(self._utterances)
 
     def add_actions(self, actions: List[ChatAction]):
-        for action in actions:
-            with self.__utt_sync_lock:
-                self._utterances.appendleft(action)
-        self._sched_sync_utterance()
+        with self.__utt_lock:
+            for action in actions:
+                self._append_utterance(action)
+        self._mark_dirty(self._utterances)
+        # The handlers of the turn may have modified values in place. Only the values they accessed are compared.
+        self.mark_values_dirty()
 
     @property
     def claim_finished(self):
@@ -170,6 +211,8 @@ class Context(collections.MutableMapping):
         `age_limit`.
         """
         intent = format_intent(intent)
+        if age_limit is None or isinstance(age_limit, int):
+            return self._is_recent(self._incoming_intents.latest_age(intent), age_limit)
         return bool(self.filter_incoming_utterances(
             lambda understanding: understanding.intent == intent,
             age_limit,
@@ -185,12 +228,22 @@ class Context(collections.MutableMapping):
         `age_limit`.
         """
         intent = format_intent(intent)
+        if age_limit is None or isinstance(age_limit, int):
+            return self._is_recent(self._outgoing_intents.latest_age(intent), age_limit)
         return bool(self.filter_outgoing_utterances(
             lambda action: intent in action.intents,
             age_limit,
             only_latest=True
         ))
 
+    def count_outgoing_intent(self, intent: str, age_limit: int = settings.CONTEXT_LOOKUP_RECENCY) -> int:
+        """ Returns the number of outgoing `ChatActions` with the specified `intent` not older than `age_limit` """
+        return self._outgoing_intents.count_within(format_intent(intent), age_limit)
+
+    @staticmethod
+    def _is_recent(age: int, age_limit: int) -> bool:
+        return age is not None and (age_limit is None or age <= age_limit)
+
     def filter_incoming_utterances(
             self,
             filter_func: Callable[[MessageUnderstanding], bool],
@@ -282,11 +335,12 @@ class Context(collections.MutableMapping):
     def reset_all(self) -> int:
         self.dialog_states.reset()
 
-        self._utterances.clear()
+        with self.__utt_lock:
+            self._utterances.clear()
+            self._index_utterances()
         self._value_store.clear()
-        if self._redis:
-            self._utterances.sync()
-            self._sync_utterances()
+        self._mark_dirty(self._utterances)
+        self.mark_values_dirty()
 
         num_reset = UserAnswers.reset_answers(self.user)
         self._answered_question_ids = set()
@@ -296,12 +350,12 @@ class Context(collections.MutableMapping):
 
     def __setitem__(self, key, value):
         self._value_store[key] = value
-        if isinstance(self._value_store, SyncableDict):
-            self._value_store.sync()
+        self.mark_values_dirty()
         return value
 
     def __delitem__(self, key):
         del self._value_store[key]
+        self.mark_values_dirty()
 
     def __getitem__(self, key):
         return self._value_store[key]
@@ -315,13 +369,41 @@ class Context(collections.MutableMapping):
 
 class ContextManager:
     """
-    Holds and creates the contexts of individual users
+    Holds and creates the contexts of individual users.
+
+    With redis, at most `max_size` contexts are kept in memory, and contexts that have not been used for
+    `idle_timeout` seconds are dropped. The least recently used contexts are evicted first. Their pending changes are
+    written by the `flusher`, and they are restored from redis on the next message of their user. Without redis,
+    contexts are never evicted, as they could not be restored.
+
+    Note that a context may still be in use by a turn while it is evicted. A `max_size` much larger than the number
+    of concurrent turns makes this unlikely, and the changes of such a turn are written nevertheless.
     """
 
-    def __init__(self, initial_state, redis: StrictRedis = None):
-        self.contexts = {}  # type: Dict[int, Context]
+    # Number of rehydration latencies kept for the statistics
+    LATENCY_SAMPLES = 200
+
+    def __init__(self,
+                 initial_state,
+                 redis: StrictRedis = None,
+                 flusher: WriteBehindFlusher = None,
+                 max_size: int = None,
+                 idle_timeout: float = None):
+        self.contexts = OrderedDict()  # type: Dict[int, Context]
         self.initial_state = initial_state
         self.redis = redis
+        # One flusher for all contexts, so that their changes are written in batches
+        self.flusher = flusher or (WriteBehindFlusher(redis) if redis else None)
+        self.max_size = max_size if redis else None
+        self.idle_timeout = idle_timeout if redis else None
+
+        self._lock = threading.Lock()
+        self._last_used = {}  # type: Dict[int, float]
+        self._rehydration_latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self.hits = 0
+        self.rehydrations = 0
+        self.evictions = 0
+        self.idle_evictions = 0
 
     def add_outgoing_action(self, action: ChatAction) -> Context:
         ctx = self.get_user_context(action.peer)
@@ -340,9 +422,87 @@ class ContextManager:
         ctx.add_user_utterance(nlu)
         return ctx
 
+    def flush_all(self):
+        """ Writes the pending changes of all contexts to redis """
+        if not self.flusher:
+            return
+        for ctx in self._all_contexts():
+            ctx.mark_values_dirty()
+        self.flusher.flush()
+
+    def refresh_question_contexts(self):
+        """ Recalculates the current questions of all contexts, e.g. after the questionnaires have been reloaded """
+        for ctx in self._all_contexts():
+            ctx._update_question_context()
+
     def get_user_context(self, user: User):
-        try:
-            return self.contexts[user.id]
-        except KeyError:
-            self.contexts[user.id] = Context(user, self.initial_state, redis=self.redis)
-            return self.contexts[user.id]
+        now = time.monotonic()
+        with self._lock:
+            ctx = self.contexts.get(user.id)
+            if ctx is not None:
+                self.hits += 1
+                self._touch(user.id, now)
+                return ctx
+
+        ctx = self._rehydrate(user)
+
+        with self._lock:
+            # Another turn of the same user may have been faster
+            ctx = self.contexts.setdefault(user.id, ctx)
+            self._touch(user.id, now)
+            evicted = self._evict(now)
+        for old in evicted:
+            # Values may have been modified in place, so they are written in any case
+            old.mark_values_dirty()
+        return ctx
+
+    def _rehydrate(self, user: User) -> Context:
+        started = time.monotonic()
+        if self.flusher and any(self.flusher.is_pending(key) for key in Context.redis_keys(user.id)):
+            # The context has been evicted before its changes were written
+            self.flusher.flush()
+        ctx = Context(user, self.initial_state, redis=self.redis, flusher=self.flusher)
+        if self.redis:
+            self.rehydrations += 1
+            self._rehydration_latencies.append(time.monotonic() - started)
+        return ctx
+
+    def _touch(self, user_id: int, now: float):
+        self.contexts.move_to_end(user_id)
+        self._last_used[user_id] = now
+
+    def _evict(self, now: float) -> List[Context]:
+        evicted = []
+        while self.contexts:
+            user_id = next(iter(self.contexts))
+            if self.max_size and len(self.contexts) > self.max_size:
+                self.evictions += 1
+            elif self.idle_timeout and now - self._last_used[user_id] > self.idle_timeout:
+                self.idle_evictions += 1
+            else:
+                break
+            evicted.append(self.contexts.pop(user_id))
+            del self._last_used[user_id]
+        return evicted
+
+    def _all_contexts(self) -> List[Context]:
+        with self._lock:
+            return list(self.contexts.values())
+
+    def stats(self) -> dict:
+        latencies = sorted(self._rehydration_latencies)
+
+        def percentile(p):
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1) if latencies else None
+
+        return dict(
+            size=len(self.contexts),
+            max_size=self.max_size,
+            hits=self.hits,
+            rehydrations=self.rehydrations,
+            evictions=self.evictions,
+            idle_evictions=self.idle_evictions,
+            rehydration_p50_ms=percentile(0.5),
+            rehydration_p95_ms=percentile(0.95),
+            rehydration_max_ms=round(latencies[-1] * 1000, 1) if latencies else None,
+        )
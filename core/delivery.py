@@ -0,0 +1,95 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from logzero import logger as log
+
+from clients.botapiclients import BotAPIClient
+from core.chataction import ChatAction
+from core.timers import TimerQueue
+
+
+class DeliveryScheduler:
+    """
+    Sends planned `ChatActions` when they are due instead of sleeping between messages.
+
+    Every action is queued with its natural delay on a shared `TimerQueue`. The actions for a single peer are
+    delivered strictly in order: the delay of the next action starts counting when the previous one has been sent.
+    Sequences of consecutive turns for the same peer are appended to the same queue, so they never interleave.
+    """
+
+    def __init__(self, timers: TimerQueue):
+        self._timers = timers
+        self._lock = threading.Lock()
+        self._queues = {}  # type: Dict[Tuple[str, int], Deque[Tuple[BotAPIClient, ChatAction, bool]]]
+        # Identifies the currently scheduled send of each queue, so that a send can be brought forward by `rush`
+        self._due = {}  # type: Dict[Tuple[str, int], object]
+        self._rushing = False
+
+    @property
+    def pending(self) -> int:
+        """ Number of actions that have not been sent yet """
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def schedule(self, bot: BotAPIClient, actions: List[ChatAction]):
+        if not actions:
+            return
+
+        key = (bot.client_name, actions[0].peer.id)
+        with self._lock:
+            queue = self._queues.get(key)
+            idle = queue is None
+            if idle:
+                queue = self._queues[key] = deque()
+            for i, action in enumerate(actions):
+                queue.append((bot, action, i == len(actions) - 1))
+
+        if idle:
+            self._timers.call_soon(self._prepare_next, key)
+
+    def rush(self):
+        """
+        Sends all remaining actions right away, without typing indications and delays, e.g. when shutting down.
+        """
+        with self._lock:
+            self._rushing = True
+            for key in list(self._due):
+                token = self._due[key] = object()
+                self._timers.call_soon(self._send_next, key, token)
+
+    def _prepare_next(self, key):
+        with self._lock:
+            queue = self._queues[key]
+            if not queue:
+                del self._queues[key]
+                return
+            bot, action, _ = queue[0]
+            rushing = self._rushing
+
+        if action.show_typing and not rushing:
+            try:
+                bot.show_typing(action.peer)
+            except Exception as e:
+                log.error(f"Showing typing indication failed: {e}")
+
+        with self._lock:
+            token = self._due[key] = object()
+            delay = 0 if self._rushing else bot.get_delay(action)
+            self._timers.call_later(delay, self._send_next, key, token)
+
+    def _send_next(self, key, token):
+        with self._lock:
+            if self._due.get(key) is not token:
+                # Has been brought forward by `rush`
+                return
+            del self._due[key]
+            bot, action, is_last = self._queues[key].popleft()
+
+        try:
+            bot.perform_action(action, is_last=is_last)
+        except Exception as e:
+            log.error("Error while performing chat action:")
+            log.exception(e)
+        finally:
+            self._prepare_next(key)
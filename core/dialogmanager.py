@@ -1,5 +1,9 @@
+import asyncio
 import os
-from typing import List
+import threading
+from concurrent.futures import Future
+from functools import partial, wraps
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING, Tuple
 
 import time
 from logzero import logger as log
@@ -7,18 +11,27 @@ from logzero import logger as log
 import settings
 from appglobals import ROOT_DIR
 from clients.botapiclients import BotAPIClient
-from clients.nluclients import NLUEngine
 from clients.supportchannel import SupportChannel
 from clients.voice import VoiceRecognitionClient
 from core import ChatAction
-from core.context import ContextManager
+from core.choices import PendingChoices
+from core.coalescing import MessageCoalescer
+from core.context import Context, ContextManager
+from core.delivery import DeliveryScheduler
+from core.dispatcher import AsyncDispatcher, Lane
+from core.pipeline import StagedPipeline
 from core.planningagent import IPlanningAgent
 from core.recorder import ConversationRecorder
+from core.turngate import TurnGate
 from core.understanding import MessageUnderstanding
-from logic.intents import MEDIA_RECEIVED_INTENT
+from logic.intents import MEDIA_INTENT
 from logic.responsecomposer import NOT_SET
 from model import Update
 
+if TYPE_CHECKING:
+    # Only for annotations, as `clients.nluclients` imports the `core` package and with it this module
+    from clients.nluclients import NLUEngine
+
 
 class DialogManager:
     """
@@ -27,17 +40,41 @@ class DialogManager:
 
     Enriches incoming updates with a `MessageUnderstanding` and lets the `PlanningAgent` decide on which actions to
     perform next. Then calls `perform_actions` on the respective client with the laid-out `ChatActions`.
+
+    If an `AsyncDispatcher` is given, incoming updates are not processed on the thread of the bot API client, but
+    handed to the dispatcher's per-user mailboxes instead. Work that handlers defer with `ResponseComposer.defer` is
+    then run in its lower priority lane.
+    If a `DeliveryScheduler` is given, the actions are queued for delivery instead of being performed (and waited
+    for) on the current thread.
+    If a `StagedPipeline` is given, understanding, planning and delivery of a turn run on separate thread pools.
+    Planning holds the `turn_gate`, so that templates and rules can be swapped in between turns (see `HotReloader`).
+    With `async_nlu`, turns in the dispatcher wait for their understanding on the dispatcher's event loop instead of
+    blocking a thread (unless a `StagedPipeline` runs them).
+    If a `MessageCoalescer` is given, consecutive plain text messages of a user that arrive in quick succession are
+    merged and understood as a single turn.
+    If `PendingChoices` are given, a message that is the label of one of the buttons offered in the last response is
+    understood as the intent of that button without asking the NLU engine.
     """
 
+    # Seconds before the drain deadline at which the remaining actions are sent without delays
+    DRAIN_RUSH_MARGIN = 5
+
     def __init__(
             self,
             context_manager: ContextManager,
             bot_clients: List[BotAPIClient],
-            nlu_client: NLUEngine,
+            nlu_client: 'NLUEngine',
             planning_agent: IPlanningAgent,
             recorder: ConversationRecorder = None,
             voice_recognition_client: VoiceRecognitionClient = None,
-            support_channel: SupportChannel = None
+            support_channel: SupportChannel = None,
+            dispatcher: AsyncDispatcher = None,
+            delivery: DeliveryScheduler = None,
+            coalescer: MessageCoalescer = None,
+            pipeline: StagedPipeline = None,
+            turn_gate: TurnGate = None,
+            pending_choices: PendingChoices = None,
+            async_nlu: bool = False
     ):
         self.context_manager = context_manager
         self.bots = bot_clients
@@ -46,23 +83,142 @@ class DialogManager:
         self.voice = voice_recognition_client
         self.planning_agent = planning_agent
         self.support_channel = support_channel
+        self.dispatcher = dispatcher
+        self.delivery = delivery
+        self.coalescer = coalescer
+        self.pipeline = pipeline
+        self.turn_gate = turn_gate or TurnGate()
+        self.pending_choices = pending_choices
+        self.async_nlu = async_nlu
+
+        # Turns that have been taken off the queues of the bots and the dispatcher, but are not done yet
+        self._turns_lock = threading.Lock()
+        self._turns_in_flight = 0
+        # Without a dispatcher, the last pipeline turn of each user that is not done yet
+        self._last_turns = {}  # type: Dict[int, Future]
 
         for bot in bot_clients:
-            bot.set_start_handler(self.start_callback)
-            bot.add_plaintext_handler(self.text_update_received)
-            bot.add_voice_handler(self.voice_received)
-            bot.add_media_handler(self.media_received)
+            bot.set_start_handler(self._dispatched(self._counted(self.start_callback)))
+            bot.add_plaintext_handler(self._dispatched(self._counted(self.text_update_received)))
+            bot.add_voice_handler(self._dispatched(self._counted(self.voice_received)))
+            bot.add_media_handler(self._dispatched(self._counted(self.media_received)))
 
             bot.start_listening()
 
+    @property
+    def pending(self) -> int:
+        """ Number of updates, turns and outgoing actions that have not been processed yet """
+        pending = sum(bot.pending for bot in self.bots) + self._turns_in_flight
+        pending += sum(ingress.depth for ingress in {bot.ingress for bot in self.bots if bot.ingress})
+        for component in (self.coalescer, self.dispatcher, self.delivery):
+            if component:
+                pending += component.pending
+        return pending
+
+    def wait_until_idle(self, timeout: float = None, interval: float = 0.1) -> bool:
+        """ Blocks until all pending turns and deliveries are done. Returns False if `timeout` has been reached. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Shuts down without losing turns: refuses new webhook updates, finishes the turns that have already been
+        received and sends their responses. If the deliveries are not done shortly before `timeout`, the remaining
+        actions are sent without their delays. Finally, unsynced context state is written to redis and the pending
+        conversation recordings are saved and published.
+
+        Returns False if some work was still pending when `timeout` was reached.
+        """
+        deadline = time.monotonic() + timeout
+        for bot in self.bots:
+            bot.draining = True
+
+        if self.coalescer:
+            for bot, update, swallowed in self.coalescer.take_all():
+                self._coalesced_text_received(bot, update, swallowed)
+
+        # Leave some time to send out what is left
+        rush_margin = min(timeout / 4, self.DRAIN_RUSH_MARGIN)
+        idle = self.wait_until_idle(timeout=deadline - time.monotonic() - rush_margin)
+        if not idle and self.delivery:
+            log.warning("Deadline is approaching, sending the remaining actions without delays.")
+            self.delivery.rush()
+            idle = self.wait_until_idle(timeout=max(deadline - time.monotonic(), 0))
+        if not idle:
+            log.warning(f"{self.pending} updates, turns or actions were still pending when draining timed out.")
+
+        self.context_manager.flush_all()
+        if self.recorder:
+            self.recorder.flush()
+
+        for bot in self.bots:
+            try:
+                bot.stop_listening()
+            except Exception as e:
+                log.debug(f"Could not stop listening for {bot.client_name} updates: {e}")
+        return idle
+
+    def _turn_finished(self, *_):
+        with self._turns_lock:
+            self._turns_in_flight -= 1
+
+    async def _finish_after(self, turn):
+        try:
+            return await turn
+        finally:
+            self._turn_finished()
+
+    def _counted(self, callback):
+        """
+        Wraps an update callback so that its turn counts as pending until it is done, including the `Future` or
+        coroutine it returns. The bots take updates off their queues before calling back, so `drain` would not wait
+        for these turns otherwise.
+        """
+        @wraps(callback)
+        def counted(*args):
+            with self._turns_lock:
+                self._turns_in_flight += 1
+            try:
+                turn = callback(*args)
+            except BaseException:
+                self._turn_finished()
+                raise
+            if isinstance(turn, Future):
+                turn.add_done_callback(self._turn_finished)
+            elif asyncio.iscoroutine(turn):
+                return self._finish_after(turn)
+            else:
+                self._turn_finished()
+            return turn
+
+        return counted
+
+    def _dispatched(self, callback):
+        """
+        Wraps an update callback so that it is executed in the mailbox of the update's user, if a dispatcher is set.
+        """
+        if self.dispatcher is None:
+            return callback
+
+        def dispatch(bot: BotAPIClient, update: Update):
+            self.dispatcher.submit(update.user.id, callback, bot, update)
+
+        dispatch.__name__ = callback.__name__
+        return dispatch
+
     def __get_client_by_name(self, client_name: str) -> BotAPIClient:
         return next(x for x in self.bots if client_name == x.client_name)
 
     def start_callback(self, bot: BotAPIClient, update: Update):
+        self._flush_coalesced(bot, update)
         update.understanding = MessageUnderstanding(
             text=update.message_text,
             intent='start')
-        self._process_update(bot, update)
+        return self._run_turn(bot, update)
 
     def voice_received(self, bot: BotAPIClient, update: Update):
         bot.show_typing(update.user)
@@ -81,35 +237,154 @@ class DialogManager:
         update.message_text = text
         log.debug(f"Voice message received: {text}")
 
-        self.text_update_received(bot, update)
+        return self.text_update_received(bot, update)
 
     def media_received(self, bot: BotAPIClient, update: Update):
-        update.understanding = MessageUnderstanding(None, MEDIA_RECEIVED_INTENT, media_location=update.media_location)
-        self._process_update(bot, update)
+        self._flush_coalesced(bot, update)
+        update.understanding = MessageUnderstanding(None, MEDIA_INTENT, media_location=update.media_location)
+        return self._run_turn(bot, update)
 
     def text_update_received(self, bot: BotAPIClient, update: Update):
+        choice = self.pending_choices.match(update) if self.pending_choices else None
+        if choice:
+            # A button press needs no NLU and is never merged, but must not overtake earlier messages
+            self._flush_coalesced(bot, update)
+            update.understanding = choice
+            return self._run_turn(bot, update)
+
+        if self.coalescer and update.payload is None:
+            self.coalescer.add(bot, update, self._coalesced_text_received)
+            return
+
+        # Button presses carry a payload and are never merged, but must not overtake earlier messages
+        self._flush_coalesced(bot, update)
+        return self._text_turn(bot, update)
+
+    def _coalesced_text_received(self, bot: BotAPIClient, update: Update, swallowed: List[Update]):
+        if self.dispatcher:
+            # Called from the coalescer's timer, so the turn needs to go through the user's mailbox again
+            self.dispatcher.submit(update.user.id, self._text_turn, bot, update, swallowed)
+        else:
+            self._counted(self._text_turn)(bot, update, swallowed)
+
+    def _flush_coalesced(self, bot: BotAPIClient, update: Update):
+        """ Processes the messages of the user that are still waiting in the coalescer """
+        if self.coalescer is None:
+            return
+        pending = self.coalescer.take(bot, update)
+        if pending:
+            turn = self._text_turn(bot, *pending, blocking=True)
+            if isinstance(turn, Future):
+                turn.result()
+
+    def _text_turn(self, bot: BotAPIClient, update: Update, swallowed: List[Update] = None, blocking: bool = False):
+        for u in swallowed or ():
+            # Merged into `update`, but kept for the conversation history
+            u.save()
+        if self.async_nlu and self.dispatcher and not self.pipeline and not blocking:
+            # Awaited by the user's mailbox
+            return self._run_turn_async(bot, update)
+        return self._run_turn(bot, update, understand=True)
+
+    async def _run_turn_async(self, bot: BotAPIClient, update: Update):
+        await self.nlp.insert_understanding_async(update)
+        # On the lane's thread pool, so that its concurrency limit applies to planning and delivery
+        await self.dispatcher.run_in_lane(Lane.INTERACTIVE, self._process_update, bot, update)
+
+    def _run_turn(self, bot: BotAPIClient, update: Update, understand: bool = False) -> Optional[Future]:
+        """
+        Understands (optionally), plans and delivers the response to an update.
+
+        With a `StagedPipeline`, every step runs on the pool of its stage and the future of the turn is returned.
+        Inside the dispatcher, the user's mailbox waits on it; otherwise the turn starts once the previous turn of
+        the user is done, without blocking the current thread.
+        """
+        if self.pipeline is None:
+            if understand:
+                self.nlp.insert_understanding(update)
+            self._process_update(bot, update)
+            return None
+
+        steps = []
+        if understand:
+            steps.append((self.pipeline.nlu, self._understand))
+        steps.append((self.pipeline.planning, partial(self._plan, bot)))
+        steps.append((self.pipeline.delivery, partial(self._deliver, bot)))
+
+        if self.dispatcher:
+            return self.pipeline.run(*steps, value=update)
+        return self._after_previous_turn(update.user.id, partial(self.pipeline.run, *steps, value=update))
+
+    def _after_previous_turn(self, user_id: int, start: Callable[[], Future]) -> Future:
+        """ Calls `start` once the previous turn of the user is done and returns a future for the started turn """
+        turn = Future()
+        turn.set_running_or_notify_cancel()
+
+        def start_turn(_=None):
+            try:
+                started = start()
+            except Exception as e:
+                started = Future()
+                started.set_exception(e)
+            started.add_done_callback(partial(self._turn_done, user_id, turn))
+
+        with self._turns_lock:
+            previous = self._last_turns.get(user_id)
+            self._last_turns[user_id] = turn
+        if previous is None:
+            start_turn()
+        else:
+            previous.add_done_callback(start_turn)
+        return turn
+
+    def _turn_done(self, user_id: int, turn: Future, started: Future):
+        with self._turns_lock:
+            if self._last_turns.get(user_id) is turn:
+                del self._last_turns[user_id]
+        error = started.exception()
+        if error is not None:
+            log.error(f"Error while processing a turn of {user_id}:", exc_info=error)
+            turn.set_exception(error)
+        else:
+            turn.set_result(started.result())
+
+    def _understand(self, update: Update) -> Update:
         self.nlp.insert_understanding(update)
-        self._process_update(bot, update)
+        return update
 
     def _process_update(self, bot: BotAPIClient, update: Update) -> None:
+        planned = self._plan(bot, update)
+        if planned is not None:
+            self._deliver(bot, planned)
+
+    def _plan(self, bot: BotAPIClient, update: Update) -> Optional[Tuple[Update, Context, List[ChatAction], list]]:
         print()  # newline on incoming request makes the logs more readable
 
         context = self.context_manager.add_incoming_update(update)
 
-        try:
+        with self.turn_gate.turn():
             try:
-                next_response = self.planning_agent.build_next_actions(context)
-            except ForceReevaluation:
-                # Some handlers require to reevaluate the template parameters (only once)
-                next_response = self.planning_agent.build_next_actions(context)
-            if next_response is None:
-                return
-            actions = next_response.collect_actions()
-        finally:
-            context.dialog_states.update_step()
+                try:
+                    next_response = self.planning_agent.build_next_actions(context)
+                except ForceReevaluation:
+                    # Some handlers require to reevaluate the template parameters (only once)
+                    next_response = self.planning_agent.build_next_actions(context)
+                if next_response is None:
+                    return None
+                actions = next_response.collect_actions()
+            finally:
+                context.dialog_states.update_step()
+
+        return update, context, actions, next_response.deferred
+
+    def _deliver(self, bot: BotAPIClient, planned: Tuple[Update, Context, List[ChatAction], list]) -> Update:
+        update, context, actions, deferred = planned
 
         if self.recorder:
             self.recorder.record_dialog(update, actions, context.dialog_states)
+        if self.pending_choices:
+            # Before sending, as the user may press a button before we are done here
+            self.pending_choices.remember(update.user.id, actions)
 
         if settings.NO_DELAYS:
             # No message delays while debugging
@@ -117,7 +392,10 @@ class DialogManager:
                 a.delay = None
 
         try:
-            bot.perform_actions(actions)
+            if self.delivery:
+                self.delivery.schedule(bot, actions)
+            else:
+                bot.perform_actions(actions)
         except Exception as e:
             log.error("Error while performing chat action:")
             log.exception(e)
@@ -125,6 +403,31 @@ class DialogManager:
         context.add_actions(actions)
         update.save()
 
+        for lane, callback in deferred:
+            if self.dispatcher:
+                self.dispatcher.submit(update.user.id, self._deferred_turn, bot, context, callback, lane=lane)
+            else:
+                self._deferred_turn(bot, context, callback)
+        return update
+
+    def _deferred_turn(self, bot: BotAPIClient, context: Context, callback):
+        """ Composes and sends the response of a callback that a handler has deferred to a lower priority lane """
+        with self.turn_gate.turn():
+            actions = self.planning_agent.build_deferred_actions(context, callback).collect_actions()
+        if not actions:
+            return
+        if self.pending_choices and any(a.choices for a in actions):
+            self.pending_choices.remember(context.user.id, actions)
+
+        if settings.NO_DELAYS:
+            for a in actions:
+                a.delay = None
+        if self.delivery:
+            self.delivery.schedule(bot, actions)
+        else:
+            bot.perform_actions(actions)
+        context.add_actions(actions)
+
 
 class ForceReevaluation(Exception):
     """
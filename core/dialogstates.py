@@ -3,6 +3,9 @@ from typing import Generator, List, NoReturn, Tuple, Union
 from logzero import logger as log
 from redis_collections import SyncableList
 
+from core import serialization
+from core.serialization import CompactSyncableList
+
 # Used to denote that a state will be used as fallback forever
 INFINITE_LIFETIME = "infinite"
 
@@ -20,6 +23,13 @@ class _StateLifetime(object):
         return f"{self.state} ({self.lifetime})"
 
 
+serialization.register(
+    's', _StateLifetime,
+    lambda s, codec: [serialization.encode_value(s.state), s.lifetime],
+    lambda fields, codec: _StateLifetime(serialization.decode_value(fields[0]), fields[1])
+)
+
+
 class DialogStates(object):
     """
     Holds a priority queue of multiple states that a conversation may be in at the same time.
@@ -27,13 +37,15 @@ class DialogStates(object):
     decremented by one for each call to `update_step()`.
     """
 
-    def __init__(self, initial_state, redis=None, key=None):
+    def __init__(self, initial_state, redis=None, key=None, flusher=None):
         if redis:
             if not key:
                 raise ValueError("If `redis` is used, then a `key` must be supplied.")
-            self._states_queue = SyncableList(redis=redis, key=key)
+            self._states_queue = CompactSyncableList(redis=redis, key=key)
         else:
             self._states_queue = []  # type: List[_StateLifetime]
+        # Writes the states to redis in the background if given (see `core.writebehind`)
+        self._flusher = flusher
 
         self.initial_state = initial_state
         self._init_states()
@@ -41,7 +53,14 @@ class DialogStates(object):
     def reset(self):
         self._states_queue.clear()
         self._init_states()
-        if isinstance(self._states_queue, SyncableList):
+        self._sync()
+
+    def _sync(self):
+        if not isinstance(self._states_queue, SyncableList):
+            return
+        if self._flusher:
+            self._flusher.mark_dirty(self._states_queue)
+        else:
             self._states_queue.sync()
 
     def _init_states(self):
@@ -124,8 +143,7 @@ class DialogStates(object):
         for s in to_remove:
             self._states_queue.remove(s)
 
-        if isinstance(self._states_queue, SyncableList):
-            self._states_queue.sync()
+        self._sync()
 
     def iter_states(self) -> Generator:
         # Returns a generator with the current states in order of recency
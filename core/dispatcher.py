@@ -0,0 +1,159 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from functools import partial
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from logzero import logger as log
+
+
+class Lane(Enum):
+    """
+    Priority classes of work in the `AsyncDispatcher`, each with its own concurrency budget
+    """
+    INTERACTIVE = 'interactive'  # turns of customers that are waiting for a response
+    BACKGROUND = 'background'  # e.g. publishing conversation recordings
+    BULK = 'bulk'  # heavy admin operations that iterate over all users
+
+
+class AsyncDispatcher:
+    """
+    Asyncio-based dispatcher that processes the turns of different users concurrently while keeping the turns of a
+    single user strictly serialized.
+
+    Every user gets an ordered mailbox. A mailbox is drained by exactly one task at a time, so that the next turn
+    of a user only starts after the previous one has finished. The number of turns processed at the same time is
+    capped by `max_concurrency`.
+
+    Work is submitted to a `Lane`. Each lane has its own concurrency budget and thread pool, so that bulk
+    operations can never take away capacity from interactive turns. `max_concurrency` is the budget of the
+    interactive lane, the budgets of the other lanes are given by `lane_budgets`. The lane only decides where and
+    when work runs, not its order: all work of a user goes through the same mailbox, so e.g. a deferred background
+    callback never runs at the same time as an interactive turn of the same user.
+
+    The event loop runs in a background thread, so `submit` can be called from any bot API client thread.
+    Synchronous callbacks are executed in a thread pool, coroutine functions are awaited on the loop directly.
+    If a synchronous callback returns a coroutine (e.g. a turn waiting for a non-blocking NLU request) or a
+    `concurrent.futures.Future` (e.g. a turn running in a `StagedPipeline`), the mailbox waits for it without holding
+    a thread. A returned future does not count towards the lane's budget while it is waited for, as the work has
+    been handed off to a pool with its own limits; the next call in the mailbox still waits for it.
+    """
+
+    DEFAULT_LANE_BUDGETS = {Lane.BACKGROUND: 2, Lane.BULK: 1}
+
+    def __init__(self, max_concurrency: int = 8, lane_budgets: Dict[Lane, int] = None):
+        budgets = dict(self.DEFAULT_LANE_BUDGETS)
+        budgets.update(lane_budgets or {})
+        budgets[Lane.INTERACTIVE] = max_concurrency
+        if any(b < 1 for b in budgets.values()):
+            raise ValueError("At least one concurrent turn must be allowed in every lane.")
+        self.max_concurrency = max_concurrency
+        self.budgets = budgets
+
+        self._loop = asyncio.new_event_loop()
+        self._executors = {
+            lane: ThreadPoolExecutor(max_workers=budget, thread_name_prefix=f'Dispatcher-{lane.value}')
+            for lane, budget in budgets.items()
+        }  # type: Dict[Lane, ThreadPoolExecutor]
+        self._thread = None  # type: threading.Thread
+        self._semaphores = {}  # type: Dict[Lane, asyncio.Semaphore]
+
+        # Only ever accessed from within the event loop
+        self._mailboxes = {}  # type: Dict[Hashable, Deque[Tuple[Lane, Callable, tuple]]]
+        self._pending = {lane: 0 for lane in Lane}  # type: Dict[Lane, int]
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self) -> int:
+        """ Number of submitted turns that have not finished yet, in all lanes """
+        return sum(self._pending.values())
+
+    def lane_pending(self, lane: Lane) -> int:
+        return self._pending[lane]
+
+    def stats(self) -> dict:
+        return {
+            lane.value: dict(pending=self._pending[lane], budget=self.budgets[lane])
+            for lane in Lane
+        }
+
+    def start(self):
+        if self.running:
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), name='AsyncDispatcher', daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self, timeout: float = None):
+        if not self.running:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+
+    def _run_loop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._semaphores = {lane: asyncio.Semaphore(budget) for lane, budget in self.budgets.items()}
+        ready.set()
+        self._loop.run_forever()
+
+    def submit(self, key: Hashable, func: Callable, *args, lane: Lane = Lane.INTERACTIVE):
+        """
+        Puts a call to `func` into the mailbox identified by `key` (usually the id of a user), to be run in the given
+        `lane`. Calls with the same `key` are executed one after another in the order they were submitted.
+        """
+        if not self.running:
+            raise RuntimeError("The dispatcher has not been started.")
+        self._loop.call_soon_threadsafe(self._enqueue, lane, key, func, args)
+
+    def _enqueue(self, lane: Lane, key: Hashable, func: Callable, args: tuple):
+        self._pending[lane] += 1
+        mailbox = self._mailboxes.get(key)
+        if mailbox is not None:
+            # The mailbox is already being drained
+            mailbox.append((lane, func, args))
+            return
+        mailbox = self._mailboxes[key] = deque([(lane, func, args)])
+        self._loop.create_task(self._drain(key, mailbox))
+
+    async def _drain(self, key: Hashable, mailbox: Deque):
+        try:
+            while mailbox:
+                lane, func, args = mailbox.popleft()
+                try:
+                    async with self._semaphores[lane]:
+                        handed_off = await self._execute(self._executors[lane], func, args)
+                    if handed_off is not None:
+                        await asyncio.wrap_future(handed_off, loop=self._loop)
+                except Exception as e:
+                    log.error(f"Error while processing a turn of {key} ({lane.value}):")
+                    log.exception(e)
+                finally:
+                    self._pending[lane] -= 1
+        finally:
+            del self._mailboxes[key]
+
+    def run_in_lane(self, lane: Lane, func: Callable, *args) -> asyncio.Future:
+        """ Runs `func` on the thread pool of `lane`, for coroutines in the mailboxes that need to block """
+        return self._loop.run_in_executor(self._executors[lane], partial(func, *args))
+
+    async def _execute(self, executor: ThreadPoolExecutor, func: Callable, args: tuple) -> Optional[Future]:
+        """ Runs `func` and returns the `Future` it has handed its work off to, if any """
+        if asyncio.iscoroutinefunction(func):
+            await func(*args)
+            return None
+        result = await self._loop.run_in_executor(executor, partial(func, *args))
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result if isinstance(result, Future) else None
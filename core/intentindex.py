@@ -0,0 +1,53 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional
+
+
+class IntentIndex:
+    """
+    Index from intents to the positions of the utterances of one direction (incoming or outgoing) in which they
+    occurred.
+
+    Every utterance that is added gets the next rank, and its age is the number of utterances that have been added
+    after it, like the ages that `Context._filter_utterances` counts. The ranks of an intent are kept in ascending
+    order, so its most recent occurrence is found in constant time and the number of occurrences within an age
+    limit by bisection. When the oldest utterance falls out of the history, it has to be dropped with `drop_oldest`.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._oldest = 0
+        self._ranks = {}  # type: Dict[str, List[int]]
+
+    def add(self, intents: Iterable[str]):
+        rank = self.count
+        self.count += 1
+        for intent in set(intents or ()):
+            self._ranks.setdefault(intent, []).append(rank)
+
+    def drop_oldest(self, intents: Iterable[str]):
+        for intent in set(intents or ()):
+            ranks = self._ranks.get(intent)
+            if ranks and ranks[0] == self._oldest:
+                del ranks[0]
+                if not ranks:
+                    del self._ranks[intent]
+        self._oldest += 1
+
+    def clear(self):
+        self.count = 0
+        self._oldest = 0
+        self._ranks.clear()
+
+    def latest_age(self, intent: str) -> Optional[int]:
+        """ Returns the age of the most recent utterance with `intent`, or None if there is none """
+        ranks = self._ranks.get(intent)
+        return self.count - 1 - ranks[-1] if ranks else None
+
+    def count_within(self, intent: str, age_limit: int = None) -> int:
+        """ Returns the number of utterances with `intent` that are not older than `age_limit` """
+        ranks = self._ranks.get(intent)
+        if not ranks:
+            return 0
+        if age_limit is None:
+            return len(ranks)
+        return len(ranks) - bisect_left(ranks, self.count - 1 - age_limit)
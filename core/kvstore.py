@@ -0,0 +1,182 @@
+import pickle
+import threading
+from collections import MutableMapping
+from typing import Any, Callable, Dict, Set
+
+from redis import StrictRedis
+
+from core.serialization import CompactCodec
+
+# Values of these types cannot be modified in place, so reading them does not require them to be written again
+IMMUTABLE_TYPES = (type(None), bool, int, float, str, bytes, tuple, frozenset)
+
+
+class RedisHashStore(MutableMapping):
+    """
+    Dictionary of a context's values that is backed by a redis hash with one field per key.
+
+    Values are fetched when they are first read and then kept, as the contexts of a user only live in one process at
+    a time. Changes are written by `write_to` (see `core.writebehind`): assigned and deleted keys, and values that
+    have been read and modified in place since they were last written, which is detected by comparing their encoding.
+    Only the keys that have been assigned or read since the last write are encoded again, and only the changed fields
+    are written, so a large value (e.g. the `Counter` of used templates) does not have to be encoded or written
+    whenever some other key changes.
+
+    The fields are stored like those of `redis_collections.Dict`, so hashes written by a `SyncableDict` can be read.
+    """
+
+    def __init__(self, redis: StrictRedis, key: str, codec: CompactCodec = None):
+        self.redis = redis
+        self.key = key
+        self.codec = codec or CompactCodec()
+
+        self._lock = threading.RLock()
+        self._cache = {}  # type: Dict[Any, Any]
+        # Encodings of the cached values as they are stored in redis, None for values that have not been written
+        self._stored = {}  # type: Dict[Any, bytes]
+        self._missing = set()  # type: Set
+        self._deleted = set()  # type: Set
+        self._cleared = False
+        self._clears = 0
+        self._complete = False
+        # Keys that have been assigned or read since they were last written, mapped to the version of that access
+        self._touched = {}  # type: Dict[Any, int]
+        self._version = 0
+
+        self.fetches = 0
+
+    @staticmethod
+    def _field(key) -> bytes:
+        return pickle.dumps(key)
+
+    def _touch(self, key, value):
+        if not isinstance(value, IMMUTABLE_TYPES):
+            self._version += 1
+            self._touched[key] = self._version
+
+    @property
+    def has_changes(self) -> bool:
+        """ Whether a value may have changed since the last write """
+        return bool(self._touched or self._deleted or self._cleared)
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value = self._cache[key]
+                # It may be modified in place by the caller
+                self._touch(key, value)
+                return value
+            except KeyError:
+                pass
+            if self._complete or key in self._missing:
+                raise KeyError(key)
+            self.fetches += 1
+            data = self.redis.hget(self.key, self._field(key))
+            if data is None:
+                self._missing.add(key)
+                raise KeyError(key)
+            self._cache[key] = value = self.codec.loads(data)
+            self._stored[key] = data
+            self._touch(key, value)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._stored.setdefault(key, None)
+            self._version += 1
+            self._touched[key] = self._version
+            self._missing.discard(key)
+            self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._cache.pop(key, None)
+            self._stored.pop(key, None)
+            self._touched.pop(key, None)
+            self._missing.add(key)
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        with self._lock:
+            self._load_all()
+            return iter(list(self._cache))
+
+    def __len__(self):
+        with self._lock:
+            self._load_all()
+            return len(self._cache)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._stored.clear()
+            self._touched.clear()
+            self._missing.clear()
+            self._deleted.clear()
+            self._cleared = True
+            self._clears += 1
+            self._complete = True
+
+    def _load_all(self):
+        if self._complete:
+            return
+        self.fetches += 1
+        for field, data in self.redis.hgetall(self.key).items():
+            key = pickle.loads(field)
+            if key not in self._cache and key not in self._deleted:
+                self._cache[key] = self.codec.loads(data)
+                self._stored[key] = data
+        self._missing.clear()
+        self._complete = True
+
+    def write_to(self, pipe) -> Callable[[], None]:
+        """
+        Adds the changes since the last write to `pipe` and returns a function to call once `pipe` has been executed.
+        If it fails, the same changes are written by the next call.
+        """
+        with self._lock:
+            cleared, clears = self._cleared, self._clears
+            deleted = set(self._deleted)
+            touched = dict(self._touched)
+            changed = {}
+            for key in (list(self._cache) if cleared else list(touched)):
+                try:
+                    data = self.codec.dumps(self._cache[key])
+                except RuntimeError:
+                    # Modified in place by a turn at the same time, compared again with the next write
+                    touched.pop(key, None)
+                    continue
+                if cleared or data != self._stored.get(key):
+                    changed[key] = data
+
+        if cleared:
+            pipe.delete(self.key)
+        elif deleted:
+            pipe.hdel(self.key, *(self._field(k) for k in deleted))
+        if changed:
+            pipe.hmset(self.key, {self._field(k): data for k, data in changed.items()})
+
+        def commit():
+            with self._lock:
+                if cleared and self._clears == clears:
+                    self._cleared = False
+                self._deleted -= deleted
+                for key, version in touched.items():
+                    # Unless it has been accessed again in the meantime
+                    if self._touched.get(key) == version:
+                        del self._touched[key]
+                for key, data in changed.items():
+                    if key in self._stored:
+                        self._stored[key] = data
+
+        return commit
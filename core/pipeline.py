@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Tuple
+
+
+class Stage:
+    """
+    A step of the turn pipeline with its own, independently sized thread pool.
+
+    Keeps track of how many calls are waiting for a worker (`queued`), how many are being executed (`active`) and how
+    long they take, so that a stage that limits the throughput can be spotted.
+    """
+
+    def __init__(self, name: str, workers: int):
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker.")
+        self.name = name
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self._busy_seconds = 0.0
+
+    def submit(self, func: Callable, *args) -> Future:
+        with self._lock:
+            self.queued += 1
+        return self._executor.submit(self._execute, func, args)
+
+    def _execute(self, func: Callable, args: tuple):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        started = time.monotonic()
+        failed = False
+        try:
+            return func(*args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.failed += failed
+                self._busy_seconds += time.monotonic() - started
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                workers=self.workers,
+                queued=self.queued,
+                active=self.active,
+                completed=self.completed,
+                failed=self.failed,
+                avg_seconds=self._busy_seconds / self.completed if self.completed else 0.0,
+            )
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+class StagedPipeline:
+    """
+    Runs the turns of the `DialogManager` in three stages: language understanding (network-bound), planning and
+    rendering of the response (CPU-bound) and delivery (network-bound, with delays between messages).
+
+    Each stage has its own thread pool, so a slow NLU service or long typing delays only occupy the workers of their
+    own stage. A turn moves from one stage to the next without blocking a thread while it waits in between.
+    """
+
+    def __init__(self, nlu_workers: int = 8, planning_workers: int = 2, delivery_workers: int = 8):
+        self.nlu = Stage('nlu', nlu_workers)
+        self.planning = Stage('planning', planning_workers)
+        self.delivery = Stage('delivery', delivery_workers)
+
+    @property
+    def stages(self) -> Tuple[Stage, ...]:
+        return self.nlu, self.planning, self.delivery
+
+    def run(self, *steps: Tuple[Stage, Callable], value=None) -> Future:
+        """
+        Executes `steps` one after another, each on its stage, and returns a future for the result of the last step.
+        Every step is called with the result of the previous one (the first with `value`). A step that returns None
+        ends the turn early.
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+        self._run_step(steps, 0, value, result)
+        return result
+
+    def _run_step(self, steps, index: int, value, result: Future):
+        if index == len(steps):
+            result.set_result(value)
+            return
+        stage, func = steps[index]
+        stage.submit(func, value).add_done_callback(partial(self._step_done, steps, index, result))
+
+    def _step_done(self, steps, index: int, result: Future, future: Future):
+        error = future.exception()
+        if error is not None:
+            result.set_exception(error)
+            return
+        value = future.result()
+        if value is None:
+            result.set_result(None)
+            return
+        self._run_step(steps, index + 1, value, result)
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def shutdown(self, wait: bool = True):
+        for stage in self.stages:
+            stage.shutdown(wait=wait)
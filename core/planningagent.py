@@ -8,3 +8,8 @@ class IPlanningAgent(metaclass=ABCMeta):
 
     @abstractmethod
     def build_next_actions(self, context) -> ResponseComposer: pass
+
+    @abstractmethod
+    def build_deferred_actions(self, context, callback) -> ResponseComposer:
+        """ Composes the response of a callback that has been deferred with `ResponseComposer.defer` """
+        pass
@@ -1,9 +1,7 @@
 import datetime
 import itertools
 import os
-import sched
 import threading
-import time
 from typing import Callable, List
 
 from logzero import logger as log
@@ -13,6 +11,8 @@ import util
 from clients.supportchannel import SupportChannel
 from core import ChatAction
 from core.dialogstates import DialogStates
+from core.dispatcher import AsyncDispatcher, Lane
+from core.timers import TimerQueue
 from model import Update
 
 
@@ -35,7 +35,9 @@ class ConversationRecorder:
             self,
             telegram_bot,
             support_channel: SupportChannel,
-            publish_trigger: Callable[[Update, List[ChatAction], DialogStates], bool] = None
+            publish_trigger: Callable[[Update, List[ChatAction], DialogStates], bool] = None,
+            timers: TimerQueue = None,
+            dispatcher: AsyncDispatcher = None
     ):
         self.bot = telegram_bot
         self.support_channel = support_channel
@@ -44,8 +46,14 @@ class ConversationRecorder:
         self.publish_trigger = publish_trigger
 
         self.date_started = datetime.datetime.now()
-        self._scheduler = sched.scheduler(time.time, time.sleep)
+        if timers is None:
+            timers = TimerQueue(workers=1, name='Recorder')
+            timers.start()
+        self._timers = timers
+        # Publishes in the background lane of the dispatcher if given, instead of on the timer thread
+        self._dispatcher = dispatcher
         self._wait_publish_events = {}
+        self._lock = threading.Lock()
 
     def record_dialog(self, update: Update, actions: List[ChatAction], dialog_states: DialogStates):
         uid = update.user.id
@@ -98,15 +106,37 @@ class ConversationRecorder:
 
         if not schedule_publish:
             return
-        if self._wait_publish_events.get(user.id, None):
+        with self._lock:
+            pending = self._wait_publish_events.get(user.id)
+            if pending:
+                pending[1].cancel()
+            timer = self._timers.call_later(
+                self.CLOSING_TIMEFRAME.total_seconds(),
+                self._publish_when_closed,
+                user
+            )
+            self._wait_publish_events[user.id] = (user, timer)
+
+    def _publish_when_closed(self, user):
+        with self._lock:
+            self._wait_publish_events.pop(user.id, None)
+        if self._dispatcher:
+            self._dispatcher.submit(user.id, self._close_and_publish, user, lane=Lane.BACKGROUND)
+        else:
+            self._close_and_publish(user)
+
+    def flush(self):
+        """
+        Saves all recordings and publishes those that are waiting for the `CLOSING_TIMEFRAME` right away.
+        """
+        with self._lock:
+            pending = list(self._wait_publish_events.values())
+            self._wait_publish_events.clear()
+        for user, timer in pending:
+            timer.cancel()
             try:
-                self._scheduler.cancel(self._wait_publish_events[user.id])
-            except ValueError:
-                pass  # Happens if we're too fast for some reason
-        self._wait_publish_events[user.id] = self._scheduler.enter(
-            int(self.CLOSING_TIMEFRAME.total_seconds()),
-            1,
-            action=self._close_and_publish,
-            argument=(user,)
-        )
-        threading.Thread(target=self._scheduler.run).start()
+                self._save(user, schedule_publish=False)
+            except Exception as e:
+                log.error(f"Saving the conversation recording of {user} failed:")
+                log.exception(e)
+            self._close_and_publish(user)
@@ -231,6 +231,13 @@ class Router(object):
             handler_list = self._flatten(handlers)
             self.states.setdefault(state, []).extend(handler_list)
 
+    def replace_rules(self, rules_dict):
+        """ Replaces all handlers in place, so that everyone holding a reference to this router sees the new rules """
+        self.states = {}
+        self.fallbacks = []
+        self.stateless = []
+        self.add_rules_dict(rules_dict)
+
     def iter_stateless_matches(self, understanding: MessageUnderstanding):
         for rule in self.stateless:
             # Non-breaking, yield all
@@ -0,0 +1,189 @@
+"""
+Compact encoding of the utterances, chat actions and dialog states that the contexts store in redis.
+
+Instead of pickling whole objects (including the `User` model that every `ChatAction` refers to), the fields of the
+registered types are written as a short JSON array behind a one-byte format version, e.g.
+`\\x01["u","hallo","hello",null,null,1520000000000000,0.9,null]`. Users are stored by their id. Values that cannot be
+encoded this way are still pickled, and pickles written by older versions are read as before, so existing keys are
+migrated with the next change of their collection (or right away with `migrate.migrate_context_encoding`).
+"""
+import collections
+import datetime
+import importlib
+import json
+import pickle
+from enum import Enum
+from typing import Any, Callable, Dict, List, Tuple
+
+from redis_collections import Deque, List as RedisList, SyncableDeque, SyncableList
+
+from core.chataction import ChatAction
+from core.understanding import MessageUnderstanding
+from model import User
+
+FORMAT_VERSION = 1
+_VERSION_PREFIX = bytes([FORMAT_VERSION])
+_SEPARATORS = (',', ':')
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# type -> (tag, encode), tag -> decode
+_encoders = {}  # type: Dict[type, Tuple[str, Callable[[Any, 'CompactCodec'], List]]]
+_decoders = {}  # type: Dict[str, Callable[[List, 'CompactCodec'], Any]]
+
+
+def register(tag: str, cls: type, encode: Callable[[Any, 'CompactCodec'], List],
+             decode: Callable[[List, 'CompactCodec'], Any]):
+    """
+    Registers the compact encoding of `cls`. `encode` returns the fields of an instance as a JSON-serializable list,
+    `decode` creates the instance from them. New fields must only be appended, so that older entries can still be
+    decoded.
+    """
+    _encoders[cls] = (tag, encode)
+    _decoders[tag] = decode
+
+
+def encode_date(date: datetime.datetime) -> int:
+    """ Returns a naive `date` as microseconds since the epoch, which (unlike a float timestamp) is exact """
+    if date is None:
+        return None
+    delta = date - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def decode_date(value: int) -> datetime.datetime:
+    return None if value is None else EPOCH + datetime.timedelta(microseconds=value)
+
+
+def encode_value(value):
+    """ Encodes plain values, tuples and enum members, which JSON does not tell apart from lists and numbers """
+    if isinstance(value, Enum):
+        cls = type(value)
+        return {'e': f'{cls.__module__}:{cls.__qualname__}', 'n': value.name}
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, tuple):
+        return {'t': [encode_value(v) for v in value]}
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {'d': {k: encode_value(v) for k, v in value.items()}}
+    raise TypeError(f"Cannot encode {type(value).__name__} compactly")
+
+
+def decode_value(value):
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if 't' in value:
+        return tuple(decode_value(v) for v in value['t'])
+    if 'd' in value:
+        return {k: decode_value(v) for k, v in value['d'].items()}
+    module, qualname = value['e'].split(':')
+    cls = importlib.import_module(module)
+    for name in qualname.split('.'):
+        cls = getattr(cls, name)
+    return cls[value['n']]
+
+
+class CompactCodec:
+    """
+    Encodes the registered types compactly and everything else with pickle. The `user` of a context is used for the
+    chat actions that are sent to them, so that it does not have to be loaded from the database.
+    """
+
+    def __init__(self, user: User = None):
+        self.user = user
+
+    def dumps(self, obj) -> bytes:
+        try:
+            tag, encode = _encoders[type(obj)]
+            fields = encode(obj, self)
+            return _VERSION_PREFIX + json.dumps([tag] + fields, separators=_SEPARATORS).encode('utf-8')
+        except (KeyError, TypeError, ValueError):
+            return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes):
+        if not data:
+            return None
+        if data[:1] == _VERSION_PREFIX:
+            tag, *fields = json.loads(data[1:].decode('utf-8'))
+            return _decoders[tag](fields, self)
+        # Pickled, e.g. by an older version
+        return pickle.loads(data)
+
+    def get_user(self, user_id: int) -> User:
+        if self.user is not None and self.user.id == user_id:
+            return self.user
+        if user_id is None:
+            return None
+        return User.get_or_none(User.id == user_id)
+
+
+def _encode_understanding(u: MessageUnderstanding, codec: CompactCodec) -> List:
+    return [u.text, u.intent, encode_value(u.parameters), encode_value(u.contexts), encode_date(u.date), u.score,
+            u.media_location]
+
+
+def _decode_understanding(fields: List, codec: CompactCodec) -> MessageUnderstanding:
+    text, intent, parameters, contexts, date, score, media_location = fields[:7]
+    return MessageUnderstanding(text, intent, parameters=decode_value(parameters), contexts=decode_value(contexts),
+                                date=decode_date(date), score=score, media_location=media_location)
+
+
+def _encode_action(a: ChatAction, codec: CompactCodec) -> List:
+    return [a.action_type.value, a.peer.id if a.peer is not None else None, a.text_parts, a.intents, a.media_id,
+            encode_value(a.choices), a.choice_intents, a.show_typing,
+            a.delay.name if isinstance(a.delay, ChatAction.Delay) else a.delay, encode_date(a.date)]
+
+
+def _decode_action(fields: List, codec: CompactCodec) -> ChatAction:
+    action_type, peer_id, text_parts, intents, media_id, choices, choice_intents, show_typing, delay, date = \
+        fields[:10]
+    action = ChatAction(ChatAction.Type(action_type), peer=codec.get_user(peer_id), intents=intents,
+                        media_id=media_id, choices=decode_value(choices), choice_intents=choice_intents,
+                        show_typing=show_typing, delay=ChatAction.Delay[delay] if isinstance(delay, str) else delay)
+    action.text_parts = text_parts
+    action.date = decode_date(date)
+    return action
+
+
+register('u', MessageUnderstanding, _encode_understanding, _decode_understanding)
+register('a', ChatAction, _encode_action, _decode_action)
+
+
+class _CompactCollection:
+    """ Mixin for the redis collections that stores their items with a `CompactCodec` """
+    codec = None  # type: CompactCodec
+
+    def _pickle(self, data):
+        return self.codec.dumps(data)
+
+    def _unpickle(self, pickled_data):
+        return self.codec.loads(pickled_data)
+
+
+class CompactDeque(_CompactCollection, Deque):
+    def __init__(self, *args, codec: CompactCodec = None, **kwargs):
+        self.codec = codec or CompactCodec()
+        super().__init__(*args, **kwargs)
+
+
+class CompactList(_CompactCollection, RedisList):
+    def __init__(self, *args, codec: CompactCodec = None, **kwargs):
+        self.codec = codec or CompactCodec()
+        super().__init__(*args, **kwargs)
+
+
+class CompactSyncableDeque(SyncableDeque):
+    def __init__(self, iterable=None, maxlen=None, codec: CompactCodec = None, **kwargs):
+        self.persistence = CompactDeque(iterable=iterable, maxlen=maxlen, codec=codec, **kwargs)
+        collections.deque.__init__(self, maxlen=self.persistence.maxlen)
+        self.extend(self.persistence)
+
+
+class CompactSyncableList(SyncableList):
+    def __init__(self, codec: CompactCodec = None, **kwargs):
+        self.persistence = CompactList(codec=codec, **kwargs)
+        list.__init__(self)
+        self.extend(self.persistence)
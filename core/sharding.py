@@ -0,0 +1,101 @@
+import bisect
+import hashlib
+import multiprocessing
+import time
+from typing import Callable, Hashable, Iterable, List
+
+from logzero import logger as log
+
+
+class ConsistentHashRing:
+    """
+    Maps keys (e.g. user ids) to nodes by consistent hashing.
+
+    Each node is placed on the ring `replicas` times, so that keys are spread evenly and only a small share of them
+    moves to another node when the number of nodes changes.
+    """
+
+    def __init__(self, nodes: Iterable[Hashable], replicas: int = 100):
+        self.replicas = replicas
+        self._ring = {}
+        self._sorted_hashes = []  # type: List[int]
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(value) -> int:
+        return int(hashlib.md5(str(value).encode('utf-8')).hexdigest(), 16)
+
+    def add_node(self, node: Hashable):
+        for i in range(self.replicas):
+            h = self._hash(f'{node}:{i}')
+            self._ring[h] = node
+            bisect.insort(self._sorted_hashes, h)
+
+    def remove_node(self, node: Hashable):
+        for i in range(self.replicas):
+            h = self._hash(f'{node}:{i}')
+            del self._ring[h]
+            self._sorted_hashes.remove(h)
+
+    def get_node(self, key: Hashable):
+        if not self._sorted_hashes:
+            raise ValueError("The hash ring has no nodes.")
+        idx = bisect.bisect(self._sorted_hashes, self._hash(key)) % len(self._sorted_hashes)
+        return self._ring[self._sorted_hashes[idx]]
+
+
+class ShardRouter:
+    """
+    Distributes incoming work items over `num_shards` worker processes by consistent hashing on a key.
+
+    Every worker consumes its own queue in order, so all items with the same key are processed by the same worker in
+    the order they were routed. `worker_target(shard_index, queue)` is run in each worker process and should return
+    when it receives `None` from the queue.
+    """
+
+    def __init__(self, num_shards: int, worker_target: Callable, replicas: int = 100):
+        if num_shards < 1:
+            raise ValueError("At least one shard is required.")
+        self.num_shards = num_shards
+        self.ring = ConsistentHashRing(range(num_shards), replicas=replicas)
+        self.queues = [multiprocessing.Queue() for _ in range(num_shards)]
+        self.processes = [
+            multiprocessing.Process(
+                target=worker_target,
+                args=(i, self.queues[i]),
+                name=f'Shard-{i}',
+                daemon=True
+            ) for i in range(num_shards)
+        ]
+        self._stopped = False
+
+    def start(self):
+        for p in self.processes:
+            p.start()
+        log.info(f"Started {self.num_shards} shard workers.")
+
+    def stop(self, timeout: float = None) -> bool:
+        """
+        Tells every worker to stop after the items that have already been routed to it, and waits up to `timeout`
+        seconds in total for all of them. Returns False if some worker was still running. Stopping again does nothing.
+        """
+        if self._stopped:
+            return all(not p.is_alive() for p in self.processes)
+        self._stopped = True
+
+        for q in self.queues:
+            q.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for p in self.processes:
+            p.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        running = [p.name for p in self.processes if p.is_alive()]
+        if running:
+            log.warning(f"Shard workers {', '.join(running)} were still running when stopping timed out.")
+        return not running
+
+    def shard_for(self, key: Hashable) -> int:
+        return self.ring.get_node(key)
+
+    def route(self, key: Hashable, item):
+        self.queues[self.shard_for(key)].put(item)
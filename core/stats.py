@@ -0,0 +1,20 @@
+"""
+Registry for runtime statistics (queue depths, counters, etc.) of the components of a running bot.
+The collected values are served as JSON under the `/stats` endpoint.
+"""
+from typing import Callable, Dict
+
+_providers = {}  # type: Dict[str, Callable[[], dict]]
+
+
+def register(name: str, provider: Callable[[], dict]):
+    """ Registers a callable that returns the current statistics of a component under `name` """
+    _providers[name] = provider
+
+
+def unregister(name: str):
+    _providers.pop(name, None)
+
+
+def collect() -> Dict[str, dict]:
+    return {name: provider() for name, provider in _providers.items()}
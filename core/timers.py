@@ -0,0 +1,103 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from logzero import logger as log
+
+
+class Timer:
+    """
+    Handle for a call scheduled on a `TimerQueue`.
+    """
+    __slots__ = ('due', 'func', 'args', 'cancelled')
+
+    def __init__(self, due: float, func: Callable, args: tuple):
+        self.due = due
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """
+    Central, heap-based timer for calls that should happen at a later point in time.
+
+    A single thread waits for the next due timer, so no thread is held by a pending call. Due calls are executed on a
+    small pool of `workers`, which keeps slow callbacks (e.g. network requests) from delaying the timer itself.
+    """
+
+    def __init__(self, workers: int = 4, name: str = 'TimerQueue'):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()  # tie-breaker to keep insertion order for equal due times
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = None  # type: threading.Thread
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+    def call_later(self, delay: float, func: Callable, *args) -> Timer:
+        """ Schedules `func` to be called with `args` after `delay` seconds """
+        timer = Timer(time.monotonic() + max(delay or 0, 0), func, args)
+        with self._condition:
+            heapq.heappush(self._heap, (timer.due, next(self._counter), timer))
+            if self._heap[0][2] is timer:
+                # New earliest timer, wake up the waiting thread
+                self._condition.notify()
+        return timer
+
+    def call_soon(self, func: Callable, *args) -> Timer:
+        return self.call_later(0, func, *args)
+
+    def __len__(self):
+        return sum(1 for _, _, t in self._heap if not t.cancelled)
+
+    def _run(self):
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due, _, timer = self._heap[0]
+                timeout = due - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+
+                heapq.heappop(self._heap)
+                if not timer.cancelled:
+                    self._executor.submit(self._execute, timer)
+
+    @staticmethod
+    def _execute(timer: Timer):
+        try:
+            timer.func(*timer.args)
+        except Exception as e:
+            log.error(f"Error in timer callback {getattr(timer.func, '__name__', timer.func)}:")
+            log.exception(e)
@@ -0,0 +1,54 @@
+import threading
+from contextlib import contextmanager
+
+
+class TurnGate:
+    """
+    Readers-writer lock between the turns of the `DialogManager` and operations that need to run while no turn is in
+    progress, such as swapping in reloaded templates and rules.
+
+    Any number of turns may hold the gate at the same time. An `exclusive` section waits until all running turns have
+    left the gate and keeps new turns from entering meanwhile, so it is not starved by a steady stream of turns.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._turns = 0
+        self._exclusive = False
+        self._waiting_exclusive = 0
+
+    @property
+    def turns(self) -> int:
+        """ Number of turns currently inside the gate """
+        return self._turns
+
+    @contextmanager
+    def turn(self):
+        with self._condition:
+            while self._exclusive or self._waiting_exclusive:
+                self._condition.wait()
+            self._turns += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._turns -= 1
+                if self._turns == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting_exclusive += 1
+            try:
+                while self._exclusive or self._turns:
+                    self._condition.wait()
+            finally:
+                self._waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
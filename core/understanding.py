@@ -1,11 +1,14 @@
 import datetime
 
-from typing import Dict
+from typing import Any, Callable, Dict
 
 
 class MessageUnderstanding:
     """
     Data holding class for an incoming utterance, enriched with NLU information.
+
+    Values that are parsed from the text (dates, names, devices, ...) are memoized with `extract`, so that each
+    parser runs at most once per utterance, no matter how often a turn is re-evaluated. They are not serialized.
     """
 
     def __init__(
@@ -20,13 +23,32 @@ class MessageUnderstanding:
         self.text = text
         self.intent = intent
         self.parameters = parameters if parameters else None
-        self.contexts = contexts if contexts else None,
+        self.contexts = contexts if contexts else None
         self.score = score
         self.date = date if date else datetime.datetime.now()
         self.media_location = media_location
+        self._extractions = {}  # type: Dict[str, Any]
+
+    def extract(self, key: str, parser: Callable[[str], Any]) -> Any:
+        """ Returns `parser(self.text)`, computed only on the first call with the same `key` """
+        # Instances restored from redis or older pickles have no memo yet
+        extractions = self.__dict__.setdefault('_extractions', {})
+        try:
+            return extractions[key]
+        except KeyError:
+            value = extractions[key] = parser(self.text)
+            return value
+
+    def clear_extractions(self):
+        self._extractions = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_extractions', None)
+        return state
 
     def __str__(self):
         params = {k: v for k, v in self.parameters.items() if v} if self.parameters else None
         return f"Understanding('{self.intent}'" \
                f"{', ' + str(params) if params else ''})" \
-               f"{', ' + str(self.contexts) if any(self.contexts) else ''}"
+               f"{', ' + str(self.contexts) if self.contexts else ''}"
@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Union
+
+from logzero import logger as log
+from redis import StrictRedis
+from redis_collections import SyncableDeque, SyncableDict, SyncableList
+
+from core.kvstore import RedisHashStore
+from core.timers import Timer, TimerQueue
+
+Syncable = Union[SyncableDict, SyncableDeque, SyncableList, RedisHashStore]
+
+
+class WriteBehindFlusher:
+    """
+    Writes the modified redis collections of all contexts (utterances, values and dialog states) in the background.
+
+    Instead of syncing a collection with redis on every change, its owner marks it as dirty. All dirty collections are
+    written together every `interval` seconds, or as soon as `max_pending` collections are dirty, in a single
+    pipeline. A collection that is changed again before the next flush is only written once.
+
+    Without `timers`, every change is written right away. Call `flush` to write the pending changes, e.g. when
+    shutting down.
+    """
+
+    def __init__(self, redis: StrictRedis, timers: TimerQueue = None, interval: float = 5.0, max_pending: int = 200):
+        self.redis = redis
+        self._timers = timers
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        # Serializes the flushes, so that an older snapshot of a collection never overwrites a newer one
+        self._flush_lock = threading.Lock()
+        self._dirty = OrderedDict()  # type: Dict[str, Syncable]
+        # Collections of the flush that is being written
+        self._in_flight = {}  # type: Dict[str, Syncable]
+        self._timer = None  # type: Timer
+        self._urgent = False
+
+        self.flushes = 0
+        self.written = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def mark_dirty(self, collection: Syncable):
+        with self._lock:
+            if collection.key in self._dirty:
+                self.coalesced += 1
+            self._dirty[collection.key] = collection
+            if self._timers is None:
+                flush_now = True
+            elif len(self._dirty) >= self.max_pending and not self._urgent:
+                self._urgent = True
+                self._timers.call_soon(self.flush)
+                flush_now = False
+            else:
+                if self._timer is None:
+                    self._timer = self._timers.call_later(self.interval, self.flush)
+                flush_now = False
+        if flush_now:
+            self.flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def is_pending(self, key: str) -> bool:
+        """ Returns whether changes of the collection at `key` have not been written yet """
+        return key in self._dirty or key in self._in_flight
+
+    def flush(self) -> int:
+        """ Writes all dirty collections to redis and returns how many have been written """
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, OrderedDict()
+                self._in_flight = dirty
+                if self._timer:
+                    self._timer.cancel()
+                    self._timer = None
+                self._urgent = False
+            if not dirty:
+                return 0
+
+            pipe = self.redis.pipeline(transaction=False)
+            commits = []
+            failed = OrderedDict()  # type: Dict[str, Syncable]
+            written = False
+            try:
+                for key, collection in dirty.items():
+                    try:
+                        commits.append(self._write(pipe, collection))
+                    except Exception as e:
+                        # Only this collection is retried, the others are still written
+                        self.errors += 1
+                        log.error(f"Encoding the context collection {key} failed, retrying with the next flush:")
+                        log.exception(e)
+                        failed[key] = collection
+                if len(failed) < len(dirty):
+                    pipe.execute()
+                written = True
+            except Exception as e:
+                self.errors += 1
+                log.error(f"Writing {len(dirty)} context collections to redis failed, retrying with the next flush:")
+                log.exception(e)
+            finally:
+                self._retry(failed if written else dirty)
+                self._in_flight = {}
+            if not written:
+                return 0
+
+            for commit in commits:
+                if commit:
+                    commit()
+            count = len(dirty) - len(failed)
+            if count:
+                self.flushes += 1
+                self.written += count
+            return count
+
+    def _retry(self, dirty: Dict[str, Syncable]):
+        if not dirty:
+            return
+        with self._lock:
+            for key, collection in dirty.items():
+                self._dirty.setdefault(key, collection)
+            if self._timers is not None and self._timer is None:
+                self._timer = self._timers.call_later(self.interval, self.flush)
+
+    @staticmethod
+    def _write(pipe, collection: Syncable) -> Optional[Callable[[], None]]:
+        """ Replaces the contents of `collection` in redis like its `sync` method does, but on `pipe` """
+        if isinstance(collection, RedisHashStore):
+            # Writes only the changed fields
+            return collection.write_to(pipe)
+
+        persistence = collection.persistence
+        # Copying a builtin collection does not release the GIL, so the snapshot is consistent even if the turn of the
+        # user changes it at the same time. Everything is encoded before the first command is added to `pipe`, so
+        # that a value that cannot be encoded leaves the stored collection as it is.
+        if isinstance(collection, SyncableDict):
+            encoded = {persistence._pickle_key(k): persistence._pickle_value(v) for k, v in dict(collection).items()}
+            pipe.delete(persistence.key)
+            if encoded:
+                pipe.hmset(persistence.key, encoded)
+        else:
+            encoded = [persistence._pickle(v) for v in list(collection)]
+            pipe.delete(persistence.key)
+            if encoded:
+                pipe.rpush(persistence.key, *encoded)
+
+    def stats(self) -> dict:
+        return dict(
+            pending=self.pending,
+            flushes=self.flushes,
+            written=self.written,
+            coalesced=self.coalesced,
+            errors=self.errors,
+        )
@@ -11,12 +11,19 @@ env = Environment(
 )
 
 _TEMPLATES_DIR = 'templates'
-_files = os.listdir(os.path.join(PATH, _TEMPLATES_DIR))
-_yml_files = [x for x in _files if os.path.splitext(x)[1] in ('.yml', '.yaml')]
-
-# Construct ResponseTemplate objects
-raw_templates = dict()
-for yml_file in _yml_files:
-    loaded_yml = util.load_yaml_as_dict(os.path.join(PATH, _TEMPLATES_DIR, yml_file))
-    if loaded_yml:
-        raw_templates.update(loaded_yml)
+
+
+def load_raw_templates() -> dict:
+    """ Reads the raw response templates from all YAML files in the templates directory """
+    files = os.listdir(os.path.join(PATH, _TEMPLATES_DIR))
+    yml_files = [x for x in files if os.path.splitext(x)[1] in ('.yml', '.yaml')]
+
+    result = dict()
+    for yml_file in yml_files:
+        loaded_yml = util.load_yaml_as_dict(os.path.join(PATH, _TEMPLATES_DIR, yml_file))
+        if loaded_yml:
+            result.update(loaded_yml)
+    return result
+
+
+raw_templates = load_raw_templates()
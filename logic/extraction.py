@@ -0,0 +1,89 @@
+"""
+Parsers for the values that answer checkers and template conditions extract from the user's text. Use `extract` to
+run them at most once per `MessageUnderstanding`.
+"""
+import datetime
+import re
+import traceback
+from collections import namedtuple
+from typing import Any, List, Optional
+
+import dateparser
+import regex
+
+from core.understanding import MessageUnderstanding
+from corpus import phones
+from logic.germandates import parse_german_date
+
+FirstLastName = namedtuple("FirstLastName", ["first_name", "last_name"])
+
+
+def parse_date(text: str) -> Optional[datetime.datetime]:
+    result = parse_german_date(text)
+    if result:
+        return result
+
+    # Slow path for everything else
+    answer = text.lower()
+
+    try:
+        answer = answer.replace(" uhr", ":00")
+
+        result = dateparser.parse(answer, languages=['de'])
+        if result:
+            return result
+
+        # Perform some very naive transformations to try get the string to parse
+        answer = re.sub(r'(um|bis|am)', "", answer, re.IGNORECASE)
+        result = dateparser.parse(answer, languages=['de'])
+        if result:
+            return result
+
+        answer = re.sub(r'[a-zA-ZöäüÖÄÜ]', "", answer)
+        return dateparser.parse(answer, languages=['de'])
+    except:
+        traceback.print_exc()
+        return None
+
+
+def parse_names(text: str) -> Optional[FirstLastName]:
+    # https://stackoverflow.com/questions/44460642/python-regex-duplicate-names-in-named-groups
+    match = regex.match(r'^(?|'
+                        r'(?P<last_name>(?:\s?\S+){1,3}), (?P<first_name>\w+)'
+                        r'|(?P<first_name>\w+) (?P<last_name>(?:\s?\S+){1,3})'
+                        r')$', text, regex.MULTILINE)
+
+    if not match:
+        return None
+
+    names = match.groupdict()
+    last_name_parts = names['last_name'].strip().split()
+
+    if len(last_name_parts) == 1:
+        last_name = last_name_parts[0].title()
+    else:
+        # Uppercase last word of the last name
+        last_name = ' '.join(last_name_parts[:-1]) + ' ' + last_name_parts[-1].title()
+
+    return FirstLastName(
+        first_name=names['first_name'].strip().title(),
+        last_name=last_name
+    )
+
+
+def find_devices(text: str) -> List[tuple]:
+    return phones.devices_by_name(text)
+
+
+EXTRACTORS = {
+    'date': parse_date,
+    'names': parse_names,
+    'devices': find_devices,
+}
+
+
+def extract(understanding: MessageUnderstanding, key: str) -> Any:
+    """ Returns the value named `key` (one of `EXTRACTORS`) from the text of `understanding` """
+    if understanding is None or not understanding.text:
+        return None
+    return understanding.extract(key, EXTRACTORS[key])
@@ -0,0 +1,121 @@
+"""
+Reloads the response templates, questionnaires and dialog rules of a running bot without restarting the process.
+"""
+import importlib
+import itertools
+import threading
+import time
+
+from logzero import logger as log
+
+from core.context import ContextManager
+from core.routing import Router
+from core.turngate import TurnGate
+
+# Modules that define the handlers of the `application_router` and the parsers they use, in the order they need to be
+# reloaded. The `PlanningAgent` looks up its own fallback handlers on these modules.
+RULE_MODULES = (
+    'logic.germandates',
+    'logic.extraction',
+    'logic.rules.answercheckers',
+    'logic.rules.progresstracker',
+    'logic.rules.claimhandlers',
+    'logic.rules.smalltalkhandlers',
+    'logic.rules.adminhandlers',
+    'logic.rules.dialogcontroller',
+)
+
+
+class HotReloader:
+    """
+    Rebuilds `all_response_templates`, `all_questionnaires` and the rules of the `router` and swaps them in between
+    two turns.
+
+    The templates and questionnaires are parsed in the background while turns continue to be served. Only the swap
+    itself (and the reimport of the rule modules, whose globals running handlers would otherwise see half-updated)
+    happens with the `turn_gate` held exclusively. The collections are replaced in place, so that all modules holding
+    a reference to them see the new contents. If anything fails to load, the old corpus and rules stay in place.
+    """
+
+    def __init__(self, router: Router, turn_gate: TurnGate, context_manager: ContextManager = None):
+        self.router = router
+        self.turn_gate = turn_gate
+        self.context_manager = context_manager
+        self._lock = threading.Lock()
+
+        self.reloads = 0
+        self.last_reload = None
+        self.last_duration = None
+        self.last_error = None
+
+    def reload(self) -> bool:
+        """ Reloads everything on the current thread. Returns False if the reload failed. """
+        with self._lock:
+            started = time.monotonic()
+            try:
+                self._reload()
+            except Exception as e:
+                log.error("Hot reload failed, keeping the current corpus and rules:")
+                log.exception(e)
+                self.last_error = repr(e)
+                return False
+
+            self.reloads += 1
+            self.last_reload = time.time()
+            self.last_duration = time.monotonic() - started
+            self.last_error = None
+            log.info(f"Reloaded corpus and rules in {self.last_duration:.2f} seconds.")
+            return True
+
+    def reload_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.reload, name='HotReload', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return dict(
+            reloads=self.reloads,
+            last_reload=self.last_reload,
+            last_duration=self.last_duration,
+            last_error=self.last_error,
+        )
+
+    def _reload(self):
+        import corpus
+        from corpus import questions, responsetemplates
+
+        # Expensive parsing and compilation, while turns continue to be served
+        raw_templates = corpus.load_raw_templates()
+        templates = responsetemplates.load_templates(raw_templates)
+        questionnaires = questions.load_questionnaires()
+
+        with self.turn_gate.exclusive():
+            rule_modules = [importlib.reload(importlib.import_module(m)) for m in RULE_MODULES]
+            dialogcontroller = rule_modules[-1]
+
+            corpus.raw_templates.clear()
+            corpus.raw_templates.update(raw_templates)
+            responsetemplates.all_response_templates.clear()
+            responsetemplates.all_response_templates.update(templates)
+            questions.all_questionnaires[:] = questionnaires
+            questions.all_questions[:] = itertools.chain.from_iterable(q.questions for q in questionnaires)
+
+            self.router.replace_rules(dialogcontroller.RULES)
+            # The reimported module created a new router, but everyone else holds a reference to ours
+            dialogcontroller.application_router = self.router
+
+            if self.context_manager:
+                self.context_manager.refresh_question_contexts()
+
+
+_reloader = None  # type: HotReloader
+
+
+def install(reloader: HotReloader):
+    """ Makes `reloader` available to the admin handlers """
+    global _reloader
+    _reloader = reloader
+
+
+def get_reloader() -> HotReloader:
+    return _reloader
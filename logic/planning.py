@@ -11,9 +11,9 @@ from core.dialogmanager import StopPropagation
 from core.planningagent import IPlanningAgent
 from core.routing import Router
 from corpus.responsetemplates import ResponseTemplate, SelectiveTemplateLoader, TemplateRenderer, TemplateSelector
+from logic import extraction
 from logic.responsecomposer import ResponseComposer
-from logic.rules.claimhandlers import excuse_did_not_understand
-from logic.rules.smalltalkhandlers import no_rule_found
+from logic.rules import claimhandlers, smalltalkhandlers
 from model import UserAnswers
 from util import timing
 
@@ -50,9 +50,9 @@ class PlanningAgent(IPlanningAgent):
             question=context.current_question,
             questionnaire=context.current_questionnaire,
             overall_completion=context.overall_completion_ratio,
-            num_actions=lambda intent: len(context.filter_outgoing_utterances(
-                lambda ca: intent in ca.intents, 12)),
+            num_actions=lambda intent: context.count_outgoing_intent(intent, 12),
             get=lambda key: context.get(key, None),
+            extracted=lambda key: extraction.extract(context.last_user_utterance, key),
             formal=context.user.formal_address,
             informal=not context.user.formal_address,
             chance=chance,
@@ -128,12 +128,13 @@ class PlanningAgent(IPlanningAgent):
 
         if not handler_found:
             if u.intent == 'fallback':
-                excuse_did_not_understand(composer, context)
+                # Looked up on the module, so that a hot reload replaces the handler
+                claimhandlers.excuse_did_not_understand(composer, context)
                 log.debug(f'Incoming message was not understood: "{u.text}"')
                 log.debug("Not updating state lifetimes.")
                 return composer
             else:
-                next_state = no_rule_found(composer, context)
+                next_state = smalltalkhandlers.no_rule_found(composer, context)
 
         if isinstance(next_state, ResponseComposer):
             # Lambdas return the sentence composer, which we don't need (call by reference)
@@ -149,6 +150,12 @@ class PlanningAgent(IPlanningAgent):
         self._log_actions(composer)
         return composer
 
+    def build_deferred_actions(self, context: Context, callback) -> ResponseComposer:
+        composer = self._create_composer(context)
+        callback(composer, context)
+        self._log_actions(composer)
+        return composer
+
     @staticmethod
     def _log_actions(composer):
         text = ', then '.join(f'"{x.render()}"' for x in composer.collect_actions())
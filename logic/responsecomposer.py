@@ -1,8 +1,10 @@
 import string
-from typing import List, Union
+from typing import Callable, List, Tuple, Union
 
 import util
 from core import ChatAction
+from core.choices import choice_intent
+from core.dispatcher import Lane
 from corpus.questions import Question, Questionnaire
 from corpus.responsetemplates import ResponseTemplate, SelectiveTemplateLoader, TemplateRenderer, format_intent
 from model import User
@@ -23,6 +25,7 @@ class ResponseComposer:
 
         self._sequence = []  # type: List[ChatAction]
         self._inside_sentence = False
+        self.deferred = []  # type: List[Tuple[Lane, Callable]]
 
     def collect_actions(self) -> List[ChatAction]:
         # Calculating delays based on the message length.
@@ -35,6 +38,13 @@ class ResponseComposer:
             a.delay = human_delay
         return self._sequence
 
+    def defer(self, callback: Callable, lane: Lane = Lane.BULK):
+        """
+        Runs `callback(r, c)` after the current turn in the given priority `lane`, so that heavy operations do not
+        delay the responses to other users. The actions it composes are sent to the same peer afterwards.
+        """
+        self.deferred.append((lane, callback))
+
     @property
     def is_empty(self):
         return len(self._sequence) == 0
@@ -241,13 +251,20 @@ class ResponseComposer:
         else:
             raise ValueError(f"Incompatible type of question: {type(question)}")
 
+        choice_intents = {}
         if choices:
-            choices = [self.renderer.load_and_render(x, safe=True) for x in choices]
+            rendered = [self.renderer.load_and_render(x, safe=True) for x in choices]
+            # Remember which intent a button stands for, so that pressing it does not need to be understood by NLU
+            choice_intents = {r: choice_intent(x) for x, r in zip(choices, rendered) if choice_intent(x)}
+            choices = rendered
 
         question_id = question.id if isinstance(question, Question) else question
 
-        return self._create_action(question_id, text, choices=choices, type_=ChatAction.Type.ASKING_QUESTION,
-                                   as_new_message=as_new_message, delay=delay)
+        self._create_action(question_id, text, choices=choices, type_=ChatAction.Type.ASKING_QUESTION,
+                            as_new_message=as_new_message, delay=delay)
+        if choice_intents:
+            self._sequence[-1].choice_intents = choice_intents
+        return self
 
     def __str__(self):
         return ' then '.join(
@@ -9,7 +9,9 @@ import sys
 
 import migrate
 from core import Context
+from core.dispatcher import Lane
 from core.dialogmanager import ForceReevaluation, StopPropagation
+from logic import hotreload
 from model import User, UserAnswers
 
 
@@ -25,6 +27,18 @@ def restart_system(r, c: Context):
     os.execl(sys.executable, sys.executable, *sys.argv)
 
 
+def reload_system(r, c: Context):
+    if not is_admin(c.user):
+        return r.say("no permission")
+    reloader = hotreload.get_reloader()
+    if reloader is None:
+        return restart_system(r, c)
+    log.warning("Reloading templates, questionnaires and rules...")
+    # Waits for this turn to finish before swapping
+    reloader.reload_in_background()
+    r.say("reloading")
+
+
 def reset_database(r, c: Context, for_all=False):
     log.info("Resetting")
     if c.get("reset") is not None:
@@ -46,6 +60,11 @@ def reset_database(r, c: Context, for_all=False):
 
 
 def send_questionnaires(r, c: Context):
+    # Iterates over all users, so it is run in the bulk lane after this turn
+    r.defer(_send_all_questionnaires, lane=Lane.BULK)
+
+
+def _send_all_questionnaires(r, c: Context):
     for u in User.select():
         all_answers = UserAnswers.get_name_answer_dict(u)
         if all_answers:
@@ -1,16 +1,10 @@
 """ These are matching functions, named after question titles and are called through a getattr() expression when the
 user utters a response to a question. """
 import datetime
-import re
-import traceback
-from collections import namedtuple
 from pprint import pprint
 
-import dateparser
-import regex
-
-from corpus import phones
 from corpus.phones import format_device
+from logic.extraction import extract
 from logic.responsecomposer import ResponseComposer
 
 
@@ -25,8 +19,7 @@ def policy_nr(r, c, q):
 
 
 def model_identifier(r: ResponseComposer, c, q):
-    answer = c.last_user_utterance.text
-    results = phones.devices_by_name(answer)
+    results = extract(c.last_user_utterance, 'devices') or []
     choices = [format_device(x[0]) for x in results]
     if not results:
         r.say('no phone results')
@@ -46,64 +39,14 @@ def _check_time(r, c, answer: datetime.datetime):
 
 
 def date_and_time(r, c, q):
-    answer = c.last_user_utterance.text.lower()
-
-    try:
-        answer = answer.replace(" uhr", ":00")
-
-        result = dateparser.parse(answer, languages=['de'])
-        if result:
-            return _check_time(r, c, result)
-
-        # Perform some very naive transformations to try get the string to parse
-        answer = re.sub(r'(um|bis|am)', "", answer, re.IGNORECASE)
-        result = dateparser.parse(answer, languages=['de'])
-        if result:
-            return _check_time(r, c, result)
-
-        answer = re.sub(r'[a-zA-ZöäüÖÄÜ]', "", answer)
-        result = dateparser.parse(answer, languages=['de'])
-        if result:
-            return _check_time(r, c, result)
-
-        return False
-    except:
-        traceback.print_exc()
-        return False
-
-
-FirstLastName = namedtuple("FirstLastName", ["first_name", "last_name"])
-
-
-def _parse_names(text) -> FirstLastName:
-    # https://stackoverflow.com/questions/44460642/python-regex-duplicate-names-in-named-groups
-    match = regex.match(r'^(?|'
-                        r'(?P<last_name>(?:\s?\S+){1,3}), (?P<first_name>\w+)'
-                        r'|(?P<first_name>\w+) (?P<last_name>(?:\s?\S+){1,3})'
-                        r')$', text, regex.MULTILINE)
-
-    if not match:
-        return None
-
-    names = match.groupdict()
-    last_name_parts = names['last_name'].strip().split()
-
-    if len(last_name_parts) == 1:
-        last_name = last_name_parts[0].title()
-    else:
-        # Uppercase last word of the last name
-        last_name = ' '.join(last_name_parts[:-1]) + ' ' + last_name_parts[-1].title()
-
-    return FirstLastName(
-        first_name=names['first_name'].strip().title(),
-        last_name=last_name
-    )
+    result = extract(c.last_user_utterance, 'date')
+    if result:
+        return _check_time(r, c, result)
+    return False
 
 
 def name(r, c, question):
-    answer = c.last_user_utterance.text
-
-    names = _parse_names(answer)
+    names = extract(c.last_user_utterance, 'names')
 
     if names is None:
         r.say('sorry', 'invalid answer').give_hint(question)
@@ -27,7 +27,8 @@ RULES = {  # blueprint for state machine
 
     "stateless": [  # always viable
         IntentHandler(change_formal_address),
-        RegexHandler(restart_system, pattern=r'^/r$'),
+        RegexHandler(reload_system, pattern=r'^/r$'),
+        RegexHandler(restart_system, pattern=r'^/restart$'),
         RegexHandler(lambda r, c: reset_database(r, c, for_all=True), pattern=r'^/resetall$'),
         RegexHandler(reset_database, pattern=r'^/reset$'),
         RegexHandler(send_questionnaires, pattern=r'^/query$'),
@@ -29,6 +29,25 @@ def clear_redis(users: List[User] = None):
         conn.flushdb()
 
 
+def migrate_context_encoding(conn: StrictRedis = None) -> int:
+    """ Rewrites the utterances and dialog states of all users in the compact encoding of `core.serialization` """
+    from core.serialization import CompactCodec
+
+    conn = conn or StrictRedis.from_url(settings.REDIS_URL)
+    codec = CompactCodec()
+    migrated = 0
+    for pattern in ('*:utterances', '*:ds'):
+        for key in conn.scan_iter(match=pattern):
+            items = [codec.loads(data) for data in conn.lrange(key, 0, -1)]
+            pipe = conn.pipeline()
+            pipe.delete(key)
+            if items:
+                pipe.rpush(key, *(codec.dumps(item) for item in items))
+            pipe.execute()
+            migrated += 1
+    return migrated
+
+
 def reset_all():
     Update.drop_table(fail_silently=True, cascade=True)
     Update.create_table()
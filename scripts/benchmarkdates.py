@@ -0,0 +1,61 @@
+"""
+Measures the time per call of the German date fast path (`logic.germandates`) against `dateparser`, e.g.
+
+    python scripts/benchmarkdates.py --number 200
+
+Prints one line per input with the result and the time of both parsers, and whether the fast path answers it.
+"""
+import argparse
+import timeit
+import warnings
+
+import dateparser
+
+from logic.germandates import parse_german_date
+
+SAMPLES = [
+    "gestern um 14 Uhr",
+    "12.03.2018 15:30",
+    "heute morgen",
+    "letzten Montag abend",
+    "am 12. März",
+    "vorgestern gegen 14 Uhr 30",
+    "14:30",
+    "vor zwei Tagen",
+    "Anfang letzter Woche",
+]
+
+
+def time_per_call(func, text: str, number: int) -> float:
+    return timeit.timeit(lambda: func(text), number=number) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('texts', nargs='*', default=SAMPLES, help="Dates to parse")
+    parser.add_argument('--number', type=int, default=100, help="Calls per input and parser")
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    def slow(text):
+        return dateparser.parse(text.lower(), languages=['de'])
+
+    # The first call of dateparser loads its language data
+    slow(args.texts[0])
+
+    fast_total = slow_total = 0
+    for text in args.texts:
+        fast_time = time_per_call(parse_german_date, text, args.number)
+        slow_time = time_per_call(slow, text, args.number)
+        fast_total += fast_time
+        slow_total += slow_time
+        result = parse_german_date(text)
+        print(f"{text!r:32} fast {fast_time * 1e6:8.1f} µs, dateparser {slow_time * 1e6:8.1f} µs  "
+              f"{'->' if result else 'fallback'} {result or slow(text)}")
+
+    print(f"Mean: fast {fast_total / len(args.texts) * 1e6:.1f} µs, "
+          f"dateparser {slow_total / len(args.texts) * 1e6:.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
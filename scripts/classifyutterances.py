@@ -0,0 +1,85 @@
+"""
+Classifies the `user_says` lines of recorded conversations in bulk and writes the understandings as JSON lines, e.g.
+
+    python scripts/classifyutterances.py --engine dialogflow --parallelism 16 -o results.jsonl tmp/*/recordings/*.yml
+
+Prints the accuracy (compared to the intents that were recorded) and the latencies of the engine afterwards. The
+Dialogflow engine uses `DIALOGFLOW_BASE_URL`, so it can also be run against `scripts/nlustub.py`.
+"""
+import argparse
+import json
+import sys
+import time
+
+import settings
+from clients.localnlu import RECORDING_GLOBS, LocalNLUEngine, load_choice_examples, load_recorded_examples
+from clients.nluclients import BatchResult, DialogflowClient, NLUEngine
+
+
+def create_engine(name: str) -> NLUEngine:
+    if name == 'dialogflow':
+        return DialogflowClient(settings.DIALOGFLOW_ACCESS_TOKEN, base_url=settings.DIALOGFLOW_BASE_URL)
+    if name == 'local':
+        return LocalNLUEngine(load_recorded_examples() + load_choice_examples())
+    raise ValueError(f"Unknown engine: {name}")
+
+
+def to_json(result: BatchResult, expected_intent: str) -> str:
+    understanding = result.understanding
+    return json.dumps(dict(
+        text=result.text,
+        expected=expected_intent,
+        intent=understanding.intent if understanding else None,
+        score=understanding.score if understanding else None,
+        parameters=understanding.parameters if understanding else None,
+        latency_ms=round(result.latency * 1000, 1),
+        error=repr(result.error) if result.error else None,
+    ), ensure_ascii=False)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recordings', nargs='*', default=RECORDING_GLOBS, help="Recording files or glob patterns")
+    parser.add_argument('--engine', choices=('dialogflow', 'local'), default='dialogflow')
+    parser.add_argument('--parallelism', type=int, default=8, help="Number of requests in flight")
+    parser.add_argument('-o', '--output', help="JSONL file to write the results to (default: stdout)")
+    args = parser.parse_args()
+
+    examples = load_recorded_examples(args.recordings)
+    engine = create_engine(args.engine)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+    latencies = []
+    correct = errors = 0
+    started = time.monotonic()
+    try:
+        results = engine.understand_batch((text for text, _ in examples), parallelism=args.parallelism)
+        for (_, expected), result in zip(examples, results):
+            out.write(to_json(result, expected) + '\n')
+            latencies.append(result.latency)
+            if result.error:
+                errors += 1
+            elif result.understanding.intent == expected:
+                correct += 1
+    finally:
+        if args.output:
+            out.close()
+    duration = time.monotonic() - started
+
+    total = len(examples)
+    print(f"Classified {total} utterances in {duration:.1f} seconds ({total / max(duration, 1e-9):.1f}/s), "
+          f"{errors} errors.", file=sys.stderr)
+    if total:
+        print(f"Accuracy: {correct / total:.1%}", file=sys.stderr)
+        print(f"Latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, "
+              f"max {max(latencies) * 1000:.0f} ms", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
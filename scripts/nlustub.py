@@ -0,0 +1,168 @@
+"""
+Stub of the Dialogflow V1 query API for load tests, answering with the same JSON as the real service, e.g.
+
+    python scripts/nlustub.py --rules stub-rules.yml --latency lognormal:250:0.5 --error-rate 0.01 --port 5005
+
+and run the bot with `DIALOGFLOW_BASE_URL=http://localhost:5005/v1/`.
+
+Messages are understood by exact (case and punctuation insensitive) lookup in recorded conversations, then by the
+regular expressions of the rules file, which is a YAML list like
+
+    - match: "(handy|smartphone).*(kaputt|defekt)"
+      intent: phone_broken
+      parameters: {}
+      score: 0.9
+
+Everything else is answered with the `fallback` intent.
+
+Latencies are drawn from a distribution given as `fixed:<ms>`, `uniform:<min ms>:<max ms>`,
+`normal:<mean ms>:<stddev ms>` or `lognormal:<median ms>:<sigma>`. With `--error-rate`, requests fail with a 500
+error, and with `--hang-rate`, requests take `--hang-ms` to answer.
+"""
+import argparse
+import datetime
+import glob
+import json
+import math
+import random
+import re
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Flask, Response, request
+
+import util
+from clients.localnlu import RECORDING_GLOBS
+
+_NON_WORD = re.compile(r'[^\w\s]+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    return _WHITESPACE.sub(' ', _NON_WORD.sub(' ', text.lower())).strip()
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """ Returns a function that draws latencies in seconds from the distribution given by `spec` """
+    kind, *args = spec.split(':')
+    try:
+        args = [float(a) for a in args]
+        if kind == 'fixed':
+            value, = args
+            return lambda: value / 1000
+        if kind == 'uniform':
+            low, high = args
+            return lambda: random.uniform(low, high) / 1000
+        if kind == 'normal':
+            mean, stddev = args
+            return lambda: max(random.gauss(mean, stddev), 0) / 1000
+        if kind == 'lognormal':
+            median, sigma = args
+            return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class StubRules:
+    def __init__(self, recorded: Dict[str, Tuple[str, dict]] = None, rules: List[dict] = None):
+        self.recorded = recorded or {}
+        self.rules = [dict(rule, match=re.compile(rule['match'], re.IGNORECASE)) for rule in rules or ()]
+
+    @classmethod
+    def load(cls, rules_file: str = None, recording_patterns=RECORDING_GLOBS) -> 'StubRules':
+        recorded = {}
+        for path in sorted(set(p for pattern in recording_patterns for p in glob.glob(pattern))):
+            for entry in util.load_yaml_as_dict(path) or []:
+                text, intent = entry.get('user_says'), entry.get('intent')
+                if text and intent:
+                    recorded[normalize(text)] = (intent, dict(entry.get('parameters') or {}))
+        rules = util.load_yaml_as_dict(rules_file) if rules_file else []
+        return cls(recorded, rules)
+
+    def match(self, text: str) -> Optional[Tuple[str, dict, float]]:
+        recorded = self.recorded.get(normalize(text))
+        if recorded:
+            return recorded[0], recorded[1], 1.0
+        for rule in self.rules:
+            if rule['match'].search(text):
+                return rule['intent'], dict(rule.get('parameters') or {}), rule.get('score', 1.0)
+        return None
+
+
+def json_response(data: dict, status_code: int = 200) -> Response:
+    return Response(json.dumps(data), status=status_code, mimetype='application/json')
+
+
+def create_app(rules: StubRules,
+               latency: Callable[[], float] = lambda: 0,
+               error_rate: float = 0.0,
+               hang_rate: float = 0.0,
+               hang_time: float = 30.0) -> Flask:
+    app = Flask(__name__)
+    app.config['stats'] = stats = dict(requests=0, errors=0, hangs=0)
+
+    @app.route('/v1/query', methods=['POST'])
+    def query():
+        stats['requests'] += 1
+        data = json.loads(request.get_data(as_text=True))
+        dice = random.random()
+        if dice < hang_rate:
+            stats['hangs'] += 1
+            time.sleep(hang_time)
+        else:
+            time.sleep(latency())
+
+        if dice >= 1 - error_rate:
+            stats['errors'] += 1
+            error = dict(id=str(uuid.uuid4()), status=dict(code=500, errorType='internal_server_error'))
+            return json_response(error, 500)
+
+        text = data.get('query') or ''
+        intent, parameters, score = rules.match(text) or ('fallback', {}, 0.0)
+        return json_response(dict(
+            id=str(uuid.uuid4()),
+            timestamp=datetime.datetime.utcnow().isoformat() + 'Z',
+            lang=data.get('lang', 'de'),
+            sessionId=data.get('sessionId'),
+            status=dict(code=200, errorType='success'),
+            result=dict(
+                source='agent',
+                resolvedQuery=text,
+                action='',
+                actionIncomplete=False,
+                parameters=parameters,
+                contexts=[],
+                metadata=dict(intentName=intent),
+                fulfillment=dict(speech=''),
+                score=score,
+            ),
+        ))
+
+    @app.route('/stats')
+    def get_stats():
+        return json_response(stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', help="YAML file with regular expression rules")
+    parser.add_argument('--recordings', nargs='*', default=RECORDING_GLOBS, help="Recording files or glob patterns")
+    parser.add_argument('--latency', default='fixed:0', help="Latency distribution, e.g. lognormal:250:0.5")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests that fail")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="Share of requests that hang")
+    parser.add_argument('--hang-ms', type=float, default=30000, help="Time that hanging requests take")
+    parser.add_argument('--port', type=int, default=5005)
+    args = parser.parse_args()
+
+    rules = StubRules.load(args.rules, args.recordings)
+    print(f"Loaded {len(rules.recorded)} recorded utterances and {len(rules.rules)} rules.")
+    app = create_app(rules, parse_latency(args.latency), args.error_rate, args.hang_rate, args.hang_ms / 1000)
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Production server for the bot's Flask app, used instead of Flask's development server outside of debug mode.
+"""
+from typing import Callable, Optional, Tuple
+
+from flask import Flask
+from gunicorn.app.base import BaseApplication
+from logzero import logger as log
+
+from core.dialogmanager import DialogManager
+
+
+class PreforkServer(BaseApplication):
+    """
+    Serves the app with gunicorn workers that are forked from the master process.
+
+    Everything that is loaded at import time (response templates, questionnaires, emoji tables, device data) is
+    loaded once in the master and shared copy-on-write by the workers. Threads do not survive a fork, so every worker
+    builds its own app and bot with `factory` after forking, and warms it up with `warm_up` before it accepts any
+    connections. When a worker is shut down, the dialog manager is drained first. In sharded mode, `factory` returns
+    no dialog manager, as the workers only route the updates.
+    """
+
+    def __init__(self,
+                 factory: Callable[[], Tuple[Flask, Optional[DialogManager]]],
+                 warm_up: Callable[[DialogManager], None] = None,
+                 bind: str = '0.0.0.0:5000',
+                 workers: int = 1,
+                 threads: int = 8,
+                 graceful_timeout: int = 30):
+        self.factory = factory
+        self.warm_up = warm_up
+        self.options = dict(
+            bind=bind,
+            workers=workers,
+            threads=threads,
+            worker_class='gthread',
+            graceful_timeout=graceful_timeout,
+            worker_exit=self._worker_exit,
+        )
+        self.dialog_manager = None  # type: DialogManager
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self) -> Flask:
+        # Called in the worker after forking
+        app, self.dialog_manager = self.factory()
+        if self.warm_up:
+            self.warm_up(self.dialog_manager)
+        log.info("Worker is warmed up and ready to accept connections.")
+        return app
+
+    def _worker_exit(self, _server, _worker):
+        if self.dialog_manager is None:
+            return
+        log.info("Worker is shutting down, draining pending turns...")
+        # The master kills workers that are not done after the graceful timeout
+        self.dialog_manager.drain(timeout=max(self.cfg.graceful_timeout - 1, 1))
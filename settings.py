@@ -10,8 +10,91 @@ APP_URL = 'https://bachelor-thesis.herokuapp.com/'
 DEBUG_MODE = config('DEBUG', cast=bool, default=False)
 NO_DELAYS = config('NO_DELAYS', cast=bool, default=False)
 
+# Process the turns of different users concurrently on an asyncio event loop (turns of one user stay serialized)
+ASYNC_DISPATCH = config('ASYNC_DISPATCH', cast=bool, default=False)
+MAX_CONCURRENT_TURNS = config('MAX_CONCURRENT_TURNS', cast=int, default=8)
+# Concurrency budgets of the lower priority lanes (e.g. publishing recordings, and admin operations over all users)
+MAX_CONCURRENT_BACKGROUND = config('MAX_CONCURRENT_BACKGROUND', cast=int, default=2)
+MAX_CONCURRENT_BULK = config('MAX_CONCURRENT_BULK', cast=int, default=1)
+
+# Send outgoing messages from a central timer queue when they are due, instead of sleeping between messages
+SCHEDULED_DELIVERY = config('SCHEDULED_DELIVERY', cast=bool, default=False)
+DELIVERY_WORKERS = config('DELIVERY_WORKERS', cast=int, default=4)
+
+# Run understanding, planning and delivery of a turn on separate thread pools of the given sizes
+PIPELINE_STAGES = config('PIPELINE_STAGES', cast=bool, default=False)
+NLU_STAGE_WORKERS = config('NLU_STAGE_WORKERS', cast=int, default=8)
+PLANNING_STAGE_WORKERS = config('PLANNING_STAGE_WORKERS', cast=int, default=2)
+DELIVERY_STAGE_WORKERS = config('DELIVERY_STAGE_WORKERS', cast=int, default=8)
+
+# Merge plain text messages of a user that arrive within this many milliseconds of each other into a single turn
+# (0 to disable). A burst of messages is never held back for longer than three times the window.
+COALESCE_WINDOW_MS = config('COALESCE_WINDOW_MS', cast=int, default=0)
+
+# Understand a message that is the label of a button we just offered (e.g. "Ja, gerne") as the button's intent,
+# without asking the NLU engine
+CHOICE_SHORTCUT = config('CHOICE_SHORTCUT', cast=bool, default=True)
+
+# Connections to Dialogflow are kept alive and shared by all turns. With ASYNC_NLU (and ASYNC_DISPATCH but without
+# PIPELINE_STAGES), turns wait for Dialogflow on the event loop instead of blocking a thread each.
+NLU_POOL_SIZE = config('NLU_POOL_SIZE', cast=int, default=16)
+NLU_CONNECT_TIMEOUT = config('NLU_CONNECT_TIMEOUT', cast=float, default=3.0)
+NLU_READ_TIMEOUT = config('NLU_READ_TIMEOUT', cast=float, default=10.0)
+ASYNC_NLU = config('ASYNC_NLU', cast=bool, default=False)
+
+# Give up on Dialogflow after NLU_BUDGET_MS per turn (0 for no limit) and understand the message locally (with
+# LOCAL_NLU) or as fallback. A second request is sent when the first one takes longer than NLU_HEDGE_PERCENTILE percent
+# of recent requests (0 to never hedge). While NLU_BREAKER_ERROR_RATE percent of the recent turns fail, Dialogflow is
+# not asked at all for NLU_BREAKER_RESET_TIMEOUT seconds.
+NLU_BUDGET_MS = config('NLU_BUDGET_MS', cast=int, default=2500)
+NLU_HEDGE_PERCENTILE = config('NLU_HEDGE_PERCENTILE', cast=int, default=95)
+NLU_BREAKER_ERROR_RATE = config('NLU_BREAKER_ERROR_RATE', cast=int, default=50)
+NLU_BREAKER_RESET_TIMEOUT = config('NLU_BREAKER_RESET_TIMEOUT', cast=int, default=30)
+
+# Cache understandings of repeated messages for NLU_CACHE_TTL seconds (a size of 0 disables the cache). With
+# NLU_CACHE_REDIS, the cache is shared by all processes through redis.
+NLU_CACHE_SIZE = config('NLU_CACHE_SIZE', cast=int, default=10000)
+NLU_CACHE_TTL = config('NLU_CACHE_TTL', cast=int, default=600)
+NLU_CACHE_REDIS = config('NLU_CACHE_REDIS', cast=bool, default=False)
+
+# Understand messages with a local classifier trained on the recordings and choice labels, and only ask Dialogflow
+# if its similarity score is below LOCAL_NLU_THRESHOLD
+LOCAL_NLU = config('LOCAL_NLU', cast=bool, default=False)
+LOCAL_NLU_THRESHOLD = config('LOCAL_NLU_THRESHOLD', cast=float, default=0.85)
+
+# Number of worker processes that updates are distributed to by user (consistent hashing). 0 or 1 runs a single process.
+SHARD_WORKERS = config('SHARD_WORKERS', cast=int, default=0)
+
+# Admission control for webhook updates. Once INGRESS_HIGH_WATERMARK updates are pending, new updates are shed until
+# the queue has drained to INGRESS_LOW_WATERMARK (half of the high watermark if not set). SHED_MODE is either 'reply'
+# (send a busy message) or 'retry' (ask the platform to deliver the update again later). A high watermark of 0 disables
+# the bounded queue.
+INGRESS_HIGH_WATERMARK = config('INGRESS_HIGH_WATERMARK', cast=int, default=0)
+INGRESS_LOW_WATERMARK = config('INGRESS_LOW_WATERMARK', cast=int, default=0) or None
+SHED_MODE = config('SHED_MODE', default='reply')
+
+# Serve webhooks with gunicorn workers that are forked after the corpora have been loaded (outside of debug mode).
+# Every worker would keep its own contexts, so more than one worker is only allowed together with sharding, where the
+# web workers only route the updates to the shard workers.
+PREFORK_SERVER = config('PREFORK_SERVER', cast=bool, default=True)
+WEB_WORKERS = config('WEB_WORKERS', cast=int, default=1)
+WEB_THREADS = config('WEB_THREADS', cast=int, default=8)
+# Seconds that the bot is given to finish received turns and deliveries and to flush its state when shutting down
+GRACEFUL_TIMEOUT = config('GRACEFUL_TIMEOUT', cast=int, default=30)
+
+# Changes of the conversation contexts are written to redis in a single pipeline every CONTEXT_FLUSH_INTERVAL_MS, or
+# as soon as CONTEXT_FLUSH_BATCH_SIZE collections (utterances, values or dialog states of a user) have changed
+CONTEXT_FLUSH_INTERVAL_MS = config('CONTEXT_FLUSH_INTERVAL_MS', cast=int, default=5000)
+CONTEXT_FLUSH_BATCH_SIZE = config('CONTEXT_FLUSH_BATCH_SIZE', cast=int, default=200)
+# At most CONTEXT_CACHE_SIZE contexts are kept in memory, and contexts that have not been used for
+# CONTEXT_IDLE_TIMEOUT seconds are dropped (0 for no limit). Evicted contexts are restored from redis when needed.
+CONTEXT_CACHE_SIZE = config('CONTEXT_CACHE_SIZE', cast=int, default=10000)
+CONTEXT_IDLE_TIMEOUT = config('CONTEXT_IDLE_TIMEOUT', cast=int, default=6 * 60 * 60)
+
 REDIS_URL = config('REDIS_URL')
 DIALOGFLOW_ACCESS_TOKEN = config('DIALOGFLOW_ACCESS_TOKEN')
+# Can be pointed to `scripts/nlustub.py` for load tests
+DIALOGFLOW_BASE_URL = config('DIALOGFLOW_BASE_URL', default='https://api.api.ai/v1/')
 FACEBOOK_ACCESS_TOKEN = config('FACEBOOK_ACCESS_TOKEN')
 TELEGRAM_ACCESS_TOKEN = config('TELEGRAM_ACCESS_TOKEN')
 TWILIO_ACCESS_TOKEN = config('TWILIO_ACCESS_TOKEN')
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+import requests
+
+from clients.httptransport import PooledHTTPTransport
+from clients.nluclients import DialogflowClient
+
+
+class FakeDialogflowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.clients.add(self.client_address)
+        self.server.paths.append(self.path)
+        if body['query'] == 'kaputt':
+            data = json.dumps({'status': {'code': 500, 'errorType': 'internal_error'}}).encode('utf-8')
+            self.send_response(500)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        data = json.dumps({
+            'timestamp': '2018-05-01T12:00:00.000Z',
+            'result': {
+                'metadata': {'intentName': 'yes' if body['query'] == 'ja' else 'no'},
+                'parameters': {},
+                'score': 0.9,
+            },
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    httpd = FakeServer(('127.0.0.1', 0), FakeDialogflowHandler)
+    httpd.clients = set()
+    httpd.paths = []
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_client(server, **kwargs):
+    transport = PooledHTTPTransport(f'http://127.0.0.1:{server.server_port}/v1/', pool_size=2)
+    return DialogflowClient('token', transport=transport, **kwargs)
+
+
+def test_connections_are_reused(server):
+    client = make_client(server)
+
+    assert client.understand("ja", 1).intent == 'yes'
+    assert client.understand("nein", 1).intent == 'no'
+
+    assert len(server.clients) == 1
+    assert server.paths[0] == '/v1/query?v=20150910'
+    assert client.transport.stats()['requests'] == 2
+
+
+def test_concurrent_async_requests(server):
+    client = make_client(server)
+    loop = asyncio.new_event_loop()
+
+    async def understand_all():
+        results = await asyncio.gather(*(client.understand_async(t, i) for i, t in enumerate(["ja", "nein"] * 5)))
+        await client.transport.close_async()
+        return results
+
+    results = loop.run_until_complete(understand_all())
+    loop.close()
+
+    assert [r.intent for r in results] == ['yes', 'no'] * 5
+    # Limited by the pool size
+    assert len(server.clients) <= 2
+
+
+def test_error_statuses_are_understood_as_fallback(server):
+    client = make_client(server)
+    loop = asyncio.new_event_loop()
+
+    assert client.understand("kaputt", 1).intent == 'fallback'
+    assert loop.run_until_complete(client.understand_async("kaputt", 1)).intent == 'fallback'
+    loop.run_until_complete(client.transport.close_async())
+    loop.close()
+    assert client.transport.stats()['failures'] == 2
+
+    with pytest.raises(requests.HTTPError):
+        make_client(server, raise_errors=True).understand("kaputt", 1)
@@ -0,0 +1,61 @@
+from clients.localnlu import FastPathNLUEngine, LocalNLUEngine, load_choice_examples
+from clients.nluclients import NLUEngine
+from core.understanding import MessageUnderstanding
+
+EXAMPLES = [
+    ("Ja, gerne", 'yes'),
+    ("Ja klar", 'yes'),
+    ("Nein danke", 'no'),
+    ("Nein, lieber nicht", 'no'),
+    ("Mein Handy ist kaputt", 'phone_broken'),
+    ("Das Display ist gesprungen", 'phone_broken'),
+]
+
+
+class RemoteEngine(NLUEngine):
+    def __init__(self):
+        self.calls = []
+
+    def understand(self, text, session_id):
+        self.calls.append(text)
+        return MessageUnderstanding(text, intent='remote')
+
+    def get_user_entities(self, user):
+        return []
+
+
+def test_classifies_similar_utterances():
+    engine = LocalNLUEngine(EXAMPLES)
+
+    intent, score, margin = engine.classify("ja gerne!")
+    assert intent == 'yes'
+    assert score > 0.99
+    assert margin > 0.5
+
+    assert engine.understand("mein handy ist kaputt").intent == 'phone_broken'
+    assert engine.classify("xyz") == (None, 0.0, 0.0)
+
+
+def test_confident_predictions_are_answered_locally():
+    remote = RemoteEngine()
+    engine = FastPathNLUEngine(LocalNLUEngine(EXAMPLES), remote, threshold=0.8)
+
+    assert engine.understand("Ja, gerne", 1).intent == 'yes'
+    assert engine.understand("Wie funktioniert das?", 1).intent == 'remote'
+    assert engine.understand("/start", 1).intent == 'remote'
+    assert remote.calls == ["Wie funktioniert das?", "/start"]
+    assert engine.stats() == dict(examples=6, local_hits=1, fallthroughs=2)
+
+
+def test_only_allowed_intents_are_answered_locally():
+    remote = RemoteEngine()
+    engine = FastPathNLUEngine(LocalNLUEngine(EXAMPLES), remote, threshold=0.8, allowed_intents=['yes', 'no'])
+
+    assert engine.understand("Nein danke", 1).intent == 'no'
+    assert engine.understand("Mein Handy ist kaputt", 1).intent == 'remote'
+
+
+def test_choice_labels_are_training_data():
+    examples = load_choice_examples()
+    assert ("Ja, gerne", 'yes') in [(text.strip(), intent) for text, intent in examples]
+    assert {'yes', 'no', 'correct', 'wrong', 'submit'} <= {intent for _, intent in examples}
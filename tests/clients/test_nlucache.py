@@ -0,0 +1,87 @@
+import time
+
+from clients.nlucache import CachingNLUEngine
+from clients.nluclients import NLUEngine
+from core.understanding import MessageUnderstanding
+
+
+class CountingEngine(NLUEngine):
+    def __init__(self):
+        self.calls = []
+
+    def understand(self, text, session_id):
+        self.calls.append(text)
+        contexts = [{'name': 'confirming', 'lifespan': 2}] if text == 'phone broken' else None
+        parameters = {'date': '2018-05-02'} if text == 'morgen' else {'device': ['iPhone X']}
+        return MessageUnderstanding(text, intent=f'intent_{len(self.calls)}', parameters=parameters,
+                                    contexts=contexts)
+
+    def get_user_entities(self, user):
+        return []
+
+
+def test_normalization():
+    assert CachingNLUEngine.normalize("  Ja!! ") == "ja"
+    assert CachingNLUEngine.normalize("Weiter  geht's.") == "weiter geht's"
+    assert CachingNLUEngine.normalize("?") == "?"
+
+
+def test_repeated_inputs_are_served_from_cache():
+    engine = CountingEngine()
+    cache = CachingNLUEngine(engine)
+
+    first = cache.understand("Ja", 1)
+    second = cache.understand("ja!", 2)
+
+    assert engine.calls == ["Ja"]
+    assert second.intent == first.intent
+    assert second.text == "ja!"
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_active_contexts_are_part_of_the_key():
+    engine = CountingEngine()
+    cache = CachingNLUEngine(engine)
+
+    cache.understand("ja", 1)
+    cache.understand("phone broken", 2)
+    cache.understand("ja", 2)  # contexts of session 2 differ
+
+    assert engine.calls == ["ja", "phone broken", "ja"]
+
+
+def test_lru_and_ttl_eviction():
+    engine = CountingEngine()
+    cache = CachingNLUEngine(engine, max_size=2, ttl=0.05)
+
+    for text in ("a", "b", "c"):
+        cache.understand(text, 1)
+    assert cache.stats()['evictions'] == 1
+
+    time.sleep(0.06)
+    cache.understand("c", 1)
+    assert engine.calls == ["a", "b", "c", "c"]
+    assert cache.stats()['expirations'] == 1
+
+
+def test_hits_do_not_share_parameters():
+    cache = CachingNLUEngine(CountingEngine())
+
+    cache.understand("iphone", 1).parameters['device'].append('Galaxy S9')
+    second = cache.understand("iphone", 2)
+    second.parameters['device'][0] = 'Pixel'
+
+    assert cache.understand("iphone", 3).parameters == {'device': ['iPhone X']}
+
+
+def test_dates_are_not_cached():
+    engine = CountingEngine()
+    cache = CachingNLUEngine(engine)
+
+    cache.understand("morgen", 1)
+    cache.understand("morgen", 2)
+
+    assert engine.calls == ["morgen", "morgen"]
+    assert not CachingNLUEngine.is_cacheable(MessageUnderstanding("x", 'time', parameters={'time': ['14:00:00']}))
+    assert CachingNLUEngine.is_cacheable(MessageUnderstanding("x", 'phone', parameters={'model': '7'}))
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from clients.nluclients import NLUEngine
+from core.understanding import MessageUnderstanding
+
+
+class SlowEngine(NLUEngine):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.sessions = set()
+
+    def understand(self, text, session_id):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.sessions.add(session_id)
+        time.sleep(0.01 if int(text) % 3 else 0.03)
+        with self.lock:
+            self.active -= 1
+        if text == '7':
+            raise ConnectionError()
+        return MessageUnderstanding(text, intent=f'intent_{text}')
+
+    def get_user_entities(self, user):
+        return []
+
+
+def test_batch_keeps_order_and_bounds_parallelism():
+    engine = SlowEngine()
+
+    results = list(engine.understand_batch((str(i) for i in range(20)), parallelism=4))
+
+    assert [r.text for r in results] == [str(i) for i in range(20)]
+    assert results[0].understanding.intent == 'intent_0'
+    assert engine.max_active <= 4
+    assert len(engine.sessions) == 20
+    assert all(r.latency > 0 for r in results)
+
+
+def test_batch_reports_errors():
+    results = list(SlowEngine().understand_batch(["6", "7"]))
+
+    assert results[0].error is None
+    assert isinstance(results[1].error, ConnectionError)
+    assert results[1].understanding is None
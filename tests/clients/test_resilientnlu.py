@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from clients.nluclients import NLUEngine
+from clients.resilientnlu import CircuitBreaker, ResilientNLUEngine
+from core.understanding import MessageUnderstanding
+
+
+class ScriptedEngine(NLUEngine):
+    """ Answers the n-th request after `delays[n]` seconds, or raises if the delay is None """
+
+    def __init__(self, *delays):
+        self.delays = list(delays)
+        self.calls = 0
+
+    def _next_delay(self):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        if delay is None:
+            raise ConnectionError("Dialogflow is down")
+        return delay
+
+    def understand(self, text, session_id):
+        time.sleep(self._next_delay())
+        return MessageUnderstanding(text, intent=f'call_{self.calls}')
+
+    async def understand_async(self, text, session_id):
+        await asyncio.sleep(self._next_delay())
+        return MessageUnderstanding(text, intent=f'call_{self.calls}')
+
+    def get_user_entities(self, user):
+        return []
+
+
+def test_slow_requests_are_hedged():
+    engine = ResilientNLUEngine(ScriptedEngine(1.0, 0.01), budget=0.5)
+
+    started = time.monotonic()
+    understanding = engine.understand("ja", 1)
+
+    assert understanding.intent == 'call_2'
+    assert time.monotonic() - started < 0.5
+    assert engine.stats()['hedges'] == 1
+
+
+def test_failed_requests_are_hedged_immediately():
+    engine = ResilientNLUEngine(ScriptedEngine(None, 0), budget=1)
+
+    assert engine.understand("ja", 1).intent == 'call_2'
+    assert engine.stats()['errors'] == 1
+
+
+def test_falls_back_when_budget_is_exceeded():
+    fallback = ScriptedEngine(0)
+    engine = ResilientNLUEngine(ScriptedEngine(1.0), fallback=fallback, budget=0.1, hedge_percentile=0)
+
+    started = time.monotonic()
+    assert engine.understand("ja", 1).intent == 'call_1'
+    assert time.monotonic() - started < 0.5
+    assert fallback.calls == 1
+    assert engine.stats()['timeouts'] == 1
+    assert engine.stats()['hedges'] == 0
+
+
+def test_circuit_breaker_fails_fast():
+    primary = ScriptedEngine(None)
+    breaker = CircuitBreaker(error_rate=0.5, window=4, min_calls=4, reset_timeout=0.1)
+    engine = ResilientNLUEngine(primary, budget=1, breaker=breaker)
+
+    for _ in range(4):
+        assert engine.understand("ja", 1).intent == 'fallback'
+    assert breaker.state == CircuitBreaker.State.OPEN
+    calls = primary.calls
+
+    assert engine.understand("ja", 1).intent == 'fallback'
+    assert primary.calls == calls
+
+    time.sleep(0.15)
+    primary.delays = [0]
+    assert engine.understand("ja", 1).intent == f'call_{calls + 1}'
+    assert breaker.state == CircuitBreaker.State.CLOSED
+
+
+def test_async_hedging():
+    engine = ResilientNLUEngine(ScriptedEngine(1.0, 0.01), budget=0.5)
+    loop = asyncio.new_event_loop()
+
+    understanding = loop.run_until_complete(engine.understand_async("ja", 1))
+    loop.close()
+
+    assert understanding.intent == 'call_2'
+    assert engine.stats()['hedges'] == 1
@@ -0,0 +1,70 @@
+"""
+In-memory stand-in for the parts of redis that the contexts use.
+"""
+import threading
+
+
+class MemoryPipeline:
+    """ Records the commands as `(name, *args)` tuples and applies them when executed """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def delete(self, key):
+        self.commands.append(('delete', key))
+
+    def hmset(self, key, mapping):
+        self.commands.append(('hmset', key, mapping))
+
+    def hdel(self, key, *fields):
+        self.commands.append(('hdel', key) + fields)
+
+    def rpush(self, key, *values):
+        self.commands.append(('rpush', key) + values)
+
+    def execute(self):
+        if self.redis.fail:
+            raise ConnectionError()
+        data = self.redis.data
+        for name, key, *args in self.commands:
+            if name == 'delete':
+                data.pop(key, None)
+            elif name == 'hmset':
+                data.setdefault(key, {}).update(args[0])
+            elif name == 'hdel':
+                for field in args:
+                    data.get(key, {}).pop(field, None)
+            else:
+                data.setdefault(key, []).extend(args)
+
+        self.redis.executed.append(self.commands)
+        if len(self.redis.executed) == self.redis.expected:
+            self.redis.done.set()
+
+
+class MemoryRedis:
+    def __init__(self, expected: int = None):
+        self.data = {}
+        # Commands of each executed pipeline
+        self.executed = []
+        # Makes the pipelines fail while set
+        self.fail = False
+        # `done` is set once `expected` pipelines have been executed
+        self.expected = expected
+        self.done = threading.Event()
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def lrange(self, key, start, end):
+        return list(self.data.get(key, []))
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from core.admission import IngressQueue
+
+
+def test_watermarks_with_hysteresis():
+    ingress = IngressQueue(high_watermark=4, low_watermark=1)  # not started, so nothing is consumed
+
+    assert all(ingress.offer(print, i) for i in range(4))
+    assert not ingress.offer(print, 4)
+    assert ingress.shedding
+
+    # Drain down to just above the low watermark: still shedding
+    ingress._queues[0].get_nowait()
+    ingress._queues[0].get_nowait()
+    assert not ingress.offer(print, 5)
+
+    ingress._queues[0].get_nowait()
+    assert ingress.offer(print, 6)
+    assert not ingress.shedding
+    assert (ingress.accepted, ingress.dropped) == (5, 2)
+
+
+def test_backlog_counts_towards_depth():
+    backlog = [0]
+    ingress = IngressQueue(high_watermark=2, backlog=lambda: backlog[0])
+
+    backlog[0] = 2
+    assert not ingress.offer(print)
+    backlog[0] = 1
+    assert ingress.offer(print)
+    assert ingress.stats()['depth'] == 2
+
+
+def test_updates_are_processed_in_order():
+    results = []
+    done = threading.Event()
+    ingress = IngressQueue(high_watermark=100)
+
+    for i in range(20):
+        ingress.offer(results.append, i)
+    ingress.offer(done.set)
+    ingress.start()
+
+    assert done.wait(2)
+    ingress.stop(timeout=2)
+    assert results == list(range(20))
+    assert ingress.depth == 0
+
+
+def test_slow_turn_does_not_hold_up_other_users():
+    results = []
+    release = threading.Event()
+    ingress = IngressQueue(high_watermark=100, workers=2)
+    ingress.start()
+
+    def slow_turn(name):
+        release.wait(2)
+        results.append(name)
+
+    # The keys of the users go to different workers
+    ingress.offer(slow_turn, "slow", key=0)
+    ingress.offer(results.append, "after slow", key=0)
+    ingress.offer(results.append, "other user", key=1)
+
+    end = time.monotonic() + 2
+    while not results and time.monotonic() < end:
+        time.sleep(0.01)
+    assert results == ["other user"]
+    assert ingress.depth == 2
+
+    release.set()
+    ingress.stop(timeout=2)
+    assert results == ["other user", "slow", "after slow"]
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        IngressQueue(high_watermark=2, low_watermark=2)
+    with pytest.raises(ValueError):
+        IngressQueue(high_watermark=2, shed_mode='ignore')
+    with pytest.raises(ValueError):
+        IngressQueue(high_watermark=2, workers=0)
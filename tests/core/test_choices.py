@@ -0,0 +1,76 @@
+import time
+
+from core import ChatAction
+from core.choices import PendingChoices, choice_intent
+from model import Update, User
+
+
+def make_update(user: User, text: str) -> Update:
+    update = Update()
+    update.user = user
+    update.message_text = text
+    return update
+
+
+def make_question(user: User, choice_intents: dict) -> ChatAction:
+    return ChatAction(ChatAction.Type.ASKING_QUESTION, peer=user, text="Passt das so?",
+                      choices=list(choice_intents), choice_intents=choice_intents)
+
+
+def test_choice_intent():
+    assert choice_intent('affirm_yes') == 'yes'
+    assert choice_intent('negate_wrong') == 'wrong'
+    assert choice_intent('claim damage') is None
+
+
+def test_button_labels_are_matched():
+    user = User()
+    user.id = 1
+    choices = PendingChoices()
+    choices.remember(user.id, [
+        ChatAction(ChatAction.Type.SAYING, peer=user, text="Alles klar."),
+        make_question(user, {"Ja, gerne \U0001F44D": 'yes', "Nein": 'no'}),
+    ])
+
+    # Facebook strips emojis from the quick replies
+    understanding = choices.match(make_update(user, "ja, gerne"))
+    assert understanding.intent == 'yes'
+    assert understanding.text == "ja, gerne"
+    assert understanding.score == 1.0
+
+    assert choices.match(make_update(user, "Nein!")).intent == 'no'
+    assert choices.match(make_update(user, "Nein, das Display ist kaputt")) is None
+    assert choices.stats() == dict(users=1, hits=2, misses=1, evictions=0)
+
+
+def test_choices_are_replaced_by_the_next_response():
+    user = User()
+    user.id = 1
+    choices = PendingChoices()
+    choices.remember(user.id, [make_question(user, {"Ja, gerne": 'yes'})])
+    choices.remember(user.id, [ChatAction(ChatAction.Type.SAYING, peer=user, text="Danke!")])
+
+    assert choices.match(make_update(user, "Ja, gerne")) is None
+    assert choices.stats()['users'] == 0
+
+
+def test_choices_are_bounded(monkeypatch):
+    users = []
+    for user_id in range(3):
+        user = User()
+        user.id = user_id
+        users.append(user)
+    choices = PendingChoices(max_size=2, ttl=60)
+
+    monkeypatch.setattr(time, 'monotonic', lambda: 100.0)
+    for user in users:
+        choices.remember(user.id, [make_question(user, {"Ja": 'yes'})])
+    # The least recently offered choices are dropped first
+    assert choices.match(make_update(users[0], "Ja")) is None
+    assert choices.match(make_update(users[1], "Ja")).intent == 'yes'
+
+    monkeypatch.setattr(time, 'monotonic', lambda: 200.0)
+    assert choices.match(make_update(users[2], "Ja")) is None
+    choices.remember(users[0].id, [ChatAction(ChatAction.Type.SAYING, peer=users[0], text="Hallo")])
+    assert choices.stats()['users'] == 0
+    assert choices.stats()['evictions'] == 3
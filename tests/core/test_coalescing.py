@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from core.coalescing import MessageCoalescer
+from core.timers import TimerQueue
+from model import Update, User
+
+
+class Bot:
+    client_name = 'test'
+
+
+@pytest.fixture
+def timers():
+    t = TimerQueue(workers=2)
+    t.start()
+    yield t
+    t.stop(timeout=2)
+
+
+def text_update(uid, text):
+    user = User()
+    user.id = uid
+    return Update(user=user, message_text=text)
+
+
+class Turns:
+    def __init__(self, expected):
+        self.turns = []
+        self.expected = expected
+        self.done = threading.Event()
+
+    def __call__(self, bot, update, swallowed):
+        self.turns.append((update.user.id, update.message_text, len(swallowed)))
+        if len(self.turns) == self.expected:
+            self.done.set()
+
+
+def test_burst_is_merged_into_one_turn(timers):
+    coalescer = MessageCoalescer(timers, window=0.05)
+    turns = Turns(expected=2)
+    bot = Bot()
+
+    for text in ("hi", "my phone", "is broken"):
+        coalescer.add(bot, text_update(1, text), turns)
+    coalescer.add(bot, text_update(2, "hello"), turns)
+
+    assert turns.done.wait(2)
+    assert sorted(turns.turns) == [(1, "hi my phone is broken", 2), (2, "hello", 0)]
+    assert coalescer.stats() == dict(pending=0, turns=2, merged=2)
+
+
+def test_burst_is_not_held_back_longer_than_max_delay(timers):
+    coalescer = MessageCoalescer(timers, window=0.05, max_delay=0.1)
+    turns = Turns(expected=1)
+    bot = Bot()
+
+    started = time.monotonic()
+    while not turns.done.is_set() and time.monotonic() - started < 1:
+        coalescer.add(bot, text_update(1, "x"), turns)
+        time.sleep(0.01)
+
+    assert turns.done.is_set()
+    assert time.monotonic() - started < 0.3
+
+
+def test_take_removes_pending_messages(timers):
+    coalescer = MessageCoalescer(timers, window=0.05)
+    turns = Turns(expected=1)
+    bot = Bot()
+
+    coalescer.add(bot, text_update(1, "a"), turns)
+    coalescer.add(bot, text_update(1, "b"), turns)
+    update, swallowed = coalescer.take(bot, text_update(1, None))
+
+    assert update.message_text == "a b"
+    assert len(swallowed) == 1
+    assert coalescer.take(bot, update) is None
+    assert not turns.done.wait(0.15)
@@ -0,0 +1,63 @@
+from core import MessageUnderstanding
+from core.context import ContextManager
+from core.timers import TimerQueue
+from core.writebehind import WriteBehindFlusher
+from model import User
+from tests.core.memoryredis import MemoryRedis
+
+
+def make_user():
+    user = User(insurance_id=1234)
+    user.save()
+    return user
+
+
+def test_evicts_least_recently_used_and_rehydrates():
+    redis = MemoryRedis()
+    # The timers are not started, so changes are only written when evicted contexts are needed again
+    manager = ContextManager(None, redis=redis, flusher=WriteBehindFlusher(redis, TimerQueue()),
+                             max_size=2)
+    first, second, third = make_user(), make_user(), make_user()
+
+    manager.get_user_context(first)['name'] = "Max"
+    manager.get_user_context(first).add_user_utterance(MessageUnderstanding("hallo", intent='hello'))
+    manager.get_user_context(second)
+    manager.get_user_context(third)
+
+    assert list(manager.contexts) == [second.id, third.id]
+    assert manager.flusher.pending > 0
+
+    restored = manager.get_user_context(first)
+    assert restored['name'] == "Max"
+    assert restored.has_incoming_intent('hello')
+    assert list(manager.contexts) == [third.id, first.id]
+
+    stats = manager.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 2
+    assert stats['rehydrations'] == 4
+    assert stats['rehydration_p50_ms'] is not None
+
+
+def test_evicts_idle_contexts():
+    redis = MemoryRedis()
+    manager = ContextManager(None, redis=redis, idle_timeout=60)
+    first, second = make_user(), make_user()
+
+    manager.get_user_context(first)
+    manager._last_used[first.id] -= 120
+    manager.get_user_context(second)
+
+    assert list(manager.contexts) == [second.id]
+    assert manager.stats()['idle_evictions'] == 1
+
+
+def test_never_evicts_without_redis():
+    manager = ContextManager(None, max_size=1, idle_timeout=1)
+    users = [make_user() for _ in range(3)]
+
+    for user in users:
+        manager.get_user_context(user)
+
+    assert len(manager.contexts) == 3
+    assert manager.get_user_context(users[0]) is manager.contexts[users[0].id]
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from core import ChatAction
+from core.delivery import DeliveryScheduler
+from core.timers import TimerQueue
+from model import User
+
+
+class RecordingBot:
+    client_name = 'test'
+
+    def __init__(self):
+        self.events = []
+        self.done = threading.Event()
+        self.expected = None
+
+    def show_typing(self, user):
+        self.events.append(('typing', user.id))
+
+    def get_delay(self, action):
+        return action.delay
+
+    def perform_action(self, action, is_last=True):
+        self.events.append((action.render(), is_last))
+        if self.expected and len([e for e in self.events if e[0] != 'typing']) == self.expected:
+            self.done.set()
+
+
+@pytest.fixture
+def timers():
+    t = TimerQueue(workers=2)
+    t.start()
+    yield t
+    t.stop(timeout=2)
+
+
+def user(uid):
+    u = User()
+    u.id = uid
+    return u
+
+
+def action(peer, text, delay=0.0):
+    return ChatAction(ChatAction.Type.SAYING, peer=peer, text=text, delay=delay)
+
+
+def test_timer_queue_order(timers: TimerQueue):
+    results = []
+    done = threading.Event()
+
+    timers.call_later(0.06, lambda: (results.append(3), done.set()))
+    timers.call_later(0.02, results.append, 2)
+    timers.call_later(0, results.append, 1)
+    cancelled = timers.call_later(0.04, results.append, 'cancelled')
+    cancelled.cancel()
+
+    assert done.wait(2)
+    assert results == [1, 2, 3]
+
+
+def test_actions_are_delivered_in_order(timers: TimerQueue):
+    bot = RecordingBot()
+    bot.expected = 3
+    scheduler = DeliveryScheduler(timers)
+    peer = user(1)
+
+    started = time.monotonic()
+    scheduler.schedule(bot, [action(peer, "a", 0.05), action(peer, "b", 0.01)])
+    scheduler.schedule(bot, [action(peer, "c")])
+
+    assert bot.done.wait(2)
+    assert time.monotonic() - started >= 0.06
+    assert bot.events == [
+        ('typing', 1), ("a", False),
+        ('typing', 1), ("b", True),
+        ('typing', 1), ("c", True),
+    ]
+    assert scheduler.pending == 0
+
+
+def test_peers_do_not_block_each_other(timers: TimerQueue):
+    bot = RecordingBot()
+    bot.expected = 2
+    scheduler = DeliveryScheduler(timers)
+
+    scheduler.schedule(bot, [action(user(1), "slow", 0.3)])
+    scheduler.schedule(bot, [action(user(2), "fast")])
+
+    time.sleep(0.1)
+    assert ("fast", True) in bot.events
+    assert ("slow", True) not in bot.events
+    assert bot.done.wait(2)
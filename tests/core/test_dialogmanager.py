@@ -0,0 +1,113 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from core import ChatAction, ContextManager, DialogManager
+from core.dispatcher import AsyncDispatcher
+from core.pipeline import StagedPipeline
+from model import Update, User
+from tests.core.test_drain import FakeBot
+
+
+class EchoResponse:
+    def __init__(self, context):
+        self.context = context
+        self.deferred = []
+
+    def collect_actions(self):
+        text = self.context.last_user_utterance.text
+        return [ChatAction(ChatAction.Type.SAYING, peer=self.context.user, text=text)]
+
+
+class EchoPlanningAgent:
+    def build_next_actions(self, context):
+        return EchoResponse(context)
+
+
+class SlowBot(FakeBot):
+    """ Takes until `release` is set to send the message "slow" """
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def perform_actions(self, actions):
+        for action in actions:
+            text = action.render()
+            if text == "slow":
+                self.release.wait(3)
+            self.sent.append(text)
+
+
+@pytest.fixture
+def pipeline():
+    p = StagedPipeline(nlu_workers=1, planning_workers=1, delivery_workers=2)
+    yield p
+    p.shutdown(wait=False)
+
+
+def make_dialog_manager(bot, pipeline, dispatcher=None):
+    return DialogManager(
+        context_manager=ContextManager(initial_state=None),
+        bot_clients=[bot],
+        nlu_client=None,
+        planning_agent=EchoPlanningAgent(),
+        dispatcher=dispatcher,
+        pipeline=pipeline
+    )
+
+
+def make_update(user_id: int, text: str) -> Update:
+    user = User(insurance_id=user_id)
+    user.save()
+    return Update(user=user, client_name='test', message_id=text, datetime=datetime.now(), message_text=text)
+
+
+def wait_until(predicate, timeout=3):
+    end = time.time() + timeout
+    while not predicate():
+        if time.time() > end:
+            raise TimeoutError()
+        time.sleep(0.01)
+
+
+def test_slow_delivery_does_not_take_a_dispatcher_slot(pipeline: StagedPipeline):
+    dispatcher = AsyncDispatcher(max_concurrency=1)
+    dispatcher.start()
+    bot = SlowBot()
+    make_dialog_manager(bot, pipeline, dispatcher)
+    start_handler = bot.handlers[0]
+    slow, fast = make_update(1, "slow"), make_update(2, "fast")
+
+    start_handler(bot, slow)
+    wait_until(lambda: pipeline.delivery.active == 1)
+    start_handler(bot, fast)
+
+    wait_until(lambda: bot.sent == ["fast"])
+    bot.release.set()
+    wait_until(lambda: bot.sent == ["fast", "slow"])
+    wait_until(lambda: dispatcher.pending == 0)
+    dispatcher.stop(timeout=2)
+
+
+def test_turns_do_not_block_without_dispatcher(pipeline: StagedPipeline):
+    bot = SlowBot()
+    dialog_manager = make_dialog_manager(bot, pipeline)
+    start_handler = bot.handlers[0]
+    slow = make_update(1, "slow")
+    later = Update(user=slow.user, client_name='test', message_id='later', datetime=datetime.now(),
+                   message_text="later")
+
+    start_handler(bot, slow)
+    start_handler(bot, later)
+    start_handler(bot, make_update(2, "other"))
+    assert dialog_manager.pending == 3
+
+    # The next turn of the same user waits for the slow one, other users do not
+    wait_until(lambda: bot.sent == ["other"])
+    bot.release.set()
+    wait_until(lambda: bot.sent == ["other", "slow", "later"])
+    wait_until(lambda: dialog_manager.pending == 0)
+    assert not dialog_manager._last_turns
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.dispatcher import AsyncDispatcher, Lane
+
+
+@pytest.fixture
+def dispatcher():
+    d = AsyncDispatcher(max_concurrency=2)
+    d.start()
+    yield d
+    d.stop(timeout=2)
+
+
+def wait_until(predicate, timeout=3):
+    end = time.time() + timeout
+    while not predicate():
+        if time.time() > end:
+            raise TimeoutError()
+        time.sleep(0.01)
+
+
+def test_turns_of_one_user_are_serialized(dispatcher: AsyncDispatcher):
+    results = []
+
+    def turn(i):
+        time.sleep(0.02 if i % 2 == 0 else 0)
+        results.append(i)
+
+    for i in range(10):
+        dispatcher.submit('user', turn, i)
+
+    wait_until(lambda: len(results) == 10)
+    assert results == list(range(10))
+
+
+def test_concurrency_is_capped(dispatcher: AsyncDispatcher):
+    lock = threading.Lock()
+    active = [0]
+    max_active = [0]
+    done = []
+
+    def turn(i):
+        with lock:
+            active[0] += 1
+            max_active[0] = max(max_active[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        done.append(i)
+
+    for i in range(6):
+        dispatcher.submit(i, turn, i)
+
+    wait_until(lambda: len(done) == 6)
+    assert max_active[0] == 2
+    # The mailbox counts a turn as done right after it returns
+    wait_until(lambda: dispatcher.pending == 0)
+
+
+def test_coroutine_callbacks(dispatcher: AsyncDispatcher):
+    results = []
+
+    async def turn(i):
+        results.append(i)
+
+    dispatcher.submit('user', turn, 1)
+    wait_until(lambda: results == [1])
+
+
+def test_returned_coroutines_are_awaited_in_order(dispatcher: AsyncDispatcher):
+    results = []
+
+    async def finish(i):
+        await asyncio.sleep(0.02 if i == 0 else 0)
+        results.append(i)
+
+    def turn(i):
+        return finish(i)
+
+    dispatcher.submit('user', turn, 0)
+    dispatcher.submit('user', turn, 1)
+    wait_until(lambda: len(results) == 2)
+    assert results == [0, 1]
+
+
+def test_submit_requires_start():
+    with pytest.raises(RuntimeError):
+        AsyncDispatcher().submit('user', print)
+
+
+def test_bulk_lane_does_not_take_interactive_capacity():
+    dispatcher = AsyncDispatcher(max_concurrency=1, lane_budgets={Lane.BULK: 1})
+    dispatcher.start()
+    release = threading.Event()
+    results = []
+
+    dispatcher.submit('admin', release.wait, 2, lane=Lane.BULK)
+    dispatcher.submit('admin', results.append, 'bulk', lane=Lane.BULK)
+    dispatcher.submit('user', results.append, 'interactive')
+
+    wait_until(lambda: results == ['interactive'])
+    assert dispatcher.stats()['bulk']['pending'] == 2
+
+    release.set()
+    wait_until(lambda: results == ['interactive', 'bulk'])
+    assert dispatcher.pending == 0
+    dispatcher.stop(timeout=2)
+
+
+def test_lanes_share_the_mailbox_of_a_user(dispatcher: AsyncDispatcher):
+    lock = threading.Lock()
+    active = [0]
+    overlapped = []
+    results = []
+
+    def work(name):
+        with lock:
+            active[0] += 1
+            overlapped.append(active[0] > 1)
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        results.append(name)
+
+    dispatcher.submit('user', work, 'deferred', lane=Lane.BACKGROUND)
+    dispatcher.submit('user', work, 'turn')
+    dispatcher.submit('user', work, 'bulk', lane=Lane.BULK)
+    dispatcher.submit('user', work, 'next turn')
+
+    wait_until(lambda: len(results) == 4)
+    assert results == ['deferred', 'turn', 'bulk', 'next turn']
+    assert not any(overlapped)
+
+
+def test_run_in_lane_uses_the_lane_threads(dispatcher: AsyncDispatcher):
+    names = []
+
+    async def turn():
+        await dispatcher.run_in_lane(Lane.BULK, lambda: names.append(threading.current_thread().name))
+
+    dispatcher.submit('user', turn)
+    wait_until(lambda: len(names) == 1)
+    assert names[0].startswith('Dispatcher-bulk')
@@ -0,0 +1,116 @@
+import pickle
+import threading
+import time
+from datetime import datetime
+
+from core import ChatAction, ContextManager, DialogManager
+from core.delivery import DeliveryScheduler
+from core.timers import TimerQueue
+from core.writebehind import WriteBehindFlusher
+from model import Update, User
+from tests.core.memoryredis import MemoryRedis
+
+
+class FakeBot:
+    client_name = 'test'
+    ingress = None
+    draining = False
+    pending = 0
+
+    def __init__(self):
+        self.sent = []
+        self.stopped = False
+        self.handlers = []
+
+    def set_start_handler(self, callback):
+        self.handlers.append(callback)
+
+    add_plaintext_handler = add_voice_handler = add_media_handler = set_start_handler
+
+    def start_listening(self):
+        pass
+
+    def stop_listening(self):
+        self.stopped = True
+
+    def show_typing(self, user):
+        pass
+
+    def get_delay(self, action):
+        return action.delay
+
+    def perform_action(self, action, is_last=True):
+        self.sent.append(action.render())
+
+
+def test_drain_rushes_remaining_deliveries():
+    timers = TimerQueue(workers=2)
+    timers.start()
+    bot = FakeBot()
+    delivery = DeliveryScheduler(timers)
+    dialog_manager = DialogManager(
+        context_manager=ContextManager(initial_state=None),
+        bot_clients=[bot],
+        nlu_client=None,
+        planning_agent=None,
+        delivery=delivery
+    )
+
+    user = User()
+    user.id = 1
+    delivery.schedule(bot, [
+        ChatAction(ChatAction.Type.SAYING, peer=user, text=text, delay=5) for text in ("a", "b", "c")
+    ])
+
+    started = time.monotonic()
+    assert dialog_manager.drain(timeout=0.4)
+    assert time.monotonic() - started < 1
+    assert bot.sent == ["a", "b", "c"]
+    assert bot.draining
+    assert bot.stopped
+    timers.stop(timeout=2)
+
+
+class SlowPlanningAgent:
+    """ Sets a value in the context and then waits until it is released """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def build_next_actions(self, context):
+        context['name'] = "Max"
+        self.started.set()
+        self.release.wait(5)
+        return None
+
+
+def test_drain_waits_for_the_turn_in_flight():
+    redis = MemoryRedis()
+    bot = FakeBot()
+    planning_agent = SlowPlanningAgent()
+    dialog_manager = DialogManager(
+        # The timers are not started, so changes are only written when flushed
+        context_manager=ContextManager(None, redis=redis, flusher=WriteBehindFlusher(redis, TimerQueue())),
+        bot_clients=[bot],
+        nlu_client=None,
+        planning_agent=planning_agent
+    )
+    user = User(insurance_id=1234)
+    user.save()
+    update = Update(user=user, client_name='test', message_id='1', datetime=datetime.now(), message_text="/start")
+
+    # Like a bot's worker thread, which has already taken the update off the queue
+    start_handler = bot.handlers[0]
+    worker = threading.Thread(target=start_handler, args=(bot, update))
+    worker.start()
+    assert planning_agent.started.wait(2)
+    assert dialog_manager.pending == 1
+
+    threading.Timer(0.3, planning_agent.release.set).start()
+    assert dialog_manager.drain(timeout=2)
+    worker.join(2)
+
+    assert bot.stopped
+    values = redis.data[f'{user.id}:kv_store']
+    assert pickle.loads(values[pickle.dumps('name')]) == "Max"
@@ -0,0 +1,50 @@
+import random
+from collections import deque
+
+from core import ChatAction, Context, MessageUnderstanding
+from core.intentindex import IntentIndex
+from model import User
+
+INTENTS = ['hello', 'yes', 'no', 'ask_something_else', 'give_hint']
+
+
+def test_ages_and_counts():
+    index = IntentIndex()
+    for intents in (['hello'], ['yes', 'give_hint'], ['no'], ['yes', 'yes']):
+        index.add(intents)
+
+    assert index.latest_age('yes') == 0
+    assert index.latest_age('hello') == 3
+    assert index.latest_age('other') is None
+    assert index.count_within('yes', 0) == 1
+    assert index.count_within('yes', 2) == 2
+    assert index.count_within('yes') == 2
+
+    index.drop_oldest(['hello'])
+    assert index.latest_age('hello') is None
+
+
+def test_agrees_with_scanning_a_bounded_history():
+    user = User(insurance_id=1234)
+    user.save()
+    context = Context(user, initial_state=None)
+    # Like with redis, where old utterances fall out of the history
+    context._utterances = deque(maxlen=10)
+    context._index_utterances()
+    rng = random.Random(42)
+
+    for _ in range(60):
+        if rng.random() < 0.4:
+            context.add_user_utterance(MessageUnderstanding("...", rng.choice(INTENTS)))
+        else:
+            context.add_actions([ChatAction(ChatAction.Type.SAYING, peer=user, text="...",
+                                            intents=rng.sample(INTENTS, rng.randint(1, 2)))
+                                 for _ in range(rng.randint(1, 3))])
+
+        for intent in INTENTS:
+            for age_limit in (0, 2, 5, 15):
+                scanned_in = context.filter_incoming_utterances(lambda u: u.intent == intent, age_limit)
+                scanned_out = context.filter_outgoing_utterances(lambda a: intent in a.intents, age_limit)
+                assert context.has_incoming_intent(intent, age_limit) == bool(scanned_in)
+                assert context.has_outgoing_intent(intent, age_limit) == bool(scanned_out)
+                assert context.count_outgoing_intent(intent, age_limit) == len(scanned_out)
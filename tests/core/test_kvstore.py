@@ -0,0 +1,99 @@
+import pickle
+from collections import Counter
+
+from core.kvstore import RedisHashStore
+from core.serialization import CompactCodec
+from core.writebehind import WriteBehindFlusher
+from tests.core.memoryredis import MemoryRedis
+
+
+def written_fields(redis, key='1:kv_store'):
+    return {pickle.loads(f): pickle.loads(v) for f, v in redis.data.get(key, {}).items()}
+
+
+def test_writes_only_changed_fields():
+    redis = MemoryRedis()
+    flusher = WriteBehindFlusher(redis)
+    store = RedisHashStore(redis, '1:kv_store')
+
+    store['used_templates'] = Counter(hello=3)
+    store['progress'] = {'claim': {'answered': 1}}
+    flusher.mark_dirty(store)
+    assert written_fields(redis) == dict(used_templates=Counter(hello=3), progress={'claim': {'answered': 1}})
+
+    redis.data['1:kv_store'].clear()
+    store['name'] = "Max"
+    store['progress']['claim']['answered'] = 2
+    flusher.mark_dirty(store)
+    # Neither the counter nor the whole dictionary is written again
+    assert written_fields(redis) == dict(name="Max", progress={'claim': {'answered': 2}})
+
+    flusher.mark_dirty(store)
+    assert redis.executed[-1] == []
+
+
+def test_reads_fields_lazily_and_caches_them():
+    redis = MemoryRedis()
+    redis.data['1:kv_store'] = {pickle.dumps('name'): pickle.dumps("Max"), pickle.dumps('age'): pickle.dumps(30)}
+    store = RedisHashStore(redis, '1:kv_store')
+
+    assert store['name'] == "Max"
+    assert store['name'] == "Max"
+    assert store.get('missing') is None
+    assert store.get('missing') is None
+    assert store.fetches == 2
+
+    assert dict(store) == dict(name="Max", age=30)
+    assert store.get('other') is None
+    assert store.fetches == 3
+
+
+def test_deletes_and_clears():
+    redis = MemoryRedis()
+    flusher = WriteBehindFlusher(redis)
+    store = RedisHashStore(redis, '1:kv_store')
+    store['a'], store['b'] = 1, 2
+    flusher.mark_dirty(store)
+
+    del store['a']
+    flusher.mark_dirty(store)
+    assert written_fields(redis) == dict(b=2)
+
+    store.clear()
+    store['c'] = 3
+    flusher.mark_dirty(store)
+    assert written_fields(redis) == dict(c=3)
+    assert dict(RedisHashStore(redis, '1:kv_store')) == dict(c=3)
+
+
+class CountingCodec(CompactCodec):
+    def __init__(self):
+        super().__init__()
+        self.encoded = []
+
+    def dumps(self, obj) -> bytes:
+        self.encoded.append(obj)
+        return super().dumps(obj)
+
+
+def test_encodes_only_accessed_values():
+    redis = MemoryRedis()
+    flusher = WriteBehindFlusher(redis)
+    codec = CountingCodec()
+    store = RedisHashStore(redis, '1:kv_store', codec=codec)
+    store['used_templates'] = Counter(hello=3)
+    store['name'] = "Max"
+    flusher.mark_dirty(store)
+    assert not store.has_changes
+
+    codec.encoded.clear()
+    store['age'] = 30
+    assert store['name'] == "Max"
+    flusher.mark_dirty(store)
+    assert codec.encoded == [30]
+    assert not store.has_changes
+
+    store['used_templates'].update(['bye'])
+    assert store.has_changes
+    flusher.mark_dirty(store)
+    assert written_fields(redis)['used_templates'] == Counter(hello=3, bye=1)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from core.dispatcher import AsyncDispatcher
+from core.pipeline import StagedPipeline
+
+
+@pytest.fixture
+def pipeline():
+    p = StagedPipeline(nlu_workers=2, planning_workers=1, delivery_workers=2)
+    yield p
+    p.shutdown(wait=False)
+
+
+def test_steps_run_in_sequence(pipeline: StagedPipeline):
+    threads = []
+
+    def step(suffix):
+        def run(value):
+            threads.append(threading.current_thread().name)
+            return value + suffix
+        return run
+
+    turn = pipeline.run(
+        (pipeline.nlu, step("n")),
+        (pipeline.planning, step("p")),
+        (pipeline.delivery, step("d")),
+        value=""
+    )
+
+    assert turn.result(timeout=2) == "npd"
+    assert len(set(threads)) == 3
+    assert [s['completed'] for s in pipeline.stats().values()] == [1, 1, 1]
+
+
+def test_none_ends_the_turn_early(pipeline: StagedPipeline):
+    delivered = []
+    turn = pipeline.run((pipeline.planning, lambda v: None), (pipeline.delivery, delivered.append), value=1)
+
+    assert turn.result(timeout=2) is None
+    assert not delivered
+
+
+def test_errors_are_propagated(pipeline: StagedPipeline):
+    def fail(_):
+        raise ValueError()
+
+    turn = pipeline.run((pipeline.nlu, fail), value=1)
+    with pytest.raises(ValueError):
+        turn.result(timeout=2)
+    assert pipeline.nlu.stats()['failed'] == 1
+
+
+def test_slow_stage_does_not_block_other_stages(pipeline: StagedPipeline):
+    slow = pipeline.run((pipeline.delivery, lambda v: time.sleep(0.3) or v), value=1)
+    fast = pipeline.run((pipeline.planning, lambda v: v + 1), value=1)
+
+    assert fast.result(timeout=0.2) == 2
+    assert not slow.done()
+    assert pipeline.delivery.stats()['active'] == 1
+
+
+def test_dispatcher_waits_for_returned_future(pipeline: StagedPipeline):
+    dispatcher = AsyncDispatcher(max_concurrency=2)
+    dispatcher.start()
+    results = []
+    done = threading.Event()
+
+    def deliver(i):
+        time.sleep(0.05 if i == 0 else 0)
+        results.append(i)
+
+    def turn(i):
+        return pipeline.run((pipeline.delivery, deliver), value=i)
+
+    dispatcher.submit('user', turn, 0)
+    dispatcher.submit('user', turn, 1)
+    dispatcher.submit('user', done.set)
+
+    assert done.wait(2)
+    assert results == [0, 1]
+    dispatcher.stop(timeout=2)
@@ -0,0 +1,74 @@
+import pickle
+
+from core import ChatAction, MessageUnderstanding
+from core.context import States
+from core.dialogstates import _StateLifetime
+from core.serialization import CompactCodec, decode_date, encode_date
+from model import User
+
+
+def make_user():
+    user = User(insurance_id=1234)
+    user.save()
+    return user
+
+
+def test_understanding_round_trip():
+    codec = CompactCodec()
+    u = MessageUnderstanding("am 12. März", 'date', parameters={'date': ['2018-03-12']},
+                             contexts=[{'name': 'claim', 'lifespan': 2}], score=0.87)
+
+    restored = codec.loads(codec.dumps(u))
+
+    assert vars(restored) == dict(vars(u), _extractions={})
+
+
+def test_action_stores_the_user_by_id():
+    user = make_user()
+    action = ChatAction(ChatAction.Type.ASKING_QUESTION, peer=user, text="Ist das korrekt?",
+                        intents=['is_that_correct'], choices=["Ja", "Nein"], choice_intents={"Ja": 'yes'},
+                        delay=ChatAction.Delay.LONG)
+
+    data = CompactCodec(user).dumps(action)
+    assert str(user.id).encode() in data and len(data) < len(pickle.dumps(action)) / 3
+
+    restored = CompactCodec(user).loads(data)
+    assert restored.peer is user
+    assert vars(restored) == vars(action)
+    assert CompactCodec().loads(data).peer == user
+
+
+def test_states_keep_tuples_and_enums():
+    codec = CompactCodec()
+
+    for state in (States.SMALLTALK, ('asking', 'damage', 'phone'), 'stateless'):
+        restored = codec.loads(codec.dumps(_StateLifetime(state, 3)))
+        assert restored.state == state and type(restored.state) is type(state)
+        assert restored.lifetime == 3
+
+
+def test_reads_pickles_and_pickles_unknown_types():
+    codec = CompactCodec()
+    u = MessageUnderstanding("hallo", 'hello')
+
+    assert codec.loads(pickle.dumps(u)).text == "hallo"
+    assert codec.loads(codec.dumps({1, 2})) == {1, 2}
+
+
+def test_rewrites_actions_pickled_before_choice_intents():
+    user = make_user()
+    action = ChatAction(ChatAction.Type.SAYING, peer=user, text="Hallo", intents=['hello'])
+    del action.choice_intents
+    codec = CompactCodec(user)
+
+    legacy = codec.loads(pickle.dumps(action))
+    restored = codec.loads(codec.dumps(legacy))
+
+    assert legacy.choice_intents == {} and restored.choice_intents == {}
+    assert str(restored) == "Hallo" and restored.intents == ['hello']
+
+
+def test_dates_are_exact():
+    date = decode_date(1520000000123456)
+    assert decode_date(encode_date(date)) == date
+    assert encode_date(None) is None
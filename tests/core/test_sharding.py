@@ -0,0 +1,130 @@
+import multiprocessing
+import queue
+from collections import Counter
+from functools import partial
+
+import pytest
+
+import settings
+from bot import main, serve_shard
+from clients.facebook import FacebookClient
+from clients.telegram import TelegramClient
+from core.sharding import ConsistentHashRing, ShardRouter
+
+KEYS = [f"telegram:{i}" for i in range(2000)]
+
+
+def test_keys_are_routed_consistently():
+    ring = ConsistentHashRing(range(4))
+    assert [ring.get_node(k) for k in KEYS] == [ConsistentHashRing(range(4)).get_node(k) for k in KEYS]
+
+    distribution = Counter(ring.get_node(k) for k in KEYS)
+    assert set(distribution) == {0, 1, 2, 3}
+    assert min(distribution.values()) > len(KEYS) / 4 * 0.5
+
+
+def test_adding_a_node_moves_few_keys():
+    ring = ConsistentHashRing(range(4))
+    before = {k: ring.get_node(k) for k in KEYS}
+    ring.add_node(4)
+    moved = [k for k in KEYS if ring.get_node(k) != before[k]]
+
+    assert all(ring.get_node(k) == 4 for k in moved)
+    assert len(moved) < len(KEYS) / 3
+
+
+def test_telegram_shard_key():
+    data = {'update_id': 1, 'message': {'message_id': 5, 'from': {'id': 1234}, 'chat': {'id': 1234}}}
+    assert TelegramClient.get_shard_key(data) == "telegram:1234"
+
+    data = {'update_id': 2, 'callback_query': {'id': 'x', 'from': {'id': 99}}}
+    assert TelegramClient.get_shard_key(data) == "telegram:99"
+
+
+def test_facebook_batches_are_split_by_sender():
+    data = {
+        'object': 'page',
+        'entry': [
+            {'id': 'page', 'messaging': [
+                {'sender': {'id': 'a'}, 'message': {'text': '1'}},
+                {'sender': {'id': 'b'}, 'message': {'text': '2'}},
+            ]},
+            {'id': 'page', 'messaging': [{'sender': {'id': 'a'}, 'message': {'text': '3'}}]},
+        ]
+    }
+    result = FacebookClient.split_webhook_data(data)
+
+    assert [k for k, _ in result] == ["facebook:a", "facebook:b", "facebook:a"]
+    for _, payload in result:
+        assert payload['object'] == 'page'
+        assert len(payload['entry']) == 1
+        assert len(payload['entry'][0]['messaging']) == 1
+    assert result[2][1]['entry'][0]['messaging'][0]['message']['text'] == '3'
+
+
+def _collect(results, shard_index, items):
+    processed = []
+    while True:
+        item = items.get()
+        if item is None:
+            break
+        processed.append(item)
+    results.put((shard_index, processed))
+
+
+def test_stopping_waits_for_the_routed_items():
+    results = multiprocessing.Queue()
+    router = ShardRouter(2, partial(_collect, results))
+    router.start()
+    for i in range(20):
+        router.route(f"telegram:{i}", i)
+
+    assert router.stop(timeout=10)
+    assert router.stop(timeout=10)
+
+    processed = dict(results.get(timeout=1) for _ in range(2))
+    assert sorted(processed[0] + processed[1]) == list(range(20))
+    assert processed[router.shard_for("telegram:3")].count(3) == 1
+
+
+class FakeClient:
+    client_name = 'telegram'
+
+    def __init__(self):
+        self.received = []
+
+    def process_webhook_data(self, data):
+        if data == 'broken':
+            raise ValueError()
+        self.received.append(data)
+
+
+class FakeDialogManager:
+    def __init__(self):
+        self.bots = [FakeClient()]
+        self.drained = None
+
+    def drain(self, timeout):
+        self.drained = list(self.bots[0].received)
+
+
+def test_shard_is_drained_after_the_last_update():
+    items = queue.Queue()
+    for data in ('a', 'broken', 'b', None):
+        items.put(None if data is None else ('telegram', data))
+    dialog_manager = FakeDialogManager()
+
+    serve_shard(0, items, dialog_manager)
+
+    assert dialog_manager.drained == ['a', 'b']
+
+
+def test_several_web_workers_require_sharding(monkeypatch):
+    monkeypatch.setattr(settings, 'DEBUG_MODE', False)
+    monkeypatch.setattr(settings, 'SHARD_WORKERS', 0)
+    monkeypatch.setattr(settings, 'PREFORK_SERVER', True)
+    monkeypatch.setattr(settings, 'WEB_WORKERS', 2)
+
+    with pytest.raises(ValueError):
+        main()
+
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from core.turngate import TurnGate
+
+
+def test_exclusive_waits_for_running_turns():
+    gate = TurnGate()
+    events = []
+    in_turn = threading.Event()
+
+    def turn():
+        with gate.turn():
+            in_turn.set()
+            time.sleep(0.1)
+            events.append('turn')
+
+    def swap():
+        with gate.exclusive():
+            events.append('swap')
+
+    t = threading.Thread(target=turn)
+    t.start()
+    in_turn.wait(1)
+    s = threading.Thread(target=swap)
+    s.start()
+
+    t.join(2)
+    s.join(2)
+    assert events == ['turn', 'swap']
+
+
+def test_new_turns_wait_for_pending_exclusive():
+    gate = TurnGate()
+    events = []
+    in_turn = threading.Event()
+    release = threading.Event()
+
+    def first_turn():
+        with gate.turn():
+            in_turn.set()
+            release.wait(1)
+            events.append('first')
+
+    def swap():
+        with gate.exclusive():
+            events.append('swap')
+
+    def second_turn():
+        with gate.turn():
+            events.append('second')
+
+    threads = [threading.Thread(target=first_turn)]
+    threads[0].start()
+    in_turn.wait(1)
+    threads.append(threading.Thread(target=swap))
+    threads[1].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=second_turn))
+    threads[2].start()
+    time.sleep(0.05)
+    release.set()
+
+    for t in threads:
+        t.join(2)
+    assert events == ['first', 'swap', 'second']
+    assert gate.turns == 0
@@ -0,0 +1,100 @@
+import pickle
+import threading
+
+import pytest
+from redis_collections import SyncableDeque, SyncableDict, SyncableList
+
+from core.timers import TimerQueue
+from core.writebehind import WriteBehindFlusher
+from tests.core.memoryredis import MemoryRedis
+
+
+@pytest.fixture
+def timers():
+    t = TimerQueue(workers=2)
+    t.start()
+    yield t
+    t.stop(timeout=2)
+
+
+def test_changes_are_written_in_one_pipeline():
+    redis = MemoryRedis()
+    # The timers are not started, so only `flush` writes
+    flusher = WriteBehindFlusher(redis, TimerQueue())
+    values = SyncableDict(redis=redis, writeback=True, key='1:kv_store')
+    utterances = SyncableDeque(maxlen=5, redis=redis, key='1:utterances')
+
+    values['name'] = 'Max'
+    flusher.mark_dirty(values)
+    utterances.appendleft('hallo')
+    flusher.mark_dirty(utterances)
+    values['age'] = 30
+    flusher.mark_dirty(values)
+    assert redis.executed == []
+
+    assert flusher.flush() == 2
+    commands, = redis.executed
+    assert [c[:2] for c in commands] == [
+        ('delete', '1:kv_store'), ('hmset', '1:kv_store'), ('delete', '1:utterances'), ('rpush', '1:utterances')
+    ]
+    assert {pickle.loads(k): pickle.loads(v) for k, v in commands[1][2].items()} == dict(name='Max', age=30)
+    assert pickle.loads(commands[3][2]) == 'hallo'
+    assert flusher.stats()['coalesced'] == 1
+    assert flusher.flush() == 0
+
+
+def test_writes_right_away_without_timers():
+    redis = MemoryRedis()
+    flusher = WriteBehindFlusher(redis)
+    states = SyncableList(redis=redis, key='1:ds')
+
+    flusher.mark_dirty(states)
+
+    assert redis.executed == [[('delete', '1:ds')]]
+
+
+def test_flushes_after_interval_and_at_batch_size(timers):
+    redis = MemoryRedis(expected=1)
+    flusher = WriteBehindFlusher(redis, timers, interval=0.5, max_pending=3)
+
+    for key in 'abc':
+        flusher.mark_dirty(SyncableList(redis=redis, key=key))
+    # The batch is full and written long before the interval has passed
+    assert redis.done.wait(0.3)
+
+    redis.expected, redis.done = 2, threading.Event()
+    flusher.mark_dirty(SyncableList(redis=redis, key='d'))
+    assert flusher.pending == 1
+    assert redis.done.wait(2)
+    assert [len(commands) for commands in redis.executed] == [3, 1]
+
+
+def test_failed_flush_is_retried():
+    redis = MemoryRedis()
+    flusher = WriteBehindFlusher(redis, timers=None)
+    redis.fail = True
+
+    flusher.mark_dirty(SyncableList(redis=redis, key='a'))
+    assert flusher.pending == 1
+
+    redis.fail = False
+    assert flusher.flush() == 1
+    assert flusher.stats()['errors'] == 1
+
+
+def test_collection_that_cannot_be_encoded_is_retried_alone():
+    redis = MemoryRedis()
+    flusher = WriteBehindFlusher(redis, TimerQueue())
+    broken = SyncableList(redis=redis, key='a:ds')
+    broken.append(lambda: None)
+    flusher.mark_dirty(broken)
+    flusher.mark_dirty(SyncableList(redis=redis, key='b:ds'))
+
+    assert flusher.flush() == 1
+    assert redis.executed == [[('delete', 'b:ds')]]
+    assert flusher.is_pending('a:ds') and not flusher.is_pending('b:ds')
+    assert flusher.stats()['errors'] == 1
+
+    broken.clear()
+    assert flusher.flush() == 1
+    assert not flusher.is_pending('a:ds')
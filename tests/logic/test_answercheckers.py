@@ -4,6 +4,7 @@ import pytest
 
 from core import Context, MessageUnderstanding
 from corpus.responsetemplates import SelectiveTemplateLoader, TemplateRenderer
+from logic.extraction import parse_names
 from logic.responsecomposer import ResponseComposer
 from logic.rules import answercheckers as ans
 from model import User
@@ -11,26 +12,26 @@ from model import User
 
 def test__parse_name():
     n = "jan Van der linden"
-    res = ans._parse_names(n)
+    res = parse_names(n)
     assert res.first_name == "Jan"
     assert res.last_name == "Van der Linden"
 
     n = "van der linden, Jan"
-    res = ans._parse_names(n)
+    res = parse_names(n)
     assert res.first_name == "Jan"
     assert res.last_name == "van der Linden"
 
     n = "max mustermann"
-    res = ans._parse_names(n)
+    res = parse_names(n)
     assert res.first_name == "Max"
     assert res.last_name == "Mustermann"
 
     n = "mustermann, max"
-    res = ans._parse_names(n)
+    res = parse_names(n)
     assert res.first_name == "Max"
     assert res.last_name == "Mustermann"
 
-    assert ans._parse_names("was meinst du damit genau?") is None
+    assert parse_names("was meinst du damit genau?") is None
 
 
 @pytest.fixture()
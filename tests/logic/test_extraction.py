@@ -0,0 +1,38 @@
+import pickle
+
+from core.understanding import MessageUnderstanding
+from logic import extraction
+from logic.extraction import FirstLastName
+
+
+def test_parser_runs_once_per_utterance():
+    calls = []
+
+    def parser(text):
+        calls.append(text)
+        return text.upper()
+
+    u = MessageUnderstanding("hallo", intent='smalltalk')
+
+    assert u.extract('upper', parser) == "HALLO"
+    assert u.extract('upper', parser) == "HALLO"
+    assert calls == ["hallo"]
+
+    u.clear_extractions()
+    u.extract('upper', parser)
+    assert len(calls) == 2
+
+
+def test_extractions_are_not_pickled():
+    u = MessageUnderstanding("Max Mustermann", intent='name')
+    assert extraction.extract(u, 'names') == FirstLastName("Max", "Mustermann")
+
+    restored = pickle.loads(pickle.dumps(u))
+
+    assert '_extractions' not in restored.__dict__
+    assert extraction.extract(restored, 'names') == FirstLastName("Max", "Mustermann")
+
+
+def test_extract_without_text():
+    assert extraction.extract(None, 'date') is None
+    assert extraction.extract(MessageUnderstanding(None, intent='media'), 'names') is None
@@ -0,0 +1,39 @@
+import datetime
+
+import pytest
+
+from logic.germandates import parse_german_date
+
+# A Wednesday
+NOW = datetime.datetime(2018, 3, 14, 10, 20, 30)
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("gestern um 14 Uhr", datetime.datetime(2018, 3, 13, 14, 0)),
+    ("12.03.2018 15:30", datetime.datetime(2018, 3, 12, 15, 30)),
+    ("12.3.18, 9.15 Uhr", datetime.datetime(2018, 3, 12, 9, 15)),
+    ("am 12. März", datetime.datetime(2018, 3, 12)),
+    ("heute morgen", datetime.datetime(2018, 3, 14, 8, 0)),
+    ("heute", NOW),
+    ("morgen früh", datetime.datetime(2018, 3, 15, 8, 0)),
+    ("Montag", datetime.datetime(2018, 3, 12)),
+    ("Mittwoch", datetime.datetime(2018, 3, 7)),
+    ("letzten Montag abend", datetime.datetime(2018, 3, 12, 19, 0)),
+    ("gestern abend um 8 Uhr", datetime.datetime(2018, 3, 13, 20, 0)),
+    ("vorgestern gegen 14 Uhr 30", datetime.datetime(2018, 3, 12, 14, 30)),
+    ("14:30", datetime.datetime(2018, 3, 14, 14, 30)),
+])
+def test_common_formats(text, expected):
+    assert parse_german_date(text, NOW) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "vor zwei Tagen",
+    "31.02.2018",
+    "25:00 Uhr",
+    "gestern und heute",
+    "hallo",
+    "",
+])
+def test_unknown_formats_are_left_to_dateparser(text):
+    assert parse_german_date(text, NOW) is None
@@ -0,0 +1,79 @@
+import io
+
+import corpus
+from core import ContextManager, MessageUnderstanding, States
+from core.turngate import TurnGate
+from corpus import questions, responsetemplates
+from corpus.responsetemplates import get_templates_by_id
+from logic import rules
+from logic.hotreload import HotReloader
+from logic.planning import PlanningAgent
+from logic.rules import smalltalkhandlers
+from logic.rules.dialogcontroller import application_router
+from model import Update, User
+
+
+def test_reload_swaps_in_place(monkeypatch):
+    load_raw_templates = corpus.load_raw_templates
+
+    def load_with_new_template():
+        raw = load_raw_templates()
+        raw['hot_reload_test'] = "Neu geladen"
+        return raw
+
+    monkeypatch.setattr(corpus, 'load_raw_templates', load_with_new_template)
+
+    templates = responsetemplates.all_response_templates
+    questionnaires = questions.all_questionnaires
+    num_stateless = len(application_router.stateless)
+
+    reloader = HotReloader(application_router, TurnGate())
+    assert reloader.reload()
+
+    assert responsetemplates.all_response_templates is templates
+    assert get_templates_by_id('hot_reload_test').original_text == "Neu geladen"
+    assert questions.all_questionnaires is questionnaires
+    assert [q.id for q in questions.all_questionnaires] == [q.id for q in questionnaires]
+    assert len(application_router.stateless) == num_stateless
+    assert reloader.stats()['reloads'] == 1
+
+
+def test_failed_reload_keeps_old_corpus(monkeypatch):
+    def fail():
+        raise ValueError("broken yaml")
+
+    monkeypatch.setattr(corpus, 'load_raw_templates', fail)
+    num_templates = len(responsetemplates.all_response_templates)
+
+    reloader = HotReloader(application_router, TurnGate())
+    assert not reloader.reload()
+    assert len(responsetemplates.all_response_templates) == num_templates
+    assert 'broken yaml' in reloader.stats()['last_error']
+
+
+def test_reload_replaces_the_fallback_handlers_of_the_planning_agent(tmpdir, monkeypatch):
+    # An edited copy of the module is found before the original
+    source = io.open(smalltalkhandlers.__file__, encoding='utf-8').read()
+    signature = "def no_rule_found(r, c):\n"
+    edited = source.replace(signature, signature + "    c['hot_reloaded'] = True\n")
+    tmpdir.join('smalltalkhandlers.py').write_text(edited, encoding='utf-8')
+    monkeypatch.setattr(rules, '__path__', [str(tmpdir)] + list(rules.__path__))
+
+    reloader = HotReloader(application_router, TurnGate())
+    try:
+        assert reloader.reload()
+
+        user = User(insurance_id=1234)
+        user.save()
+        update = Update()
+        update.user = user
+        update.message_text = "Wie hoch ist der Eiffelturm?"
+        update.understanding = MessageUnderstanding(update.message_text, 'hot_reload_unknown_intent')
+        context = ContextManager(States.SMALLTALK).add_incoming_update(update)
+        PlanningAgent(application_router).build_next_actions(context)
+
+        assert context.get('hot_reloaded')
+    finally:
+        monkeypatch.undo()
+        assert reloader.reload()
+    assert not smalltalkhandlers.__file__.startswith(str(tmpdir))
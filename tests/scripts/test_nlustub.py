@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from clients.nluclients import DialogflowClient
+from scripts.nlustub import StubRules, create_app, parse_latency
+
+RULES = StubRules(
+    recorded={'du bist also kein mensch': ('smalltalk.agent.chatbot', {})},
+    rules=[dict(match=r'(handy|smartphone).*kaputt', intent='phone_broken', parameters={'device': 'Handy'}, score=0.8)]
+)
+
+
+def serve(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def stub():
+    server = serve(create_app(RULES))
+    yield DialogflowClient('token', base_url=f'http://127.0.0.1:{server.server_port}/v1/')
+    server.shutdown()
+
+
+def test_answers_like_dialogflow(stub: DialogflowClient):
+    understanding = stub.understand("Du bist also kein Mensch?", 1)
+    assert understanding.intent == 'smalltalk.agent.chatbot'
+    assert understanding.score == 1.0
+
+    understanding = stub.understand("Mein Handy ist kaputt", 1)
+    assert understanding.intent == 'phone_broken'
+    assert understanding.parameters == {'device': 'Handy'}
+    assert understanding.score == 0.8
+
+    assert stub.understand("Wie ist das Wetter?", 1).intent == 'fallback'
+
+
+def test_error_injection():
+    client = create_app(RULES, error_rate=1.0).test_client()
+    response = client.post('/v1/query', data='{"query": "ja"}')
+    assert response.status_code == 500
+
+
+def test_latency_distributions():
+    assert parse_latency('fixed:250')() == 0.25
+    assert 0.05 <= parse_latency('uniform:50:100')() <= 0.1
+    assert parse_latency('lognormal:200:0.5')() > 0
+    with pytest.raises(ValueError):
+        parse_latency('uniform:50')